@@ -0,0 +1,311 @@
+"""
+Columnar analytics over the lesson history of a stats database.
+
+Lessons and key presses are loaded with one bulk fetch each into NumPy arrays,
+and per-lesson statistics and time-decayed averages are computed with
+vectorized and segmented reductions instead of per-lesson Python loops.
+"""
+
+import math
+import sqlite3
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+import numpy as np
+
+from tutor import ONE_WEEK
+
+
+@dataclass(frozen=True)
+class LessonHistory:
+    """
+    Per-lesson statistics as parallel columns, ordered by timestamp. Lessons in
+    which nothing was typed are left out; undefined arrhythmicity is NaN.
+    """
+
+    lesson_ids: np.ndarray
+    timestamps: np.ndarray
+    cps: np.ndarray
+    accuracy: np.ndarray
+    arrhythmicity: np.ndarray
+    keystrokes: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.lesson_ids)
+
+
+def decode_varints(data: np.ndarray) -> np.ndarray:
+    """
+    Decodes a uint8 buffer of concatenated zigzag varints, as written by
+    tutor.KeyPressLog.encode, into int64 values.
+    """
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.r_[0, ends[:-1] + 1]
+    # Byte k of a varint holds bits 7k to 7k + 6
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+    payload = (data & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+    zigzag = np.bitwise_or.reduceat(payload, starts)
+    return (zigzag >> np.uint64(1)).astype(np.int64) ^ -(zigzag & np.uint64(1)).astype(
+        np.int64
+    )
+
+
+def load_key_presses(conn: sqlite3.Connection) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the (lesson_id, timestamp_ns) columns of all key presses in lesson
+    order, decoding the packed lesson_key_presses BLOBs in one pass.
+    """
+    rows = conn.execute(
+        "SELECT lesson_id, keystrokes, data FROM lesson_key_presses ORDER BY lesson_id"
+    ).fetchall()
+    lesson_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    keystrokes = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    values = decode_varints(np.frombuffer(b"".join(row[2] for row in rows), np.uint8))
+
+    # Each BLOB holds its char index deltas, then its timestamp deltas
+    value_counts = 2 * keystrokes
+    value_offsets = np.cumsum(value_counts) - value_counts
+    position = np.arange(len(values)) - np.repeat(value_offsets, value_counts)
+    deltas = values[position >= np.repeat(keystrokes, value_counts)]
+
+    # Every lesson's deltas start from 0: taking the previous lesson's last
+    # timestamp off its first delta lets one cumsum rebuild all of them
+    nonempty = keystrokes[keystrokes > 0]
+    starts = np.cumsum(nonempty) - nonempty
+    if len(deltas):
+        deltas[starts[1:]] -= np.add.reduceat(deltas, starts)[:-1]
+    return np.repeat(lesson_ids, keystrokes), np.cumsum(deltas)
+
+
+def interval_stats(
+    lesson_ids: np.ndarray, timestamps_ns: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Computes the statistics of the intervals between consecutive key presses of
+    each lesson, given key presses sorted by lesson and timestamp.
+
+    Returns:
+        (lesson_ids, keystrokes, stddev): the distinct lessons, their number of
+        key presses and the standard deviation of their intervals in seconds
+        (DDoF=1, NaN with fewer than 2 intervals).
+    """
+    if len(lesson_ids) == 0:
+        return lesson_ids, np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    starts = np.flatnonzero(np.r_[True, lesson_ids[1:] != lesson_ids[:-1]])
+    lengths = np.diff(np.r_[starts, len(lesson_ids)])
+    counts = lengths - 1
+
+    # The interval after the last key press of a lesson belongs to no lesson; a
+    # trailing zero gives every segment, the last one included, a slot for it.
+    intervals = np.append(np.diff(timestamps_ns) / 1e9, 0.0)
+    intervals[starts[1:] - 1] = 0.0
+    intervals[-1] = 0.0
+    inside = np.ones(len(intervals), dtype=bool)
+    inside[starts[1:] - 1] = False
+    inside[-1] = False
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.add.reduceat(intervals, starts) / counts
+        deviations = np.where(inside, intervals - np.repeat(means, lengths), 0.0)
+        m2 = np.add.reduceat(deviations * deviations, starts)
+        stddev = np.where(counts >= 2, np.sqrt(m2 / (counts - 1)), np.nan)
+    return lesson_ids[starts], lengths, stddev
+
+
+def _code_points(texts: Sequence[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Concatenates `texts` into one code point array; returns it and the offsets."""
+    lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32), offsets
+
+
+def replay_typed_texts(
+    texts_required: Sequence[str], texts_typed: Sequence[str]
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Batch version of tutor.replay_typed_text: replays every typed text, with its
+    backspaces, against its required text in a few vectorized passes over all of
+    them at once.
+
+    Returns:
+        (mistakes, total_typed, final_length) arrays with one entry per lesson.
+    """
+    lessons = len(texts_typed)
+    required, required_offsets = _code_points(texts_required)
+    typed, typed_offsets = _code_points(texts_typed)
+    lengths = np.diff(typed_offsets)
+    nonempty = lengths > 0
+    starts = typed_offsets[:-1][nonempty]
+    mistakes = np.zeros(lessons, dtype=np.int64)
+    total_typed = np.zeros(lessons, dtype=np.int64)
+    final_length = np.zeros(lessons, dtype=np.int64)
+    if not len(starts):
+        return mistakes, total_typed, final_length
+
+    # The text length after each key is a walk of +1/-1 steps. Taking the total
+    # of the previous lesson off its first step restarts the walk at every
+    # lesson, so one cumsum serves all of them.
+    is_backspace = typed == ord("\b")
+    steps = is_backspace.astype(np.int64)
+    steps *= -2
+    steps += 1
+    totals = np.add.reduceat(steps, starts)
+    steps[starts[1:]] -= totals[:-1]
+    length = np.cumsum(steps)
+    # Backspacing an empty text does nothing, so the walk is floored at 0: it is
+    # the running sum minus its running minimum, when negative. The running
+    # minimum must restart with every lesson too; shifting each lesson down by
+    # more than any walk can span keeps earlier lessons out of it.
+    if length.min() < 0:
+        span = 2 * (int(lengths.max()) + 1)
+        shift = np.repeat(np.arange(lessons, dtype=np.int64) * span, lengths)
+        running_min = length - shift
+        np.minimum.accumulate(running_min, out=running_min)
+        running_min += shift
+        np.minimum(running_min, 0, out=running_min)
+        length -= running_min
+
+    # A typed character lands at the length before it. Each required text is
+    # followed by a sentinel that characters typed past its end are clamped to
+    # and which is never counted as a mistake.
+    sentinel = np.uint32(0xFFFFFFFF)
+    padded_offsets = required_offsets[:-1] + np.arange(lessons)
+    padded = np.full(len(required) + lessons, sentinel, dtype=np.uint32)
+    is_text = np.ones(len(padded), dtype=bool)
+    is_text[required_offsets[1:] + np.arange(lessons)] = False
+    padded[is_text] = required
+    index = length - 1
+    index += np.repeat(padded_offsets, lengths)
+    np.minimum(
+        index,
+        np.repeat(padded_offsets + np.diff(required_offsets), lengths),
+        out=index,
+    )
+    expected = padded[index]
+    wrong = typed != expected
+    wrong &= expected != sentinel
+    wrong &= ~is_backspace
+
+    mistakes[nonempty] = np.add.reduceat(wrong, starts)
+    total_typed[nonempty] = lengths[nonempty] - np.add.reduceat(is_backspace, starts)
+    final_length[nonempty] = length[typed_offsets[1:][nonempty] - 1]
+    return mistakes, total_typed, final_length
+
+
+def load_lesson_history(
+    conn: sqlite3.Connection, since: float | None = None
+) -> LessonHistory:
+    """
+    Computes the statistics of every recorded lesson (or of those recorded at
+    or after `since`) from their typed text and key presses.
+    """
+    rows = conn.execute(
+        "SELECT id, timestamp, text_required, text_typed, duration FROM lessons WHERE duration IS NOT NULL AND timestamp >= ? ORDER BY timestamp",
+        (since if since is not None else -math.inf,),
+    ).fetchall()
+    lesson_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    timestamps = np.fromiter(
+        (row[1] for row in rows), dtype=np.float64, count=len(rows)
+    )
+    durations = np.fromiter((row[4] for row in rows), dtype=np.float64, count=len(rows))
+    mistakes, total_typed, final_length = replay_typed_texts(
+        [row[2] for row in rows], [row[3] for row in rows]
+    )
+
+    kp_lesson_ids, kp_keystrokes, stddev = interval_stats(*load_key_presses(conn))
+    # Key press statistics of each lesson, if it has any
+    position = np.searchsorted(kp_lesson_ids, lesson_ids)
+    found = position < len(kp_lesson_ids)
+    found[found] = kp_lesson_ids[position[found]] == lesson_ids[found]
+    arrhythmicity = np.full(len(lesson_ids), np.nan)
+    arrhythmicity[found] = stddev[position[found]]
+    keystrokes = np.zeros(len(lesson_ids), dtype=np.int64)
+    keystrokes[found] = kp_keystrokes[position[found]]
+
+    typed = total_typed > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cps = np.where(durations > 0, final_length / durations, 0.0)
+        accuracy = (total_typed - mistakes) / total_typed * 100
+    return LessonHistory(
+        lesson_ids=lesson_ids[typed],
+        timestamps=timestamps[typed],
+        cps=cps[typed],
+        accuracy=accuracy[typed],
+        arrhythmicity=arrhythmicity[typed],
+        keystrokes=keystrokes[typed],
+    )
+
+
+def load_lesson_stats(conn: sqlite3.Connection) -> LessonHistory:
+    """
+    Loads the per-lesson summaries StatsManager keeps in lesson_stats. Unlike
+    load_lesson_history this also covers lessons whose key presses were
+    compacted away.
+    """
+    rows = np.fromiter(
+        conn.execute(
+            "SELECT lesson_id, timestamp, cps, accuracy, arrhythmicity, keystrokes FROM lesson_stats ORDER BY timestamp"
+        ),
+        dtype=[
+            ("lesson_id", np.int64),
+            ("timestamp", np.float64),
+            ("cps", np.float64),
+            ("accuracy", np.float64),
+            ("arrhythmicity", np.float64),
+            ("keystrokes", np.int64),
+        ],
+    )
+    return LessonHistory(
+        lesson_ids=rows["lesson_id"],
+        timestamps=rows["timestamp"],
+        cps=rows["cps"],
+        accuracy=rows["accuracy"],
+        arrhythmicity=rows["arrhythmicity"],
+        keystrokes=rows["keystrokes"],
+    )
+
+
+def decay_weights(timestamps: np.ndarray, epoch: float) -> np.ndarray:
+    """The EMA weight exp((t - epoch) / week) of each timestamp."""
+    return np.exp((timestamps - epoch) / ONE_WEEK)
+
+
+def running_decayed_means(
+    timestamps: np.ndarray, values: np.ndarray, now: float
+) -> np.ndarray:
+    """
+    Time-decayed average of `values` over every prefix of the series, as the
+    tutor's EMA would have shown it after each entry. NaN values are skipped and
+    give NaN where no value has been seen yet.
+    """
+    valid = ~np.isnan(values)
+    weights = np.where(valid, decay_weights(timestamps, now), 0.0)
+    total_weight = np.cumsum(weights)
+    weighted = np.cumsum(np.where(valid, values, 0.0) * weights)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = weighted / total_weight
+    # Entries whose weights all underflowed fall back to their own value
+    return np.where(total_weight > 0, means, np.where(valid, values, np.nan))
+
+
+def ema_sums(
+    history: LessonHistory, epoch: float
+) -> tuple[float, float, float, float, float]:
+    """
+    The decayed sums the tutor keeps in ema_stats (see EMA_COLUMNS) for the
+    lessons of `history`, with weights relative to `epoch`.
+    """
+    weights = decay_weights(history.timestamps, epoch)
+    has_arrhythmicity = ~np.isnan(history.arrhythmicity)
+    arr_weights = np.where(has_arrhythmicity, weights, 0.0)
+    return (
+        float(weights.sum()),
+        float(history.cps @ weights),
+        float(history.accuracy @ weights),
+        float(arr_weights.sum()),
+        float(np.where(has_arrhythmicity, history.arrhythmicity, 0.0) @ arr_weights),
+    )
@@ -0,0 +1,22 @@
+-- Cluster key_presses on (lesson_id, timestamp) so that a lesson's key presses
+-- are read in order without a sort
+CREATE TABLE key_presses_clustered (
+    lesson_id INTEGER NOT NULL,
+    char_index INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL,
+    PRIMARY KEY (lesson_id, timestamp, char_index),
+    FOREIGN KEY (lesson_id) REFERENCES lessons (id)
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO key_presses_clustered (lesson_id, char_index, timestamp)
+SELECT lesson_id, char_index, timestamp FROM key_presses;
+
+DROP TABLE key_presses;
+ALTER TABLE key_presses_clustered RENAME TO key_presses;
+
+-- Recently typed words are looked up by timestamp
+CREATE INDEX IF NOT EXISTS idx_lesson_words_timestamp ON lesson_words (timestamp, word_id);
+
+-- Mistakes and lessons are read by time range or in time order
+CREATE INDEX IF NOT EXISTS idx_mistakes_timestamp ON mistakes (timestamp);
+CREATE INDEX IF NOT EXISTS idx_lessons_timestamp ON lessons (timestamp);
@@ -0,0 +1,13 @@
+"""
+Packs the one-row-per-key key_presses table into one delta/varint-encoded
+BLOB per lesson in lesson_key_presses, then drops it.
+"""
+
+import sqlite3
+
+from tutor import create_lesson_key_presses
+
+
+def migrate(conn: sqlite3.Connection) -> None:
+    create_lesson_key_presses(conn)
+    conn.execute("DROP TABLE IF EXISTS key_presses")
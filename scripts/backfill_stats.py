@@ -0,0 +1,29 @@
+"""Rebuilds the per-lesson summaries and EMA accumulator of a stats database.
+
+Usage: uv run scripts/backfill_stats.py [stats.db]
+"""
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tutor import STATS_DB, StatsManager
+
+
+def backfill_stats(db_path):
+    if not os.path.exists(db_path):
+        print(f"Error: Database file {db_path} not found.")
+        sys.exit(1)
+
+    stats = StatsManager(db_path)
+    try:
+        count = stats.backfill_lesson_stats()
+    finally:
+        stats.close()
+    print(f"Summarized {count} lessons.")
+
+
+if __name__ == "__main__":
+    backfill_stats(sys.argv[1] if len(sys.argv) > 1 else STATS_DB)
@@ -0,0 +1,768 @@
+"""Micro-benchmarks for the typing tutor's hot paths.
+
+Usage: uv run scripts/benchmark.py [name ...]
+Without arguments every benchmark is run.
+"""
+
+import contextlib
+import curses
+import io
+import itertools
+import os
+import random
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+from build_dictionary import build_dictionary
+from create_bigram_index import (
+    create_bigram_index,
+    refresh_bigram_index,
+    word_bigrams,
+)
+from dictionary_decompressor import decompress_dictionary, write_body_data
+from process_dictionary import (
+    parse_title,
+    parse_title_xml,
+    parse_titles,
+    process_dictionary,
+)
+
+from analytics import load_key_presses, load_lesson_history, replay_typed_texts
+from tutor import (
+    DICTIONARY_DB,
+    EXCLUDE_RECENT_MINUTES,
+    BigramIndex,
+    KeyPressLog,
+    LessonGenerator,
+    LessonRenderer,
+    LessonSession,
+    LessonSummary,
+    LessonWord,
+    StatsManager,
+    create_ascii_words,
+    replay_typed_text,
+)
+
+
+def calls_per_second(fn, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return calls / (time.perf_counter() - start)
+
+
+def report(name, baseline, optimized, unit="calls/s"):
+    print(
+        f"{name:<32} {baseline:>12,.0f} -> {optimized:>12,.0f} {unit}"
+        f"  ({optimized / baseline:.3g}x)"
+    )
+
+
+def bench_connections(calls=2000):
+    """Connect-per-call (the old StatsManager behaviour) vs the pooled connection."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "bench_stats.db")
+        stats = StatsManager(db_path)
+
+        def record_mistake_per_call():
+            with sqlite3.connect(db_path) as conn:
+                conn.execute(
+                    "INSERT INTO mistakes (word, char_index, typed_char, timestamp) VALUES (?, ?, ?, ?)",
+                    ("these", 1, "x", time.time()),
+                )
+                conn.commit()
+
+        def recently_typed_per_call():
+            cutoff = time.time() - (EXCLUDE_RECENT_MINUTES * 60)
+            with sqlite3.connect(db_path) as conn:
+                conn.execute(
+                    "SELECT word_id FROM lesson_words WHERE timestamp > ?", (cutoff,)
+                ).fetchall()
+
+        report(
+            "record_mistake",
+            calls_per_second(record_mistake_per_call, calls),
+            calls_per_second(lambda: stats.record_mistake("these", 1, "x"), calls),
+        )
+        report(
+            "get_recently_typed_ids",
+            calls_per_second(recently_typed_per_call, calls),
+            calls_per_second(stats.get_recently_typed_ids, calls),
+        )
+        stats.close()
+
+
+def bench_lesson_generation(calls=200):
+    """SQL sampling vs the in-memory bigram index, on the real dictionary."""
+    if not os.path.exists(DICTIONARY_DB):
+        print(f"Skipped: {DICTIONARY_DB} not found.")
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        stats = StatsManager(str(Path(tmp) / "bench_stats.db"))
+        for word in ("these", "quick", "rhythm", "zephyr", "bazaar"):
+            for i in range(len(word)):
+                stats.record_mistake(word, i, "x")
+
+        sql = LessonGenerator(stats)
+        memory = LessonGenerator(stats, use_memory_index=True)
+        memory.generate_lesson()  # load the index outside the timing
+        report(
+            "generate_lesson",
+            calls_per_second(sql.generate_lesson, calls),
+            calls_per_second(memory.generate_lesson, calls),
+        )
+        sql.close()
+        memory.close()
+        stats.close()
+
+
+class FakeScreen:
+    """Stands in for a curses window, counting what would be sent to the terminal."""
+
+    def __init__(self, height=40, width=120):
+        self.height = height
+        self.width = width
+        self.bytes_written = 0
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def erase(self):
+        self.bytes_written += self.height * self.width
+
+    def clrtoeol(self):
+        pass
+
+    def move(self, *_):
+        pass
+
+    def addstr(self, _y, _x, text, *_):
+        self.bytes_written += len(text.encode())
+
+    def addch(self, _y, _x, char, *_):
+        self.bytes_written += len(char.encode())
+
+    def refresh(self):
+        pass
+
+
+def random_lesson(words):
+    rng = random.Random(0)
+    return [
+        LessonWord(i, word, word, " ")
+        for i, word in enumerate(
+            "".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(3, 9)))
+            for _ in range(words)
+        )
+    ]
+
+
+def bench_rendering(words=200):
+    """Full erase-and-redraw per keystroke vs the damage-tracking renderer."""
+    curses.color_pair = lambda n: n << 8  # needs initscr() otherwise
+    lesson = random_lesson(words)
+    with tempfile.TemporaryDirectory() as tmp:
+        stats = StatsManager(str(Path(tmp) / "bench_stats.db"))
+
+        def type_lesson(full_repaint):
+            session = LessonSession(lesson, stats)
+            screen = FakeScreen()
+            renderer = LessonRenderer(screen)
+            start = time.perf_counter()
+            for char in session.full_text[:-1]:
+                if full_repaint:
+                    renderer.invalidate()
+                renderer.draw(session, f" {len(session.typed_text)} ")
+                session.handle_key(ord(char))
+            elapsed = time.perf_counter() - start
+            keystrokes = len(session.full_text) - 1
+            return screen.bytes_written / keystrokes, keystrokes / elapsed
+
+        full_bytes, full_rate = type_lesson(full_repaint=True)
+        incremental_bytes, incremental_rate = type_lesson(full_repaint=False)
+        report("bytes per keystroke", full_bytes, incremental_bytes, unit="B")
+        report("frames", full_rate, incremental_rate, unit="frames/s")
+        stats.close()
+
+
+class PerFrameLayoutRenderer(LessonRenderer):
+    """Lays the text out on every frame, as the renderer did before the cache."""
+
+    def draw(self, session, stats_str):
+        self._layout_key = None
+        self._layout_screen(session.full_text)
+        super().draw(session, stats_str)
+
+
+def bench_layout(words=1000, keystrokes=500):
+    """The same typing loop laying the text out on every frame vs once."""
+    curses.color_pair = lambda n: n << 8  # needs initscr() otherwise
+    lesson = random_lesson(words)
+    with tempfile.TemporaryDirectory() as tmp:
+        stats = StatsManager(str(Path(tmp) / "bench_stats.db"))
+
+        def type_lesson(renderer_class):
+            session = LessonSession(lesson, stats)
+            renderer = renderer_class(FakeScreen())
+            renderer.draw(session, "")
+            start = time.process_time()
+            for char in session.full_text[:keystrokes]:
+                session.handle_key(ord(char))
+                renderer.draw(session, "")
+            return (time.process_time() - start) / keystrokes
+
+        per_frame = type_lesson(PerFrameLayoutRenderer)
+        cached = type_lesson(LessonRenderer)
+        report("CPU per keystroke", per_frame * 1e6, cached * 1e6, unit="us")
+        stats.close()
+
+
+def synthetic_stats_db(db_path, lessons, keys_per_lesson=30, *, legacy=False):
+    """
+    Fills a stats database with random lessons and their key presses, also as
+    one row per key in the pre-BLOB key_presses table if legacy is set.
+    """
+    StatsManager(db_path).close()
+    rng = random.Random(0)
+    now = time.time()
+    with sqlite3.connect(db_path) as conn:
+        if legacy:
+            conn.execute(
+                "CREATE TABLE key_presses (lesson_id INTEGER NOT NULL, char_index INTEGER NOT NULL, timestamp INTEGER NOT NULL, PRIMARY KEY (lesson_id, timestamp, char_index)) WITHOUT ROWID"
+            )
+        for lesson_id in range(1, lessons + 1):
+            text = "".join(rng.choices("abcdefgh ", k=keys_per_lesson))
+            typed = "".join(c if rng.random() < 0.95 else "x\b" + c for c in text)
+            conn.execute(
+                "INSERT INTO lessons (id, timestamp, text_required, text_typed, duration) VALUES (?, ?, ?, ?, ?)",
+                (lesson_id, now - lessons + lesson_id, text, typed, 10.0),
+            )
+            start = rng.randint(0, 10**12)
+            key_presses = KeyPressLog(
+                (i, start + i * 2 * 10**8 + rng.randint(0, 10**8))
+                for i in range(len(typed))
+            )
+            conn.execute(
+                "INSERT INTO lesson_key_presses (lesson_id, keystrokes, data) VALUES (?, ?, ?)",
+                (lesson_id, len(key_presses), key_presses.encode()),
+            )
+            if legacy:
+                conn.executemany(
+                    "INSERT INTO key_presses (lesson_id, char_index, timestamp) VALUES (?, ?, ?)",
+                    [(lesson_id, *key_press) for key_press in key_presses],
+                )
+
+
+def lesson_stats_per_lesson(db_path):
+    """The per-lesson Python loop viz.py used before the analytics module."""
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute(
+            "SELECT id, timestamp, text_required, text_typed, duration FROM lessons WHERE duration IS NOT NULL ORDER BY timestamp"
+        ).fetchall()
+        kp_map = {
+            lesson_id: KeyPressLog.decode(data).timestamps
+            for lesson_id, data in conn.execute(
+                "SELECT lesson_id, data FROM lesson_key_presses"
+            )
+        }
+    return [
+        LessonSummary.from_lesson(required, typed, duration, kp_map.get(lesson_id, []))
+        for lesson_id, _, required, typed, duration in rows
+    ]
+
+
+def table_bytes(conn, table):
+    """Bytes of the pages holding a table, including its WITHOUT ROWID key."""
+    return conn.execute(
+        "SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (table,)
+    ).fetchone()[0]
+
+
+def bench_key_presses(lessons=20_000):
+    """One row per key press vs one varint BLOB per lesson, read into NumPy."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "bench_stats.db")
+        synthetic_stats_db(db_path, lessons, legacy=True)
+        with sqlite3.connect(db_path) as conn:
+            keys = conn.execute(
+                "SELECT SUM(keystrokes) FROM lesson_key_presses"
+            ).fetchone()[0]
+
+            start = time.perf_counter()
+            rows = np.fromiter(
+                conn.execute(
+                    "SELECT lesson_id, timestamp FROM key_presses ORDER BY lesson_id, timestamp"
+                ),
+                dtype=[("lesson_id", np.int64), ("timestamp", np.int64)],
+            )
+            baseline = time.perf_counter() - start
+
+            start = time.perf_counter()
+            lesson_ids, timestamps = load_key_presses(conn)
+            optimized = time.perf_counter() - start
+            assert np.array_equal(lesson_ids, rows["lesson_id"])
+            assert np.array_equal(timestamps, rows["timestamp"])
+            report("key press load", keys / baseline, keys / optimized, unit="keys/s")
+
+            try:
+                rows_size = table_bytes(conn, "key_presses")
+                blobs_size = table_bytes(conn, "lesson_key_presses")
+            except sqlite3.OperationalError:
+                # SQLite built without the dbstat virtual table
+                return
+            report(
+                "key press storage", rows_size / keys, blobs_size / keys, unit="B/key"
+            )
+
+
+def bench_analytics(lessons=100_000):
+    """Per-lesson Python statistics vs the columnar analytics module."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "bench_stats.db")
+        synthetic_stats_db(db_path, lessons)
+
+        start = time.perf_counter()
+        lesson_stats_per_lesson(db_path)
+        baseline = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with sqlite3.connect(db_path) as conn:
+            load_lesson_history(conn)
+        optimized = time.perf_counter() - start
+
+        report(
+            f"lesson history ({lessons:,} lessons)",
+            lessons / baseline,
+            lessons / optimized,
+            unit="lessons/s",
+        )
+
+
+def bench_replay(lessons=20_000, length=200):
+    """Replaying typed texts one at a time vs the batch replay, in chars/s."""
+    rng = random.Random(0)
+    texts_required, texts_typed = [], []
+    for _ in range(lessons):
+        text = "".join(rng.choices("abcdefgh ", k=length))
+        texts_required.append(text)
+        texts_typed.append(
+            "".join(c if rng.random() < 0.95 else "x\b" + c for c in text)
+        )
+    chars = sum(map(len, texts_typed))
+
+    start = time.perf_counter()
+    for required, typed in zip(texts_required, texts_typed, strict=True):
+        replay_typed_text(required, typed)
+    baseline = time.perf_counter() - start
+
+    start = time.perf_counter()
+    replay_typed_texts(texts_required, texts_typed)
+    optimized = time.perf_counter() - start
+
+    report("replay", chars / baseline, chars / optimized, unit="chars/s")
+
+
+def synthetic_dictionary_dump(path, entries, seed=0):
+    """Writes an Apple dictionary dump of random entries, one XML document per line."""
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(entries):
+            title = "".join(
+                rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 12))
+            )
+            if rng.random() < 0.05:
+                title = rng.choice(
+                    ["^", "$", "é", " &amp; ", "&apos;s", "&#233;", "&#x2019;"]
+                ).join([title, title[:3]])
+            senses = "".join(
+                f'<span class="sg"><span class="se2"><span class="df">'
+                f"{' '.join(rng.choices(['a', 'the', 'word', 'of', 'meaning'], k=40))}"
+                f"</span></span></span>"
+                for _ in range(rng.randint(1, 6))
+            )
+            f.write(
+                f'<d:entry xmlns:d="http://www.apple.com/DTDs/DictionaryService-1.0.rng" '
+                f'id="m_en_gbus{i:07}" d:title="{title}" class="entry">'
+                f'<span class="hg x_xh0"><span role="text" class="hw">{title}</span></span>'
+                f"{senses}</d:entry>\n"
+            )
+
+
+def load_dictionary_serially(input_file, db_file):
+    """The single-process load with a commit per 1000 rows, as process_dictionary.py did."""
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE TABLE articles (word_id INTEGER PRIMARY KEY, title TEXT)")
+    with open(input_file, encoding="utf-8") as f:
+        for batch in itertools.batched(
+            enumerate(parse_titles(f), start=1), 1000, strict=False
+        ):
+            conn.executemany(
+                "INSERT INTO articles (word_id, title) VALUES (?, ?)", batch
+            )
+            conn.commit()
+    conn.execute("CREATE INDEX idx_title ON articles (title)")
+    create_ascii_words(conn)
+    conn.commit()
+    conn.close()
+
+
+def bench_dictionary_ingest(entries=200_000):
+    """Serial per-batch-commit load vs the parallel single-transaction one."""
+    with tempfile.TemporaryDirectory() as tmp:
+        dump = str(Path(tmp) / "en_en.txt")
+        synthetic_dictionary_dump(dump, entries)
+        serial_db, parallel_db = (
+            str(Path(tmp) / "serial.db"),
+            str(Path(tmp) / "parallel.db"),
+        )
+
+        start = time.perf_counter()
+        load_dictionary_serially(dump, serial_db)
+        baseline = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            process_dictionary(dump, parallel_db)
+        optimized = time.perf_counter() - start
+
+        query = "SELECT word_id, title FROM articles ORDER BY word_id"
+        with (
+            sqlite3.connect(serial_db) as serial,
+            sqlite3.connect(parallel_db) as parallel,
+        ):
+            assert (
+                serial.execute(query).fetchall() == parallel.execute(query).fetchall()
+            )
+        report(
+            f"dictionary ingest ({os.cpu_count()} CPUs)",
+            entries / baseline,
+            entries / optimized,
+            unit="entries/s",
+        )
+
+
+def decompress_to_dump(body_path, dump_path):
+    """The block by block inflation into a .txt dump that dictionary_decompressor.py did."""
+    with open(body_path, "rb") as in_file, open(dump_path, "w") as out_file:
+        in_file.seek(0x40)
+        limit = 0x40 + struct.unpack("i", in_file.read(4))[0]
+        in_file.seek(0x60)
+        while in_file.tell() < limit:
+            (sz,) = struct.unpack("i", in_file.read(4))
+            buf = zlib.decompress(in_file.read(sz)[8:])
+            pos = 0
+            while pos < len(buf):
+                (chunk_size,) = struct.unpack("i", buf[pos : pos + 4])
+                pos += 4
+                out_file.write(buf[pos : pos + chunk_size].decode())
+                pos += chunk_size
+
+
+def bench_body_data(entries=200_000):
+    """Body.data to a .txt dump to articles vs straight from the mapped blocks."""
+    with tempfile.TemporaryDirectory() as tmp:
+        dump = str(Path(tmp) / "en_en.txt")
+        synthetic_dictionary_dump(dump, entries)
+        body = str(Path(tmp) / "Body.data")
+        with open(dump, encoding="utf-8") as f:
+            write_body_data(body, f, entries_per_block=100)
+        os.remove(dump)
+        two_pass_db, direct_db = (
+            str(Path(tmp) / "two_pass.db"),
+            str(Path(tmp) / "direct.db"),
+        )
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            decompress_to_dump(body, dump)
+            process_dictionary(dump, two_pass_db)
+            baseline = time.perf_counter() - start
+
+            start = time.perf_counter()
+            decompress_dictionary(body, direct_db)
+            optimized = time.perf_counter() - start
+
+        query = "SELECT word_id, title FROM articles ORDER BY word_id"
+        with (
+            sqlite3.connect(two_pass_db) as two_pass,
+            sqlite3.connect(direct_db) as direct,
+        ):
+            assert (
+                two_pass.execute(query).fetchall() == direct.execute(query).fetchall()
+            )
+        report(
+            f"Body.data ingest ({os.cpu_count()} CPUs)",
+            entries / baseline,
+            entries / optimized,
+            unit="entries/s",
+        )
+
+
+def bench_dictionary_build(entries=200_000):
+    """Body.data to a .txt dump, articles and bigrams in turn vs one streaming pass."""
+    with tempfile.TemporaryDirectory() as tmp:
+        dump = str(Path(tmp) / "en_en.txt")
+        synthetic_dictionary_dump(dump, entries)
+        body = str(Path(tmp) / "Body.data")
+        with open(dump, encoding="utf-8") as f:
+            write_body_data(body, f, entries_per_block=100)
+        os.remove(dump)
+        three_pass_db, one_pass_db = (
+            str(Path(tmp) / "three_pass.db"),
+            str(Path(tmp) / "one_pass.db"),
+        )
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            decompress_to_dump(body, dump)
+            process_dictionary(dump, three_pass_db)
+            create_bigram_index(three_pass_db)
+            baseline = time.perf_counter() - start
+
+            start = time.perf_counter()
+            build_dictionary(body, one_pass_db)
+            optimized = time.perf_counter() - start
+
+        query = "SELECT * FROM bigram_frequency"
+        with (
+            sqlite3.connect(three_pass_db) as three_pass,
+            sqlite3.connect(one_pass_db) as one_pass,
+        ):
+            assert (
+                three_pass.execute(query).fetchall()
+                == one_pass.execute(query).fetchall()
+            )
+        report(
+            f"dictionary build ({os.cpu_count()} CPUs)",
+            entries / baseline,
+            entries / optimized,
+            unit="entries/s",
+        )
+
+
+def bench_title_extraction(entries=50_000):
+    """Parsing every entry as XML vs scanning its root start tag, in entries/s."""
+    with tempfile.TemporaryDirectory() as tmp:
+        dump = Path(tmp) / "en_en.txt"
+        synthetic_dictionary_dump(dump, entries)
+        lines = [line.strip() for line in dump.read_text(encoding="utf-8").splitlines()]
+
+    start = time.perf_counter()
+    expected = [parse_title_xml(line) for line in lines]
+    baseline = time.perf_counter() - start
+
+    start = time.perf_counter()
+    titles = [parse_title(line) for line in lines]
+    optimized = time.perf_counter() - start
+
+    assert titles == expected
+    report(
+        "title extraction", entries / baseline, entries / optimized, unit="entries/s"
+    )
+
+
+def synthetic_dictionary_db(db_path, words, seed=0):
+    """Creates a dictionary database whose articles are random words."""
+    rng = random.Random(seed)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE articles (word_id INTEGER PRIMARY KEY, title TEXT)")
+        conn.executemany(
+            "INSERT INTO articles (word_id, title) VALUES (?, ?)",
+            (
+                (
+                    word_id,
+                    "".join(
+                        rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 14))
+                    ),
+                )
+                for word_id in range(1, words + 1)
+            ),
+        )
+
+
+def create_bigram_index_unsorted(db_path):
+    """The whole-table, insertion-order build that create_bigram_index.py did."""
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE bigram_frequency (bigram TEXT(2) NOT NULL, count INTEGER NOT NULL, word_id INTEGER NOT NULL, PRIMARY KEY (bigram, count, word_id)) WITHOUT ROWID"
+    )
+    rows = conn.execute(
+        "SELECT word_id, title FROM articles WHERE title IS NOT NULL"
+    ).fetchall()
+    batch = []
+    for word_id, title in rows:
+        batch.extend(word_bigrams(word_id, title))
+        if len(batch) >= 10000:
+            conn.executemany(
+                "INSERT INTO bigram_frequency (bigram, count, word_id) VALUES (?, ?, ?)",
+                batch,
+            )
+            conn.commit()
+            batch = []
+    conn.executemany(
+        "INSERT INTO bigram_frequency (bigram, count, word_id) VALUES (?, ?, ?)", batch
+    )
+    conn.commit()
+    conn.close()
+
+
+def bench_bigram_index(words=300_000):
+    """Unsorted inserts of the whole table vs merged sorted runs, in words/s."""
+    with tempfile.TemporaryDirectory() as tmp:
+        unsorted_db, merged_db = (
+            str(Path(tmp) / "unsorted.db"),
+            str(Path(tmp) / "merged.db"),
+        )
+        synthetic_dictionary_db(unsorted_db, words)
+        synthetic_dictionary_db(merged_db, words)
+
+        start = time.perf_counter()
+        create_bigram_index_unsorted(unsorted_db)
+        baseline = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_bigram_index(merged_db)
+        optimized = time.perf_counter() - start
+
+        query = "SELECT * FROM bigram_frequency"
+        with (
+            sqlite3.connect(unsorted_db) as unsorted,
+            sqlite3.connect(merged_db) as merged,
+        ):
+            assert (
+                unsorted.execute(query).fetchall() == merged.execute(query).fetchall()
+            )
+        report(
+            "bigram index build", words / baseline, words / optimized, unit="words/s"
+        )
+        try:
+            with (
+                sqlite3.connect(unsorted_db) as unsorted,
+                sqlite3.connect(merged_db) as merged,
+            ):
+                sizes = [
+                    table_bytes(conn, "bigram_frequency") for conn in (unsorted, merged)
+                ]
+        except sqlite3.OperationalError:
+            # SQLite built without the dbstat virtual table
+            return
+        report("bigram_frequency size", *(size / 2**20 for size in sizes), unit="MiB")
+
+
+def bench_bigram_refresh(words=300_000, changes=1000):
+    """Rebuilding the bigram index vs refreshing the changed words."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "dict.db")
+        synthetic_dictionary_db(db_path, words)
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_bigram_index(db_path)
+        with sqlite3.connect(db_path) as conn:
+            create_ascii_words(conn)
+
+        def change_articles():
+            with sqlite3.connect(db_path) as conn:
+                conn.execute(
+                    "DELETE FROM articles WHERE word_id IN (SELECT word_id FROM articles ORDER BY RANDOM() LIMIT ?)",
+                    (changes // 2,),
+                )
+                conn.executemany(
+                    "INSERT INTO articles (title) VALUES (?)",
+                    [(f"word{i}",) for i in range(changes // 2)],
+                )
+
+        change_articles()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_bigram_index(db_path)
+        baseline = time.perf_counter() - start
+
+        change_articles()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            refresh_bigram_index(db_path)
+        optimized = time.perf_counter() - start
+        report(
+            f"bigram index, {changes:,} changes",
+            changes / baseline,
+            changes / optimized,
+            unit="changes/s",
+        )
+
+
+def bench_snapshot(words=300_000):
+    """Loading the bigram index from SQLite vs mapping its snapshot."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "dict.db")
+        snapshot_path = str(Path(tmp) / "dict.snapshot")
+        synthetic_dictionary_db(db_path, words)
+        with sqlite3.connect(db_path) as conn:
+            create_ascii_words(conn)
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_bigram_index(db_path)
+        with sqlite3.connect(db_path) as conn:
+            BigramIndex.load(conn).save_snapshot(snapshot_path)
+
+        start = time.perf_counter()
+        with sqlite3.connect(db_path) as conn:
+            sql = BigramIndex.load(conn)
+        baseline = time.perf_counter() - start
+
+        start = time.perf_counter()
+        snapshot = BigramIndex.from_snapshot(snapshot_path)
+        optimized = time.perf_counter() - start
+        report("bigram index load", baseline * 1e3, optimized * 1e3, unit="ms")
+
+        excluded = bytearray(len(sql.word_ids))
+        bigrams = list(sql.postings)
+        report(
+            "bigram index sample",
+            calls_per_second(
+                lambda: sql.sample(random.choice(bigrams), excluded), 10**5
+            ),
+            calls_per_second(
+                lambda: snapshot.sample(random.choice(bigrams), excluded), 10**5
+            ),
+        )
+
+
+BENCHMARKS = {
+    "connections": bench_connections,
+    "lesson_generation": bench_lesson_generation,
+    "rendering": bench_rendering,
+    "layout": bench_layout,
+    "analytics": bench_analytics,
+    "replay": bench_replay,
+    "key_presses": bench_key_presses,
+    "dictionary_ingest": bench_dictionary_ingest,
+    "body_data": bench_body_data,
+    "dictionary_build": bench_dictionary_build,
+    "title_extraction": bench_title_extraction,
+    "bigram_index": bench_bigram_index,
+    "bigram_refresh": bench_bigram_refresh,
+    "snapshot": bench_snapshot,
+}
+
+
+def main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(
+                f"Unknown benchmark {name!r}, expected one of: {', '.join(BENCHMARKS)}"
+            )
+            sys.exit(1)
+        print(f"== {name}")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
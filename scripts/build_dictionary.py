@@ -0,0 +1,199 @@
+"""Builds a dictionary database from an Apple Body.data in one streaming pass.
+
+The blocks of Body.data are inflated and their titles read in a process pool,
+as dictionary_decompressor.py does. As the titles come back in file order,
+they are numbered and written to articles and ascii_words, and every
+CHUNK_WORDS of them go back to the pool to be counted into a sorted run of
+bigrams, as create_bigram_index.py does. The runs are merged into
+bigram_frequency once the last block is in. Only the blocks and chunks in
+flight are held in memory, whatever the size of the dictionary.
+
+The database is the one dictionary_decompressor.py followed by
+create_bigram_index.py builds, change tracking included, so --refresh works
+on it. The throughput of every stage is printed at the end.
+
+Usage: uv run scripts/build_dictionary.py [name ...] [--workers N]
+"""
+
+import contextlib
+import heapq
+import itertools
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from create_bigram_index import (
+    BIGRAM_FREQUENCY,
+    CHANGE_TRACKING,
+    CHUNK_WORDS,
+    bounded_starmap,
+    read_run,
+    write_run,
+)
+from dictionary_decompressor import (
+    block_ranges,
+    inflate_titles,
+    inflate_titles_in_worker,
+    load_dictionaries,
+    map_body,
+    open_body,
+)
+from process_dictionary import finish_dictionary_db, prepare_dictionary_db
+
+
+@dataclass
+class Stage:
+    """The work done by one stage of the pipeline and the time it took."""
+
+    name: str
+    unit: str
+    items: int = 0
+    seconds: float = 0.0
+
+    def __str__(self) -> str:
+        rate = self.items / self.seconds if self.seconds else 0
+        return (
+            f"{self.name:>8}: {self.items:>12,} {self.unit} in {self.seconds:6.2f}s "
+            f"({rate:,.0f} {self.unit}/s)"
+        )
+
+
+def timed(fn: Callable, *args) -> tuple:
+    """Returns fn(*args) with the seconds it took, in whichever process it ran."""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def inflated_titles(
+    executor: Executor | None, window: int, body, blocks: list[range], stage: Stage
+) -> Iterator[str]:
+    """
+    Yields the titles of the blocks in file order, inflating at most window
+    blocks ahead in the executor, if any.
+    """
+    if executor:
+        results = bounded_starmap(
+            executor,
+            timed,
+            ((inflate_titles_in_worker, block) for block in blocks),
+            window,
+        )
+    else:
+        results = (timed(inflate_titles, body, block) for block in blocks)
+    for block, (titles, seconds) in zip(blocks, results, strict=True):
+        stage.items += len(block)
+        stage.seconds += seconds
+        yield from titles
+
+
+def loaded_articles(
+    conn: sqlite3.Connection, titles: Iterable[str], stage: Stage
+) -> Iterator[tuple[tuple[int, str], ...]]:
+    """
+    Numbers the titles from 1, writes them to articles and the ASCII ones to
+    ascii_words, and yields them on in chunks of CHUNK_WORDS words.
+    """
+    for words in itertools.batched(
+        enumerate(titles, start=1), CHUNK_WORDS, strict=False
+    ):
+        start = time.perf_counter()
+        conn.executemany("INSERT INTO articles (word_id, title) VALUES (?, ?)", words)
+        # The ordinals count up from 1 in word_id order, as create_ascii_words
+        # numbers them
+        conn.executemany(
+            "INSERT INTO ascii_words (word_id, title) VALUES (?, ?)",
+            (word for word in words if word[1].isascii()),
+        )
+        stage.items += len(words)
+        stage.seconds += time.perf_counter() - start
+        print(f"Loaded {stage.items} words...", end="\r")
+        yield words
+
+
+def build_dictionary(body_path, db_file, workers=None):
+    workers = workers or os.cpu_count() or 1
+    inflate = Stage("inflate", "bytes")
+    articles = Stage("articles", "words")
+    count = Stage("count", "bigrams")
+    merge = Stage("merge", "bigrams")
+    index = Stage("index", "words")
+    build_start = time.perf_counter()
+
+    with contextlib.ExitStack() as stack:
+        body = stack.enter_context(map_body(body_path))
+        run_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        conn = stack.enter_context(contextlib.closing(prepare_dictionary_db(db_file)))
+        executor = None
+        if workers > 1:
+            executor = stack.enter_context(
+                ProcessPoolExecutor(
+                    workers, initializer=open_body, initargs=(body_path,)
+                )
+            )
+
+        conn.execute(BIGRAM_FREQUENCY)
+
+        blocks = block_ranges(body)
+        print(f"Found {len(blocks)} blocks.")
+        words = loaded_articles(
+            conn,
+            inflated_titles(executor, 2 * workers, body, blocks, inflate),
+            articles,
+        )
+        tasks = (
+            (write_run, chunk, os.path.join(run_dir, f"{i}.run"))
+            for i, chunk in enumerate(words)
+        )
+        if executor:
+            results = bounded_starmap(executor, timed, tasks, 2 * workers)
+        else:
+            results = itertools.starmap(timed, tasks)
+        runs = []
+        for (run_path, rows), seconds in results:
+            runs.append(run_path)
+            count.items += rows
+            count.seconds += seconds
+        print(f"Loaded {articles.items} words into {len(runs)} runs of bigrams.")
+
+        start = time.perf_counter()
+        # Appends in primary key order, in the same transaction as the articles
+        conn.executemany(
+            "INSERT INTO bigram_frequency (bigram, count, word_id) VALUES (?, ?, ?)",
+            heapq.merge(*map(read_run, runs)),
+        )
+        merge.items = count.items
+        merge.seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        finish_dictionary_db(conn)
+        index.items = articles.items
+        index.seconds = time.perf_counter() - start
+
+        # The index reflects every article: log the changes from here on
+        conn.executescript(CHANGE_TRACKING)
+        conn.commit()
+
+    elapsed = time.perf_counter() - build_start
+    print(
+        f"Built {articles.items} words and {merge.items} bigrams in {elapsed:.2f}s "
+        f"({workers} workers; inflate and count times are summed over them):"
+    )
+    for stage in (inflate, articles, count, merge, index):
+        print(stage)
+
+
+def main():
+    load_dictionaries(build_dictionary, sys.argv[1:])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""Drops old raw mistakes and key presses from a stats database.
+
+Their contribution is kept in the bigram_weights and lesson_stats aggregates,
+so the tutor's EMAs and lesson sampling are unaffected.
+
+Usage: uv run scripts/compact.py [stats.db] [horizon in weeks]
+"""
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tutor import COMPACT_HORIZON_WEEKS, STATS_DB, StatsManager
+
+
+def compact(db_path, horizon_weeks):
+    if not os.path.exists(db_path):
+        print(f"Error: Database file {db_path} not found.")
+        sys.exit(1)
+
+    size_before = os.path.getsize(db_path)
+    stats = StatsManager(db_path)
+    try:
+        result = stats.compact(horizon_weeks)
+    finally:
+        stats.close()
+    print(
+        f"Deleted {result.mistakes} mistakes and {result.key_presses} key presses "
+        f"older than {horizon_weeks:g} weeks, pruned {result.bigrams} bigram weights."
+    )
+    print(f"Size: {size_before:,} -> {os.path.getsize(db_path):,} bytes.")
+
+
+if __name__ == "__main__":
+    compact(
+        sys.argv[1] if len(sys.argv) > 1 else STATS_DB,
+        float(sys.argv[2]) if len(sys.argv) > 2 else COMPACT_HORIZON_WEEKS,
+    )
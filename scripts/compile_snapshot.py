@@ -0,0 +1,53 @@
+"""Compiles the dictionary into a snapshot that the tutor maps at startup.
+
+The snapshot holds the ASCII words and their bigram postings as flat arrays
+(see BigramIndex), so lessons are sampled without SQLite. Recompile it after
+rebuilding or refreshing the dictionary; the tutor ignores a snapshot older
+than the dictionary.
+
+Usage: uv run scripts/compile_snapshot.py [dictionary.db] [snapshot]
+"""
+
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tutor import (
+    DICTIONARY_DB,
+    DICTIONARY_SNAPSHOT,
+    BigramIndex,
+    create_ascii_words,
+)
+
+
+def compile_snapshot(db_path, snapshot_path):
+    if not os.path.exists(db_path):
+        print(f"Error: Database file {db_path} not found.")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    with sqlite3.connect(db_path) as conn:
+        has_ascii_words = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ascii_words'"
+        ).fetchone()
+        if not has_ascii_words:
+            # Dictionaries built before ascii_words existed, as in LessonGenerator
+            create_ascii_words(conn, temp=True)
+        index = BigramIndex.load(conn)
+    index.save_snapshot(snapshot_path)
+    print(
+        f"Wrote {len(index.word_ids)} words and {len(index.postings)} bigrams "
+        f"to {snapshot_path} ({os.path.getsize(snapshot_path):,} bytes) "
+        f"in {time.perf_counter() - start:.2f}s."
+    )
+
+
+if __name__ == "__main__":
+    compile_snapshot(
+        sys.argv[1] if len(sys.argv) > 1 else DICTIONARY_DB,
+        sys.argv[2] if len(sys.argv) > 2 else DICTIONARY_SNAPSHOT,
+    )
@@ -1,10 +1,276 @@
+"""Builds bigram_frequency, the bigram postings of every dictionary word.
+
+The articles table is streamed in chunks to worker processes. Each worker
+counts the bigrams of its chunk, sorts them in primary key order and writes
+them to a run file. The runs are then merged and inserted in that order, so
+the WITHOUT ROWID B-tree is filled in one sequential pass, and memory stays
+bounded by a few chunks whatever the size of the dictionary.
+
+The build also installs triggers that log changes to articles, so that
+--refresh later updates the postings (and ascii_words) of the changed words
+only, in one short transaction that readers such as the tutor can run across.
+A running tutor notices the commit and picks up the new words on its next
+lesson.
+
+Usage: uv run scripts/create_bigram_index.py [workers | --refresh]
+"""
+
+import collections
+import contextlib
+import heapq
+import itertools
 import os
+import pickle
 import sqlite3
 import sys
+import tempfile
+import time
 from collections import Counter
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tutor import create_ascii_words
+
+# Words per task sent to a worker, and so per sorted run
+CHUNK_WORDS = 20_000
+# Rows per pickle in a run file, the unit in which runs are read back
+RUN_BLOCK_ROWS = 4096
+
+BIGRAM_FREQUENCY = """
+    CREATE TABLE bigram_frequency (
+        bigram TEXT(2) NOT NULL,
+        count INTEGER NOT NULL,
+        word_id INTEGER NOT NULL,
+        PRIMARY KEY (bigram, count, word_id)
+    ) WITHOUT ROWID
+"""
+
+# Every change to articles as the removal of an old row and the addition of a
+# new one. The BEFORE INSERT trigger logs the row an INSERT OR REPLACE
+# overwrites, which does not fire the DELETE trigger. It also fires for
+# inserts that end up ignored or failing, so the log only tells which words
+# may have changed and what they were before; refreshes read what they are
+# now from articles.
+CHANGE_TRACKING = """
+    CREATE TABLE IF NOT EXISTS articles_changelog (
+        seq INTEGER PRIMARY KEY,
+        word_id INTEGER NOT NULL,
+        old_title TEXT,
+        new_title TEXT,
+        removed INTEGER NOT NULL
+    );
+    CREATE TRIGGER IF NOT EXISTS articles_replace_log BEFORE INSERT ON articles BEGIN
+        INSERT INTO articles_changelog (word_id, old_title, removed)
+        SELECT word_id, title, 1 FROM articles WHERE word_id = NEW.word_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS articles_insert_log AFTER INSERT ON articles BEGIN
+        INSERT INTO articles_changelog (word_id, new_title, removed)
+        VALUES (NEW.word_id, NEW.title, 0);
+    END;
+    CREATE TRIGGER IF NOT EXISTS articles_delete_log AFTER DELETE ON articles BEGIN
+        INSERT INTO articles_changelog (word_id, old_title, removed)
+        VALUES (OLD.word_id, OLD.title, 1);
+    END;
+    CREATE TRIGGER IF NOT EXISTS articles_update_log
+    AFTER UPDATE OF word_id, title ON articles BEGIN
+        INSERT INTO articles_changelog (word_id, old_title, removed)
+        VALUES (OLD.word_id, OLD.title, 1);
+        INSERT INTO articles_changelog (word_id, new_title, removed)
+        VALUES (NEW.word_id, NEW.title, 0);
+    END;
+"""
+CHANGE_TRACKING_OBJECTS = (
+    "articles_changelog",
+    "articles_replace_log",
+    "articles_insert_log",
+    "articles_delete_log",
+    "articles_update_log",
+)
+
+
+def word_bigrams(word_id: int, title: str) -> Iterator[tuple[str, int, int]]:
+    """Yields the (bigram, count, word_id) rows of one word."""
+    # Add boundaries according to the inspiration script: '^' || word || '$'
+    word_with_boundaries = f"^{title.lower()}$"
+    # Extract bigrams and count their occurrences in the current word
+    bigrams = Counter(
+        word_with_boundaries[i : i + 2] for i in range(len(word_with_boundaries) - 1)
+    )
+    for bigram, count in bigrams.items():
+        yield bigram, count, word_id
+
+
+def write_run(words: list[tuple[int, str]], run_path: str) -> tuple[str, int]:
+    """
+    Writes the bigram rows of the words to run_path in primary key order and
+    returns the path with how many there are.
+    """
+    rows = sorted(
+        row for word_id, title in words if title for row in word_bigrams(word_id, title)
+    )
+    with open(run_path, "wb") as f:
+        for start in range(0, len(rows), RUN_BLOCK_ROWS):
+            pickle.dump(rows[start : start + RUN_BLOCK_ROWS], f)
+    return run_path, len(rows)
+
+
+def read_run(run_path: str) -> Iterator[tuple[str, int, int]]:
+    """Yields the rows of a run written by write_run, a block at a time."""
+    with open(run_path, "rb") as f:
+        while True:
+            try:
+                yield from pickle.load(f)
+            except EOFError:
+                return
+
+
+def bounded_starmap(
+    executor: Executor, fn: Callable, tasks: Iterable[tuple], window: int
+) -> Iterator:
+    """
+    Yields fn(*args) for the tasks in order, like executor.map, but submits at
+    most window tasks ahead of the result being consumed, so that the tasks
+    are read lazily.
+    """
+    pending = collections.deque()
+    for args in tasks:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(fn, *args))
+    while pending:
+        yield pending.popleft().result()
+
+
+def chunks(cursor: sqlite3.Cursor, size: int) -> Iterator[list]:
+    """Yields the remaining rows of the cursor, size at a time."""
+    while rows := cursor.fetchmany(size):
+        yield rows
+
+
+def titles_before_changes(
+    changes: Iterable[tuple[int, str | None, int]],
+) -> dict[int, str | None]:
+    """
+    Folds changelog rows (word_id, old_title, removed), in order, into the
+    title every changed word had before them, which its first change tells.
+    A missing word has a None title, like a word without one: neither has
+    bigrams.
+    """
+    before = {}
+    for word_id, old_title, removed in changes:
+        before.setdefault(word_id, old_title if removed else None)
+    return before
+
+
+def update_ascii_words(
+    conn: sqlite3.Connection, word_id: int, before: str | None, after: str | None
+) -> None:
+    """
+    Updates ascii_words for one word whose title went from before to after,
+    None meaning no ASCII title, keeping the ordinals dense: the last word
+    takes the ordinal of a removed one, and new words are appended.
+    """
+    if before is not None and after is not None:
+        conn.execute(
+            "UPDATE ascii_words SET title = ? WHERE word_id = ?", (after, word_id)
+        )
+    elif before is not None:
+        (ordinal,) = conn.execute(
+            "SELECT ordinal FROM ascii_words WHERE word_id = ?", (word_id,)
+        ).fetchone()
+        conn.execute("DELETE FROM ascii_words WHERE ordinal = ?", (ordinal,))
+        conn.execute(
+            "UPDATE ascii_words SET ordinal = ? WHERE ordinal = (SELECT MAX(ordinal) FROM ascii_words) AND ordinal > ?",
+            (ordinal, ordinal),
+        )
+    elif after is not None:
+        conn.execute(
+            "INSERT INTO ascii_words (ordinal, word_id, title) VALUES ((SELECT COALESCE(MAX(ordinal), 0) + 1 FROM ascii_words), ?, ?)",
+            (word_id, after),
+        )
+
+
+def apply_article_changes(conn: sqlite3.Connection) -> int:
+    """
+    Brings bigram_frequency and ascii_words up to date with the changes logged
+    in articles_changelog since the last build or refresh, and returns the
+    number of words they touched.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    changes = conn.execute(
+        "SELECT seq, word_id, old_title, removed FROM articles_changelog ORDER BY seq"
+    ).fetchall()
+    if not changes:
+        conn.commit()
+        return 0
+    has_ascii_words = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ascii_words'"
+    ).fetchone()
+
+    net = titles_before_changes(change[1:] for change in changes)
+    removed, added = [], []
+    for word_id, before in net.items():
+        row = conn.execute(
+            "SELECT title FROM articles WHERE word_id = ?", (word_id,)
+        ).fetchone()
+        after = row[0] if row is not None else None
+        if before == after:
+            continue
+        if before:
+            removed.extend(word_bigrams(word_id, before))
+        if after:
+            added.extend(word_bigrams(word_id, after))
+        if has_ascii_words:
+            # The titles that create_ascii_words would keep
+            update_ascii_words(
+                conn,
+                word_id,
+                before if before is not None and before.isascii() else None,
+                after if after is not None and after.isascii() else None,
+            )
+    conn.executemany(
+        "DELETE FROM bigram_frequency WHERE bigram = ? AND count = ? AND word_id = ?",
+        removed,
+    )
+    conn.executemany(
+        "INSERT INTO bigram_frequency (bigram, count, word_id) VALUES (?, ?, ?)",
+        sorted(added),
+    )
+    conn.execute("DELETE FROM articles_changelog WHERE seq <= ?", (changes[-1][0],))
+    conn.commit()
+    return len(net)
 
 
-def create_bigram_index(db_path):
+def refresh_bigram_index(db_path):
+    if not os.path.exists(db_path):
+        print(f"Error: Database file {db_path} not found.")
+        sys.exit(1)
+
+    conn = sqlite3.connect(db_path)
+    # Reloading articles drops its triggers, after which the log misses changes
+    (tracked,) = conn.execute(
+        f"SELECT COUNT(*) FROM sqlite_master WHERE name IN ({', '.join('?' * len(CHANGE_TRACKING_OBJECTS))})",
+        CHANGE_TRACKING_OBJECTS,
+    ).fetchone()
+    if tracked < len(CHANGE_TRACKING_OBJECTS):
+        conn.close()
+        print("No change tracking on articles, building the index in full.")
+        create_bigram_index(db_path)
+        return
+
+    start = time.perf_counter()
+    words = apply_article_changes(conn)
+    conn.close()
+    print(
+        f"Refreshed the bigrams of {words} changed words "
+        f"in {time.perf_counter() - start:.2f}s."
+    )
+
+
+def create_bigram_index(db_path, workers=None):
     if not os.path.exists(db_path):
         print(f"Error: Database file {db_path} not found.")
         sys.exit(1)
@@ -15,56 +281,61 @@ def create_bigram_index(db_path):
     print("Creating bigram_frequency table...")
     # Schema according to the user's inspiration script
     cursor.execute("DROP TABLE IF EXISTS bigram_frequency")
-    cursor.execute("""
-        CREATE TABLE bigram_frequency (
-            bigram TEXT(2) NOT NULL,
-            count INTEGER NOT NULL,
-            word_id INTEGER NOT NULL,
-            PRIMARY KEY (bigram, count, word_id)
-        ) WITHOUT ROWID
-    """)
+    cursor.execute(BIGRAM_FREQUENCY)
     conn.commit()
 
-    print("Fetching words from 'articles' table...")
-    cursor.execute("SELECT word_id, title FROM articles WHERE title IS NOT NULL")
-    rows = cursor.fetchall()
-
-    print(f"Processing {len(rows)} words...")
-
-    batch_size = 10000
-    batch = []
-
-    for word_id, title in rows:
-        if not title:
-            continue
-
-        # Add boundaries according to the inspiration script: '^' || word || '$'
-        word_with_boundaries = f"^{title.lower()}$"
-
-        # Extract bigrams and count their occurrences in the current word
-        bigrams = [
-            word_with_boundaries[i : i + 2]
-            for i in range(len(word_with_boundaries) - 1)
-        ]
-        counts = Counter(bigrams)
-
-        for bigram, count in counts.items():
-            batch.append((bigram, count, word_id))
-
-        if len(batch) >= batch_size:
-            cursor.executemany(
-                "INSERT INTO bigram_frequency (bigram, count, word_id) VALUES (?, ?, ?)",
-                batch,
-            )
-            conn.commit()
-            batch = []
+    workers = workers or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as run_dir:
+        print("Counting bigrams into sorted runs...")
+        start = time.perf_counter()
+        words = conn.execute(
+            "SELECT word_id, title FROM articles WHERE title IS NOT NULL"
+        )
+        tasks = (
+            (chunk, os.path.join(run_dir, f"{i}.run"))
+            for i, chunk in enumerate(chunks(words, CHUNK_WORDS))
+        )
+        runs = []
+        total = 0
+        with contextlib.ExitStack() as stack:
+            if workers > 1:
+                executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+                results = bounded_starmap(executor, write_run, tasks, 2 * workers)
+            else:
+                results = itertools.starmap(write_run, tasks)
+            for run_path, rows in results:
+                runs.append(run_path)
+                total += rows
+                print(f"Counted {total} bigrams...", end="\r")
+        elapsed = time.perf_counter() - start
+        print(
+            f"Counted {total} bigrams into {len(runs)} runs "
+            f"({total / elapsed:,.0f} rows/s)."
+        )
 
-    if batch:
+        print("Merging runs into bigram_frequency...")
+        start = time.perf_counter()
+        # A single transaction of appends in primary key order
         cursor.executemany(
             "INSERT INTO bigram_frequency (bigram, count, word_id) VALUES (?, ?, ?)",
-            batch,
+            heapq.merge(*map(read_run, runs)),
         )
         conn.commit()
+        elapsed = time.perf_counter() - start
+        print(f"Inserted {total} bigrams ({total / elapsed:,.0f} rows/s).")
+
+    has_ascii_words = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ascii_words'"
+    ).fetchone()
+    if has_ascii_words:
+        # Refreshes maintain ascii_words too, so it must start out current
+        create_ascii_words(conn)
+        conn.commit()
+
+    # The index now reflects every article: log the changes from here on
+    conn.executescript(CHANGE_TRACKING)
+    conn.execute("DELETE FROM articles_changelog")
+    conn.commit()
 
     print("Bigram index created successfully.")
     conn.close()
@@ -72,4 +343,7 @@ def create_bigram_index(db_path):
 
 if __name__ == "__main__":
     db_path = "dictionaries/en_en.db"
-    create_bigram_index(db_path)
+    if sys.argv[1:] == ["--refresh"]:
+        refresh_bigram_index(db_path)
+    else:
+        create_bigram_index(db_path, int(sys.argv[1]) if len(sys.argv) > 1 else None)
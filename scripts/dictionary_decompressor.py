@@ -1,12 +1,34 @@
+"""Loads Apple dictionary Body.data files straight into the articles table.
+
+Body.data is a header, whose int32 at 0x40 is the length of the block area
+that starts at 0x60, and a run of blocks: an int32 size, 8 bytes of block
+header and a zlib stream. Inflated, a block is a run of entries, each an
+int32 length and one XML entry.
+
+The file is memory-mapped and its block offsets enumerated first; blocks
+are then inflated and their titles read in a process pool, in file order,
+and loaded through process_dictionary.load_articles, without the .txt dump
+of the old pipeline.
+
+Usage: uv run scripts/dictionary_decompressor.py [name ...] [--workers N]
+"""
+
+import contextlib
+import mmap
+import os
+import struct
+import sys
+import zlib
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+
+from create_bigram_index import bounded_starmap
+from process_dictionary import load_articles, parse_titles
+
 # Thanks to commenters for providing the base of this much nicer implementation!
-# Save and run with $ ipython dictionary_decompressor.py
 # You may need to hunt down the dictionary files yourself and change the
 # awful path string below.
 # This works for me on MacOS 10.14 Mojave
-import os
-from struct import unpack
-from zlib import decompress
-import re
 
 suffix = "/Contents/Resources/Body.data"
 prefix = (
@@ -80,51 +102,142 @@ dictionaries = {
 }
 
 
-def form_and_save_dictionary(in_file_name, out_file_name):
-    if os.path.exists(out_file_name):
-        print(
-            f"File {out_file_name} already exists, not sure if should overwrite.",
-            end=" ",
-        )
-        return
+# Where the block area of a Body.data starts, and where its length is stored
+BLOCKS_START = 0x60
+BLOCKS_LENGTH_OFFSET = 0x40
+# Block size, then 8 bytes of block header before the zlib stream
+BLOCK_SIZE = struct.Struct("<i")
+BLOCK_HEADER_SIZE = 8
 
-    try:
-        in_file = open(in_file_name, "rb")
-    except FileNotFoundError:
-        print("Not found.", end=" ")
-        return
+# The mapped Body.data of a worker process, opened by open_body
+_body: mmap.mmap | None = None
 
-    in_file.seek(0x40)
-    limit = 0x40 + unpack("i", in_file.read(4))[0]
-    in_file.seek(0x60)
 
-    def gen_entry():
-        while in_file.tell() < limit:
-            (sz,) = unpack("i", in_file.read(4))
-            buf = decompress(in_file.read(sz)[8:])
+def map_body(path: str) -> mmap.mmap:
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
-            pos = 0
-            while pos < len(buf):
-                (chunk_size,) = unpack("i", buf[pos : pos + 4])
-                pos += 4
 
-                entry = buf[pos : pos + chunk_size]
-                title = re.search(b'd:title="(.*?)"', entry).group(1)
-                yield title.decode(), entry.decode()
+def open_body(path: str) -> None:
+    """Process pool initializer: maps the Body.data the worker inflates blocks of."""
+    global _body
+    _body = map_body(path)
 
-                pos += chunk_size
 
-    with open(out_file_name, "w") as out_file:
-        for _, definition in gen_entry():
-            out_file.write(definition)
+def block_ranges(body: mmap.mmap) -> list[range]:
+    """Returns the byte range of the zlib stream of every block, in file order."""
+    (length,) = BLOCK_SIZE.unpack_from(body, BLOCKS_LENGTH_OFFSET)
+    limit = BLOCKS_LENGTH_OFFSET + length
+    ranges = []
+    position = BLOCKS_START
+    while position < limit:
+        (size,) = BLOCK_SIZE.unpack_from(body, position)
+        start = position + BLOCK_SIZE.size
+        ranges.append(range(start + BLOCK_HEADER_SIZE, start + size))
+        position = start + size
+    return ranges
 
 
-def main():
-    for name in dictionaries:
-        print(f"Saving {name}...", end=" ")
-        form_and_save_dictionary(dictionaries[name], "data/" + name + ".txt")
+def block_entries(block: bytes) -> Iterator[str]:
+    """Yields the XML entries of an inflated block."""
+    position = 0
+    while position < len(block):
+        (size,) = BLOCK_SIZE.unpack_from(block, position)
+        position += BLOCK_SIZE.size
+        yield block[position : position + size].decode()
+        position += size
+
+
+def inflate_titles(body: mmap.mmap, block: range) -> list[str]:
+    """Inflates one block and returns the titles of its entries, in order."""
+    return list(
+        parse_titles(block_entries(zlib.decompress(body[block.start : block.stop])))
+    )
+
+
+def inflate_titles_in_worker(block: range) -> list[str]:
+    return inflate_titles(_body, block)
+
+
+def decompress_dictionary(body_path, db_file, workers=None):
+    workers = workers or os.cpu_count() or 1
+    with contextlib.ExitStack() as stack:
+        body = stack.enter_context(map_body(body_path))
+        blocks = block_ranges(body)
+        print(f"Found {len(blocks)} blocks.")
+        if workers > 1:
+            executor = stack.enter_context(
+                ProcessPoolExecutor(
+                    workers, initializer=open_body, initargs=(body_path,)
+                )
+            )
+            # At most two blocks per worker are in flight, in file order
+            chunks = bounded_starmap(
+                executor,
+                inflate_titles_in_worker,
+                ((block,) for block in blocks),
+                2 * workers,
+            )
+        else:
+            chunks = (inflate_titles(body, block) for block in blocks)
+        load_articles(db_file, chunks)
+
+
+def write_body_data(path: str, entries: Iterable[str], entries_per_block: int) -> None:
+    """
+    Writes entries in the Body.data format, for tests and benchmarks that run
+    without the macOS dictionaries.
+    """
+    blocks = []
+    entries = list(entries)
+    for start in range(0, len(entries), entries_per_block):
+        raw = b"".join(
+            BLOCK_SIZE.pack(len(data)) + data
+            for data in (
+                entry.encode() for entry in entries[start : start + entries_per_block]
+            )
+        )
+        compressed = zlib.compress(raw)
+        # The block header holds the compressed and the inflated sizes
+        block = struct.pack("<ii", len(compressed) + 4, len(raw)) + compressed
+        blocks.append(BLOCK_SIZE.pack(len(block)) + block)
+    block_area = b"".join(blocks)
+    header = bytearray(BLOCKS_START)
+    BLOCK_SIZE.pack_into(
+        header,
+        BLOCKS_LENGTH_OFFSET,
+        BLOCKS_START - BLOCKS_LENGTH_OFFSET + len(block_area),
+    )
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(block_area)
+
+
+def load_dictionaries(
+    load: Callable[[str, str, int | None], object], args: list[str]
+) -> None:
+    """
+    Runs load(body_path, db_file, workers) for the dictionaries named in args,
+    or all of them, into dictionaries/<name>.db. Usage: [name ...] [--workers N]
+    """
+    args = list(args)
+    workers = None
+    if "--workers" in args:
+        i = args.index("--workers")
+        workers = int(args[i + 1])
+        del args[i : i + 2]
+    for name in args or dictionaries:
+        if not os.path.exists(dictionaries[name]):
+            print(f"Skipping {name}: {dictionaries[name]} not found.")
+            continue
+        print(f"Loading {name}...")
+        load(dictionaries[name], f"dictionaries/{name}.db", workers)
         print("Done.")
 
 
+def main():
+    load_dictionaries(decompress_dictionary, sys.argv[1:])
+
+
 if __name__ == "__main__":
     main()
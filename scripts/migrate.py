@@ -1,6 +1,11 @@
+import importlib.util
 import logging
 import os
 import sqlite3
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 # Configure logging
 logging.basicConfig(
@@ -17,7 +22,9 @@ def run_migrations():
         logger.warning(f"Migration directory '{MIGRATION_DIR}' not found.")
         return
 
-    migrations = sorted([f for f in os.listdir(MIGRATION_DIR) if f.endswith(".sql")])
+    migrations = sorted(
+        [f for f in os.listdir(MIGRATION_DIR) if f.endswith((".sql", ".py"))]
+    )
 
     if not migrations:
         logger.info("No migration files found.")
@@ -47,9 +54,18 @@ def run_migrations():
 
                 migration_path = os.path.join(MIGRATION_DIR, m)
                 logger.info(f"Running migration: {m}")
-                with open(migration_path) as f:
-                    sql = f.read()
-                    conn.executescript(sql)
+                if m.endswith(".py"):
+                    # Python migrations transform data that SQL alone cannot
+                    spec = importlib.util.spec_from_file_location(
+                        m[:-3], migration_path
+                    )
+                    module = importlib.util.module_from_spec(spec)
+                    spec.loader.exec_module(module)
+                    module.migrate(conn)
+                else:
+                    with open(migration_path) as f:
+                        sql = f.read()
+                        conn.executescript(sql)
 
                 conn.execute("INSERT INTO _migrations (name) VALUES (?)", (m,))
                 conn.commit()
@@ -1,78 +1,227 @@
+"""Loads the titles of an Apple dictionary dump into the articles table.
+
+The dump has one XML entry per line, whose title is read off its root start
+tag without parsing the rest. Byte ranges of the file are parsed in
+parallel and written in file order by a single writer, so word_ids are the
+same as with a serial pass over the lines.
+
+Usage: uv run scripts/process_dictionary.py [workers]
+"""
+
+import contextlib
+import io
+import itertools
 import os
+import re
 import sqlite3
 import sys
 import xml.etree.ElementTree as ET
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tutor import create_ascii_words
+
+DICTIONARY_NAMESPACE = "http://www.apple.com/DTDs/DictionaryService-1.0.rng"
+TITLE_ATTRIBUTE = f"{{{DICTIONARY_NAMESPACE}}}title"
+# Dropped before loading a dictionary from scratch
+DICTIONARY_TABLES = (
+    "articles",
+    "ascii_words",
+    "bigram_frequency",
+    "articles_changelog",
+)
+# Bytes of the dump parsed per task, which bounds each worker's memory
+CHUNK_BYTES = 8 * 1024 * 1024
+
+# How the root start tag of every entry in the dumps begins
+ENTRY_START = f'<d:entry xmlns:d="{DICTIONARY_NAMESPACE}"'
+TITLE_START = ' d:title="'
+# The start tag with its double-quoted attribute values emptied
+START_TAG_SKELETON = re.compile(
+    r'<d:entry xmlns:d=""(?: (?:d:)?[A-Za-z_][\w.-]*="")*/?'
+)
+REFERENCE = re.compile(r"&(?:(amp|lt|gt|quot|apos)|#([0-9]+)|#x([0-9a-fA-F]+));")
+PREDEFINED_ENTITIES = {"amp": "&", "lt": "<", "gt": ">", "quot": '"', "apos": "'"}
+
+
+def _resolve_reference(match: re.Match) -> str:
+    name, decimal, hexadecimal = match.groups()
+    if name:
+        return PREDEFINED_ENTITIES[name]
+    code = int(decimal, 10) if decimal else int(hexadecimal, 16)
+    if code in (0x9, 0xA, 0xD) or (
+        0x20 <= code <= 0x10FFFF
+        and not (0xD800 <= code <= 0xDFFF or code in (0xFFFE, 0xFFFF))
+    ):
+        return chr(code)
+    raise ValueError(f"Invalid character reference {match[0]}")
+
+
+def scan_title(line: str) -> str | None:
+    """
+    Reads the title of one entry from its root start tag alone, with string
+    searches instead of an XML parser. Raises ValueError for start tags beyond
+    the plain ones of the dumps, which need the parser.
+    """
+    head, found, _ = line.partition(">")
+    if not found or not head.startswith(ENTRY_START) or "'" in head:
+        raise ValueError("Unrecognized entry start tag")
+    # Without single quotes, an even number of double quotes means that the
+    # first '>' closes the tag rather than sitting inside a value
+    parts = head.split('"')
+    if (
+        len(parts) % 2 == 0
+        or head.count("<") != 1
+        or not START_TAG_SKELETON.fullmatch('""'.join(parts[::2]))
+    ):
+        raise ValueError("Start tag needs an XML parser")
+    if head.count(TITLE_START) > 1:
+        raise ValueError("Duplicate d:title attribute")
+    title = head.partition(TITLE_START)[2].partition('"')[0]
+    if "\t" in title or "\n" in title or "\r" in title:
+        # XML normalizes these to spaces
+        raise ValueError("Title needs an XML parser")
+    if head.count("&") != title.count("&"):
+        raise ValueError("Entity outside of the title")
+    if "&" in title:
+        if "&" in REFERENCE.sub("", title):
+            raise ValueError("Unknown entity in title")
+        title = REFERENCE.sub(_resolve_reference, title)
+    return title or None
+
+
+def parse_title_xml(line: str) -> str | None:
+    """Returns the title of one entry, or None for entries that have none."""
+    # Each line is a self-contained XML document, with the title in the
+    # d:title attribute of the root <d:entry> tag
+    root = ET.fromstring(line)
+    # Fallback if namespaced attribute is not found
+    return root.get(TITLE_ATTRIBUTE) or root.get("d:title")
+
+
+def parse_title(line: str) -> str | None:
+    """
+    Returns the title of one entry, or None for entries that have none. Only
+    entries whose start tag scan_title cannot read are parsed as XML, so
+    errors after the start tag, or duplicates of attributes other than
+    d:title, go unnoticed.
+    """
+    try:
+        return scan_title(line)
+    except ValueError:
+        return parse_title_xml(line)
+
 
+def parse_titles(lines: Iterable[str]) -> Iterator[str]:
+    """Yields the titles of the entries on the lines, in order."""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            title = parse_title(line.strip())
+        except ET.ParseError as e:
+            print(f"Error parsing line: {e}", file=sys.stderr)
+            continue
+        if title and "^" not in title and "$" not in title:
+            yield title
 
-def process_dictionary(input_file, db_file):
+
+def byte_ranges(input_file: str, chunk_bytes: int = CHUNK_BYTES) -> list[range]:
+    """Splits the file into ranges of about chunk_bytes that end at a newline."""
+    size = os.path.getsize(input_file)
+    boundaries = [0]
+    with open(input_file, "rb") as f:
+        while boundaries[-1] < size:
+            f.seek(boundaries[-1] + chunk_bytes)
+            f.readline()
+            boundaries.append(min(f.tell(), size))
+    return [range(start, end) for start, end in itertools.pairwise(boundaries)]
+
+
+def parse_byte_range(input_file: str, byte_range: range) -> list[str]:
+    """Parses the titles of the lines in one range from byte_ranges."""
+    with open(input_file, "rb") as f:
+        f.seek(byte_range.start)
+        data = f.read(len(byte_range))
+    # Decoding the range like the whole file keeps the line splitting identical
+    return list(parse_titles(io.TextIOWrapper(io.BytesIO(data), encoding="utf-8")))
+
+
+def prepare_dictionary_db(db_file: str) -> sqlite3.Connection:
+    """
+    Opens db_file for a load from scratch, with empty articles and
+    ascii_words tables and none of the tables built from old articles.
+    """
     # Ensure the directory for the database exists
     os.makedirs(os.path.dirname(db_file), exist_ok=True)
 
-    # Connect to SQLite
     conn = sqlite3.connect(db_file)
+    # The database is rebuilt from scratch, so a crash only means running
+    # the script again: skip the journal and fsyncs during the load
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    # The bigram index and its changelog describe the old articles, so they
+    # go too; dropping articles drops its change tracking triggers
+    for table in DICTIONARY_TABLES:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.execute("CREATE TABLE articles (word_id INTEGER PRIMARY KEY, title TEXT)")
+    create_ascii_words(conn)
+    return conn
+
+
+def finish_dictionary_db(conn: sqlite3.Connection) -> None:
+    """Indexes the titles loaded into a prepare_dictionary_db database and commits."""
+    # Building the index once after the load is cheaper than maintaining it
+    conn.execute("CREATE INDEX idx_title ON articles (title)")
+    conn.commit()
+
+
+def load_articles(db_file: str, title_chunks: Iterable[list[str]]) -> int:
+    """
+    Replaces the articles of db_file with the titles, numbered from 1 in the
+    order they come in, rebuilds ascii_words and returns the word count.
+    """
+    conn = prepare_dictionary_db(db_file)
     cursor = conn.cursor()
 
-    # Create table with title and word_id columns
-    cursor.execute("DROP TABLE IF EXISTS articles")
-    cursor.execute("CREATE TABLE articles (word_id INTEGER PRIMARY KEY, title TEXT)")
-
-    # Use a generator to yield titles from the file
-    def get_entries():
-        word_id = 1
-        with open(input_file, encoding="utf-8") as f:
-            for line in f:
-                if not line.strip():
-                    continue
-                try:
-                    # Each line is an XML document
-                    # Using fromstring because each line is a self-contained XML
-                    root = ET.fromstring(line.strip())
-                    # The title is in the 'd:title' attribute of the root <d:entry> tag
-                    # The namespace is http://www.apple.com/DTDs/DictionaryService-1.0.rng
-                    title = root.get(
-                        "{http://www.apple.com/DTDs/DictionaryService-1.0.rng}title"
-                    )
-                    if not title:
-                        # Fallback if namespaced attribute is not found
-                        title = root.get("d:title")
-
-                    if title:
-                        if "^" in title or "$" in title:
-                            continue
-                        yield (word_id, title)
-                        word_id += 1
-                except ET.ParseError as e:
-                    print(f"Error parsing line: {e}", file=sys.stderr)
-                    continue
-
-    # Batch insert for performance
-    batch_size = 1000
-    batch = []
     count = 0
+    for titles in title_chunks:
+        cursor.executemany(
+            "INSERT INTO articles (word_id, title) VALUES (?, ?)",
+            enumerate(titles, start=count + 1),
+        )
+        count += len(titles)
+        print(f"Processed {count} entries...", end="\r")
+    # The whole load is a single transaction
+    conn.commit()
+    print(f"Processed {count} entries total.")
 
-    for entry in get_entries():
-        batch.append(entry)
-        if len(batch) >= batch_size:
-            cursor.executemany(
-                "INSERT INTO articles (word_id, title) VALUES (?, ?)", batch
-            )
-            conn.commit()
-            count += len(batch)
-            print(f"Processed {count} entries...", end="\r")
-            batch = []
-
-    if batch:
-        cursor.executemany("INSERT INTO articles (word_id, title) VALUES (?, ?)", batch)
-        conn.commit()
-        count += len(batch)
-        print(f"Processed {count} entries total.")
-
-    # Create index on title
+    # Dense numbering of the ASCII-only words for O(1) random sampling
+    print("Creating 'ascii_words'...")
+    create_ascii_words(conn)
     print("Creating index on 'title'...")
-    cursor.execute("CREATE INDEX idx_title ON articles (title)")
-    conn.commit()
+    finish_dictionary_db(conn)
 
     conn.close()
+    return count
+
+
+def process_dictionary(input_file, db_file, workers=None, chunk_bytes=CHUNK_BYTES):
+    ranges = byte_ranges(input_file, chunk_bytes)
+    workers = workers or os.cpu_count() or 1
+    with contextlib.ExitStack() as stack:
+        if workers > 1:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            # map() yields the chunks in file order, whatever order they finish in
+            chunks = executor.map(
+                parse_byte_range, itertools.repeat(input_file), ranges
+            )
+        else:
+            chunks = map(parse_byte_range, itertools.repeat(input_file), ranges)
+        load_articles(db_file, chunks)
     print("Done.")
 
 
@@ -84,4 +233,6 @@ if __name__ == "__main__":
         print(f"Error: Input file {input_path} not found.")
         sys.exit(1)
 
-    process_dictionary(input_path, output_path)
+    process_dictionary(
+        input_path, output_path, int(sys.argv[1]) if len(sys.argv) > 1 else None
+    )
@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 """Interactive visualization server for typing tutor statistics."""
 
+import contextlib
 import math
 import sqlite3
+import sys
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -10,6 +12,11 @@ import plotly.graph_objects as go
 from flask import Flask, render_template_string
 from plotly.subplots import make_subplots
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from analytics import load_lesson_stats, running_decayed_means
+from tutor import read_bigram_weights
+
 app = Flask(__name__)
 DB_PATH = Path(__file__).parent.parent / "stats.db"
 ONE_WEEK = 7 * 24 * 3600
@@ -78,86 +85,43 @@ HTML_TEMPLATE = """
 """
 
 
+def connect() -> sqlite3.Connection:
+    """
+    Opens stats.db read-only: the tutor owns the schema, and a page view must
+    not migrate, backfill or rebase the tables under a running tutor.
+    """
+    return sqlite3.connect(f"{DB_PATH.as_uri()}?mode=ro", uri=True)
+
+
 def get_bigram_weights() -> dict[str, float]:
-    now = __import__("time").time()
-    with sqlite3.connect(DB_PATH) as conn:
-        rows = conn.execute("SELECT word, char_index, timestamp FROM mistakes").fetchall()
-    weights: dict[str, float] = {}
-    for word, index, ts in rows:
-        bigram = (f"^{word[0].lower()}" if index == 0 else word[index - 1 : index + 1].lower())
-        weights[bigram] = weights.get(bigram, 0) + math.exp((ts - now) / ONE_WEEK)
-    return weights
-
-
-def compute_arrhythmicity(timestamps_ns):
-    """Compute standard deviation of inter-key intervals."""
-    if len(timestamps_ns) < 3:
-        return None
-    intervals = [(timestamps_ns[i + 1] - timestamps_ns[i]) / 1e9 for i in range(len(timestamps_ns) - 1)]
-    if len(intervals) < 2:
-        return None
-    mean_val = sum(intervals) / len(intervals)
-    variance = sum((x - mean_val) ** 2 for x in intervals) / (len(intervals) - 1)
-    return math.sqrt(variance)
+    with contextlib.closing(connect()) as conn:
+        return read_bigram_weights(conn)
 
 
 def get_lesson_stats():
     """Fetch all lessons with computed accuracy, CPS, and arrhythmicity."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT id, timestamp, text_required, text_typed, duration FROM lessons WHERE duration IS NOT NULL ORDER BY timestamp"
+    # lesson_stats also covers lessons whose key presses were compacted away
+    with contextlib.closing(connect()) as conn:
+        history = load_lesson_stats(conn)
+
+    return [
+        {
+            "timestamp": ts,
+            "date": datetime.fromtimestamp(ts).date(),
+            "accuracy": accuracy,
+            "cps": cps,
+            "arrhythmicity": None if math.isnan(arrhythmicity) else arrhythmicity,
+            "lesson_id": lesson_id,
+        }
+        for lesson_id, ts, accuracy, cps, arrhythmicity in zip(
+            history.lesson_ids.tolist(),
+            history.timestamps.tolist(),
+            history.accuracy.tolist(),
+            history.cps.tolist(),
+            history.arrhythmicity.tolist(),
+            strict=True,
         )
-        rows = cursor.fetchall()
-        
-        cursor.execute("SELECT lesson_id, timestamp FROM key_presses ORDER BY lesson_id, timestamp ASC")
-        kp_rows = cursor.fetchall()
-
-    # Group key presses by lesson
-    from collections import defaultdict
-    kp_map = defaultdict(list)
-    for lid, ts in kp_rows:
-        kp_map[lid].append(ts)
-
-    stats = []
-    for lesson_id, ts, text_required, text_typed, duration in rows:
-        # Compute accuracy
-        mistakes = 0
-        total_typed = 0
-        processed_typed = ""
-        for char in text_typed:
-            if char == "\b":
-                if processed_typed:
-                    processed_typed = processed_typed[:-1]
-            else:
-                total_typed += 1
-                if len(processed_typed) < len(text_required):
-                    if char != text_required[len(processed_typed)]:
-                        mistakes += 1
-                processed_typed += char
-
-        if total_typed == 0:
-            continue
-
-        accuracy = ((total_typed - mistakes) / total_typed) * 100
-        cps = len(processed_typed) / duration if duration > 0 else 0
-        date = datetime.fromtimestamp(ts).date()
-        
-        # Compute arrhythmicity
-        arrhythmicity = compute_arrhythmicity(kp_map.get(lesson_id, []))
-
-        stats.append(
-            {
-                "timestamp": ts,
-                "date": date,
-                "accuracy": accuracy,
-                "cps": cps,
-                "arrhythmicity": arrhythmicity,
-                "lesson_id": lesson_id,
-            }
-        )
-
-    return stats
+    ]
 
 
 def aggregate_by_date(stats):
@@ -187,38 +151,17 @@ def apply_exponential_smoothing(daily_stats):
     if not daily_stats:
         return [], [], []
 
+    import numpy as np
+
     now = daily_stats[-1]["timestamp"]
-    
-    # Compute weights
-    total_weight = 0.0
-    weighted_acc = 0.0
-    weighted_cps = 0.0
-    weighted_arr = 0.0
-    total_weight_arr = 0.0
-    
-    smoothed_acc = []
-    smoothed_cps = []
-    smoothed_arr = []
-    
-    for i, stat in enumerate(daily_stats):
-        t_weeks = (stat["timestamp"] - now) / ONE_WEEK
-        weight = math.exp(t_weeks)
-        
-        total_weight += weight
-        weighted_acc += stat["accuracy"] * weight
-        weighted_cps += stat["cps"] * weight
-        
-        smoothed_acc.append(weighted_acc / total_weight if total_weight > 0 else stat["accuracy"])
-        smoothed_cps.append(weighted_cps / total_weight if total_weight > 0 else stat["cps"])
-        
-        if stat["arrhythmicity"] is not None:
-            total_weight_arr += weight
-            weighted_arr += stat["arrhythmicity"] * weight
-            smoothed_arr.append(weighted_arr / total_weight_arr if total_weight_arr > 0 else stat["arrhythmicity"])
-        else:
-            smoothed_arr.append(None)
-    
-    return smoothed_acc, smoothed_cps, smoothed_arr
+    timestamps = np.array([d["timestamp"] for d in daily_stats], dtype=np.float64)
+
+    def smooth(key):
+        values = np.array([np.nan if d[key] is None else d[key] for d in daily_stats])
+        smoothed = running_decayed_means(timestamps, values, now)
+        return [None if np.isnan(values[i]) else float(v) for i, v in enumerate(smoothed)]
+
+    return smooth("accuracy"), smooth("cps"), smooth("arrhythmicity")
 
 
 def compute_pareto_frontier(stats):
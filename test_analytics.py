@@ -0,0 +1,187 @@
+import math
+import random
+import time
+
+import numpy as np
+import pytest
+
+from analytics import (
+    decode_varints,
+    ema_sums,
+    interval_stats,
+    load_lesson_history,
+    replay_typed_texts,
+    running_decayed_means,
+)
+from tutor import (
+    ONE_WEEK,
+    KeyPressLog,
+    LessonSummary,
+    StatsManager,
+    compute_arrhythmicity,
+    replay_typed_text,
+)
+
+
+@pytest.fixture
+def stats_manager(tmp_path):
+    manager = StatsManager(str(tmp_path / "stats.db"))
+    yield manager
+    manager.close()
+
+
+def _record_random_lessons(stats_manager, count, seed=0):
+    rng = random.Random(seed)
+    now = time.time()
+    lessons = []
+    for i in range(count):
+        text_required = "".join(rng.choices("abc ", k=rng.randint(1, 12)))
+        text_typed = "".join(rng.choices("abc \b", k=rng.randint(0, 15)))
+        timestamps = [rng.randint(0, 10**9)]
+        for _ in range(rng.randint(0, 6)):
+            timestamps.append(timestamps[-1] + rng.randint(10**7, 10**9))
+        key_presses = list(enumerate(timestamps))
+        timestamp = now - (count - i) * 3600
+        stats_manager.record_lesson(
+            timestamp, text_required, text_typed, rng.uniform(0.5, 5), key_presses
+        )
+        lessons.append((timestamp, text_required, text_typed, timestamps))
+    stats_manager.flush()
+    return lessons
+
+
+@pytest.mark.parametrize(
+    ("text_required", "text_typed", "expected"),
+    [
+        ("abc", "", (0, 0, 0)),
+        ("", "ab", (0, 2, 2)),
+        ("abc", "abc", (0, 3, 3)),
+        ("abc", "axc", (1, 3, 3)),
+        ("abc", "ax\bbc", (1, 4, 3)),
+        ("abc", "\b\ba\b\babc", (0, 4, 3)),
+        ("ab", "abcd\b\b\b", (0, 4, 1)),
+        ("héllo", "hèllo", (1, 5, 5)),
+    ],
+)
+def test_replay_typed_texts_cases(text_required, text_typed, expected):
+    assert replay_typed_text(text_required, text_typed) == expected
+    # The same lesson in a batch, between others that must not leak into it
+    mistakes, total_typed, final_length = replay_typed_texts(
+        ["xyz", text_required, "a"], ["\b\bxy\b", text_typed, "\b\b\b"]
+    )
+    assert (mistakes[1], total_typed[1], final_length[1]) == expected
+
+
+def test_replay_typed_texts_match_scalar_replay():
+    rng = random.Random(2)
+    texts_required = [
+        "".join(rng.choices("ab ", k=rng.randint(0, 20))) for _ in range(500)
+    ]
+    texts_typed = [
+        "".join(rng.choices("ab \b", k=rng.randint(0, 30))) for _ in range(500)
+    ]
+
+    mistakes, total_typed, final_length = replay_typed_texts(
+        texts_required, texts_typed
+    )
+    for i, (required, typed) in enumerate(
+        zip(texts_required, texts_typed, strict=True)
+    ):
+        assert (mistakes[i], total_typed[i], final_length[i]) == replay_typed_text(
+            required, typed
+        )
+    assert [a.tolist() for a in replay_typed_texts([], [])] == [[], [], []]
+
+
+def test_decode_varints_matches_key_press_log():
+    rng = random.Random(3)
+    logs = []
+    for _ in range(50):
+        log = KeyPressLog()
+        timestamp = rng.randint(0, 2**62)
+        for _ in range(rng.randint(0, 10)):
+            timestamp += rng.randint(0, 10**10)
+            log.append((rng.randint(0, 300), timestamp))
+        logs.append(log)
+
+    values = decode_varints(
+        np.frombuffer(b"".join(log.encode() for log in logs), dtype=np.uint8)
+    )
+    expected = []
+    for log in logs:
+        for column in (log.char_indices, log.timestamps):
+            expected += np.diff(column, prepend=0).tolist()
+    assert values.tolist() == expected
+
+
+def test_interval_stats_match_per_lesson_definition():
+    rng = random.Random(1)
+    lesson_ids, timestamps, expected = [], [], {}
+    for lesson_id in range(1, 50):
+        lesson = sorted(rng.sample(range(10**10), rng.randint(1, 8)))
+        lesson_ids += [lesson_id] * len(lesson)
+        timestamps += lesson
+        expected[lesson_id] = (len(lesson), compute_arrhythmicity(lesson))
+
+    ids, keystrokes, stddev = interval_stats(
+        np.array(lesson_ids, dtype=np.int64), np.array(timestamps, dtype=np.int64)
+    )
+    assert ids.tolist() == list(expected)
+    for lesson_id, count, value in zip(ids, keystrokes, stddev, strict=True):
+        expected_count, expected_value = expected[lesson_id]
+        assert count == expected_count
+        if expected_value is None:
+            assert math.isnan(value)
+        else:
+            assert value == pytest.approx(expected_value, rel=1e-9)
+
+
+def test_lesson_history_matches_lesson_summaries(stats_manager):
+    lessons = _record_random_lessons(stats_manager, 200)
+    with stats_manager.pool.connection() as conn:
+        history = load_lesson_history(conn)
+        durations = dict(conn.execute("SELECT id, duration FROM lessons"))
+
+    summaries = {}
+    for lesson_id, (_, text_required, text_typed, timestamps) in enumerate(
+        lessons, start=1
+    ):
+        summary = LessonSummary.from_lesson(
+            text_required, text_typed, durations[lesson_id], timestamps
+        )
+        if summary is not None:
+            summaries[lesson_id] = summary
+
+    assert history.lesson_ids.tolist() == list(summaries)
+    for i, lesson_id in enumerate(history.lesson_ids.tolist()):
+        summary = summaries[lesson_id]
+        assert history.cps[i] == pytest.approx(summary.cps)
+        assert history.accuracy[i] == pytest.approx(summary.accuracy)
+        assert history.keystrokes[i] == summary.keystrokes
+        if summary.arrhythmicity is None:
+            assert math.isnan(history.arrhythmicity[i])
+        else:
+            assert history.arrhythmicity[i] == pytest.approx(summary.arrhythmicity)
+
+
+def test_ema_sums_match_incremental_ema(stats_manager):
+    _record_random_lessons(stats_manager, 100)
+    with stats_manager.pool.connection() as conn:
+        history = load_lesson_history(conn)
+
+    weight, cps, accuracy, arr_weight, arrhythmicity = ema_sums(history, time.time())
+    ema_cps, ema_accuracy, ema_arrhythmicity = stats_manager.get_ema_stats()
+    assert cps / weight == pytest.approx(ema_cps)
+    assert accuracy / weight == pytest.approx(ema_accuracy)
+    assert arrhythmicity / arr_weight == pytest.approx(ema_arrhythmicity)
+
+
+def test_running_decayed_means_skip_missing_values():
+    timestamps = np.array([0.0, ONE_WEEK, 2 * ONE_WEEK])
+    values = np.array([np.nan, 1.0, 3.0])
+    means = running_decayed_means(timestamps, values, now=2 * ONE_WEEK)
+
+    assert math.isnan(means[0])
+    assert means[1] == pytest.approx(1.0)
+    w1, w2 = math.exp(-1), 1.0
+    assert means[2] == pytest.approx((w1 * 1.0 + w2 * 3.0) / (w1 + w2))
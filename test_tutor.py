@@ -1,9 +1,36 @@
+import curses
+import importlib.util
+import itertools
+import math
+import os
+import random
 import sqlite3
+import threading
 import time
+from collections import Counter
+from pathlib import Path
 
 import pytest
 
-from tutor import LessonGenerator, LessonSession, LessonWord, StatsManager
+import tutor
+from tutor import (
+    EMA_COLUMNS,
+    BigramIndex,
+    ConnectionPool,
+    IntervalStats,
+    KeyPressLog,
+    LessonGenerator,
+    LessonPrefetcher,
+    LessonRenderer,
+    LessonSession,
+    LessonWord,
+    StatsManager,
+    WriteBehindQueue,
+    calculate_layout,
+    compute_arrhythmicity,
+    create_ascii_words,
+    read_bigram_weights,
+)
 
 
 @pytest.fixture
@@ -139,6 +166,28 @@ def test_lesson_session_mistake_recording_after_backspace(stats_manager):
         assert rows[1][0] == "y"
 
 
+def test_lesson_session_maps_characters_to_words(stats_manager):
+    lesson = [
+        LessonWord(word_id=1, original="ab", display="Ab", separator=", "),
+        LessonWord(word_id=2, original="cd", display="cd", separator=" "),
+        LessonWord(word_id=1, original="ab", display="ab", separator="."),
+    ]
+    session = LessonSession(lesson, stats_manager)
+
+    # Full text: "Ab, cd ab."; a mistake in each word and one on a separator
+    for c in "Ab; xd ax.":
+        session.handle_key(ord(c))
+
+    with sqlite3.connect(stats_manager.db_path) as conn:
+        rows = conn.execute(
+            "SELECT word, char_index, typed_char FROM mistakes ORDER BY rowid"
+        ).fetchall()
+    assert rows == [("cd", 0, "x"), ("ab", 1, "x")]
+    assert session.mistakes_count == 3
+    # A word is completed once, even if it appears twice in the lesson
+    assert session.completed_word_ids_ordered == [1, 2]
+
+
 def test_lesson_full_storage(stats_manager):
     lesson = [
         LessonWord(word_id=1, original="apple", display="Apple", separator=", "),
@@ -281,16 +330,53 @@ def test_key_press_storage(stats_manager):
     with sqlite3.connect(stats_manager.db_path) as conn:
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT char_index, timestamp FROM key_presses WHERE lesson_id=?",
+            "SELECT keystrokes, data FROM lesson_key_presses WHERE lesson_id=?",
             (lesson_id,),
         )
-        rows = cursor.fetchall()
-        assert len(rows) == 2
+        keystrokes, data = cursor.fetchone()
+        rows = list(KeyPressLog.decode(data))
+        assert keystrokes == len(rows) == 2
         assert rows[0][0] == 0
         assert rows[1][0] == 1
         assert rows[0][1] == session.key_presses[0][1]
 
 
+def test_lesson_session_typed_buffers(stats_manager):
+    lesson = [LessonWord(word_id=1, original="ab", display="ab", separator=" ")]
+    session = LessonSession(lesson, stats_manager)
+
+    # Backspace on an empty buffer is still typed, but deletes nothing
+    session.handle_key(curses.KEY_BACKSPACE)
+    assert session.typed_chars.tounicode() == ""
+    assert session.raw_typed_chars.tounicode() == "\b"
+    for ch in (ord("a"), ord("x"), 127, ord("b")):
+        session.handle_key(ch)
+    assert session.typed_chars.tounicode() == session.typed_text == "ab"
+    assert session.raw_typed_chars.tounicode() == session.raw_typed_text == "\bax\bb"
+    assert [char_index for char_index, _ in session.key_presses] == [0, 1, 2, 3, 4]
+
+    # The str views can be assigned as before
+    session.typed_text = "a"
+    session.raw_typed_text = "a"
+    assert session.typed_chars.tounicode() == session.raw_typed_chars.tounicode() == "a"
+    session.handle_key(ord("b"))
+    assert session.typed_text == session.raw_typed_text == "ab"
+
+    session.key_presses = [(0, 10), (1, 30), (2, 40)]
+    assert isinstance(session.key_presses, KeyPressLog)
+    assert list(session.key_presses) == [(0, 10), (1, 30), (2, 40)]
+    assert session.get_stats().duration == pytest.approx(30e-9)
+
+    lesson_id = stats_manager.record_lesson(
+        time.time(), session.full_text, session.raw_typed_text, 1.0, session.key_presses
+    )
+    with sqlite3.connect(stats_manager.db_path) as conn:
+        (data,) = conn.execute(
+            "SELECT data FROM lesson_key_presses WHERE lesson_id = ?", (lesson_id,)
+        ).fetchone()
+    assert list(KeyPressLog.decode(data)) == [(0, 10), (1, 30), (2, 40)]
+
+
 def test_arrhythmicity_calculation(stats_manager):
     lesson = [LessonWord(word_id=1, original="test", display="Test", separator=" ")]
     session = LessonSession(lesson, stats_manager)
@@ -319,6 +405,35 @@ def test_arrhythmicity_calculation(stats_manager):
     assert session.get_stats().arrhythmicity == pytest.approx(0.0707, rel=1e-2)
 
 
+def _two_pass_stddev(intervals):
+    mean = sum(intervals) / len(intervals)
+    return math.sqrt(sum((x - mean) ** 2 for x in intervals) / (len(intervals) - 1))
+
+
+def test_interval_stats_match_two_pass_definition(stats_manager):
+    rng = random.Random(0)
+    timestamps = [10**12]
+    for _ in range(500):
+        timestamps.append(timestamps[-1] + rng.randint(50, 900) * 10**6)
+
+    lesson = [LessonWord(word_id=1, original="test", display="Test", separator=" ")]
+    session = LessonSession(lesson, stats_manager, start_time=time.time())
+    session.key_presses = list(enumerate(timestamps))
+    intervals = [(b - a) / 1e9 for a, b in itertools.pairwise(timestamps)]
+    expected = _two_pass_stddev(intervals)
+    assert session.get_stats().arrhythmicity == pytest.approx(expected, rel=1e-12)
+    assert compute_arrhythmicity(timestamps) == pytest.approx(expected, rel=1e-12)
+
+    # Merging two lessons gives the statistics of all their intervals
+    first = IntervalStats.from_timestamps(timestamps[:200])
+    second = IntervalStats.from_timestamps(timestamps[200:])
+    merged = first.merge(second)
+    assert merged.count == len(timestamps) - 2
+    del intervals[199]  # the gap between the two lessons
+    assert merged.stddev() == pytest.approx(_two_pass_stddev(intervals), rel=1e-12)
+    assert IntervalStats().merge(IntervalStats()).stddev() is None
+
+
 def test_ema_arrhythmicity(stats_manager):
     # Record a lesson with known arrhythmicity
     t1 = 1000000000
@@ -341,3 +456,926 @@ def test_ema_arrhythmicity(stats_manager):
     # Both lessons are "now" (same weight 1.0)
     # Average of 0.0707 and 0.0 = 0.03535
     assert arr == pytest.approx(0.03535, rel=1e-2)
+
+
+def test_connection_pool_reuses_connection(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), synchronous="full")
+    conn = pool.connection()
+    assert pool.connection() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 2  # FULL
+
+    pool.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+    assert pool.connection() is not conn
+
+
+def test_connection_pool_rejects_unknown_synchronous(tmp_path):
+    with pytest.raises(ValueError, match="unknown synchronous level"):
+        ConnectionPool(str(tmp_path / "pool.db"), synchronous="sometimes")
+
+
+def test_write_behind_mistakes_are_flushed(tmp_path):
+    stats_manager = StatsManager(str(tmp_path / "stats.db"), write_behind=True)
+    lesson = [LessonWord(word_id=1, original="abc", display="abc", separator=" ")]
+    session = LessonSession(lesson, stats_manager)
+    for c in "xyz":
+        session.handle_key(ord(c))
+
+    # Reads see queued writes
+    assert stats_manager.get_bigram_weights().keys() == {"^a", "ab", "bc"}
+
+    for _ in range(100):
+        stats_manager.record_mistake("abc", 1, "x")
+    stats_manager.close()
+
+    with sqlite3.connect(stats_manager.db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM mistakes").fetchone()[0] == 103
+
+
+def test_write_behind_reports_failed_batches(tmp_path):
+    stats_manager = StatsManager(str(tmp_path / "stats.db"), write_behind=True)
+    assert stats_manager.writer is not None
+    stats_manager.writer.submit(
+        ("INSERT INTO mistakes (word) VALUES (?)", [("a",)]),
+        ("INSERT INTO no_such_table VALUES (?)", [(1,)]),
+    )
+    with pytest.raises(sqlite3.OperationalError, match="no_such_table"):
+        stats_manager.flush()
+
+    # The failed group was rolled back as a whole
+    with sqlite3.connect(stats_manager.db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM mistakes").fetchone()[0] == 0
+    stats_manager.close()
+
+
+def test_write_behind_drops_only_the_failing_groups(tmp_path):
+    db_path = str(tmp_path / "stats.db")
+    StatsManager(db_path).close()
+    # The writer cannot start until every group is queued, so that they all
+    # land in one batch
+    started = threading.Event()
+    pool = ConnectionPool(db_path, setup=lambda _conn: started.wait())
+    writer = WriteBehindQueue(pool)
+    for i in range(10):
+        if i == 5:
+            writer.submit(("INSERT INTO no_such_table VALUES (?)", [(1,)]))
+        writer.submit(("INSERT INTO mistakes (word) VALUES (?)", [(str(i),)]))
+    writer.submit(
+        ("INSERT INTO mistakes (word) VALUES (?)", [("partial",)]),
+        ("INSERT INTO mistakes (no_such_column) VALUES (?)", [(1,)]),
+    )
+    started.set()
+
+    with pytest.raises(ExceptionGroup) as excinfo:
+        writer.flush()
+    assert len(excinfo.value.exceptions) == 2
+    writer.close()
+    pool.close()
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute("SELECT word FROM mistakes ORDER BY rowid").fetchall()
+    assert rows == [(str(i),) for i in range(10)]
+
+
+def test_bigram_weights_backfilled_from_existing_mistakes(tmp_path):
+    db_path = str(tmp_path / "stats.db")
+    one_week = 7 * 24 * 3600
+    now = time.time()
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE mistakes (word TEXT, char_index INTEGER, typed_char TEXT, timestamp REAL)"
+        )
+        conn.executemany(
+            "INSERT INTO mistakes VALUES (?, ?, ?, ?)",
+            [("these", 1, "x", now - one_week), ("Think", 0, "x", now)],
+        )
+
+    stats_manager = StatsManager(db_path)
+    stats_manager.record_mistake("other", 2, "x")
+    weights = stats_manager.get_bigram_weights()
+
+    assert weights.keys() == {"th", "^t"}
+    assert weights["th"] == pytest.approx(math.exp(-1) + 1, rel=1e-3)
+    assert weights["^t"] == pytest.approx(1, rel=1e-3)
+
+
+def test_bigram_weights_epoch_rebase(stats_manager):
+    stats_manager.record_mistake("these", 1, "x")
+    before = stats_manager.get_bigram_weights()
+
+    # Pretend the aggregate was started two years ago
+    two_years = 104 * 7 * 24 * 3600
+    with sqlite3.connect(stats_manager.db_path) as conn:
+        conn.execute("UPDATE decay_epochs SET epoch = epoch - ?", (two_years,))
+        conn.execute("UPDATE bigram_weights SET weight = weight * ?", (math.exp(104),))
+
+    reopened = StatsManager(stats_manager.db_path)
+    with sqlite3.connect(stats_manager.db_path) as conn:
+        (epoch,) = conn.execute("SELECT epoch FROM decay_epochs").fetchone()
+        (stored,) = conn.execute("SELECT weight FROM bigram_weights").fetchone()
+    assert epoch == pytest.approx(time.time(), abs=60)
+    assert stored == pytest.approx(1, rel=1e-3)
+    assert reopened.get_bigram_weights()["th"] == pytest.approx(before["th"], rel=1e-6)
+
+
+def test_bigram_weights_survive_a_rebase_by_another_process(stats_manager):
+    stats_manager.record_mistake("these", 1, "x")
+    two_years = 104 * 7 * 24 * 3600
+    with sqlite3.connect(stats_manager.db_path) as conn:
+        conn.execute("UPDATE decay_epochs SET epoch = epoch - ?", (two_years,))
+        conn.execute("UPDATE bigram_weights SET weight = weight * ?", (math.exp(104),))
+
+    # Another process opens stats.db and rebases the table under the first
+    StatsManager(stats_manager.db_path).close()
+    assert stats_manager.get_bigram_weights()["th"] == pytest.approx(1, rel=1e-3)
+    stats_manager.record_mistake("these", 1, "x")
+    assert stats_manager.get_bigram_weights()["th"] == pytest.approx(2, rel=1e-3)
+    with sqlite3.connect(stats_manager.db_path) as conn:
+        assert read_bigram_weights(conn)["th"] == pytest.approx(2, rel=1e-3)
+
+    stats_manager.compact(epsilon=1.5)
+    assert stats_manager.get_bigram_weights().keys() == {"th"}
+
+
+def test_lesson_summary_recorded_once(stats_manager):
+    kp = [(0, 1000000000), (1, 1200000000), (2, 1500000000)]
+    lesson_id = stats_manager.record_lesson(time.time(), "abc", "ax\bbc", 0.5, kp)
+
+    with sqlite3.connect(stats_manager.db_path) as conn:
+        row = conn.execute(
+            "SELECT cps, accuracy, arrhythmicity, keystrokes FROM lesson_stats WHERE lesson_id = ?",
+            (lesson_id,),
+        ).fetchone()
+    assert row[0] == pytest.approx(6.0)  # 3 chars / 0.5s
+    assert row[1] == pytest.approx(75.0)  # 4 typed, 1 mistake
+    assert row[2] == pytest.approx(0.0707, rel=1e-2)
+    assert row[3] == 3
+
+
+def test_ema_stats_backfilled_for_existing_lessons(tmp_path):
+    db_path = str(tmp_path / "stats.db")
+    one_week = 7 * 24 * 3600
+    now = time.time()
+    # A database recorded before lesson_stats existed
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE lessons (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp REAL NOT NULL, text_required TEXT NOT NULL, text_typed TEXT NOT NULL, duration REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE key_presses (lesson_id INTEGER, char_index INTEGER, timestamp INTEGER)"
+        )
+        conn.executemany(
+            "INSERT INTO lessons (timestamp, text_required, text_typed, duration) VALUES (?, ?, ?, ?)",
+            [
+                (now - one_week, "abc", "abc", 0.3),
+                (now, "abcd", "axcy", 0.2),
+                (now, "abcd", "", None),
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO key_presses VALUES (2, ?, ?)",
+            [(0, 2000000000), (1, 2100000000), (2, 2200000000)],
+        )
+
+    stats_manager = StatsManager(db_path)
+    ema_cps, ema_acc, ema_arr = stats_manager.get_ema_stats()
+    assert ema_cps == pytest.approx(17.31, rel=1e-2)
+    assert ema_acc == pytest.approx(63.45, rel=1e-2)
+    assert ema_arr == pytest.approx(0.0)
+
+    # An explicit rebuild gives the same result
+    assert stats_manager.backfill_lesson_stats() == 2
+    assert stats_manager.get_ema_stats() == pytest.approx((ema_cps, ema_acc, ema_arr))
+
+
+def test_ema_stats_survive_a_backfill_by_another_process(stats_manager):
+    now = time.time()
+    stats_manager.record_lesson(now - 3600, "ab", "ab", 1.0)
+    # Pretend the accumulator was started ten weeks ago
+    with sqlite3.connect(stats_manager.db_path) as conn:
+        conn.execute(
+            "UPDATE decay_epochs SET epoch = epoch - ? WHERE name = 'ema_stats'",
+            (10 * 7 * 24 * 3600,),
+        )
+        conn.execute(
+            f"UPDATE ema_stats SET {', '.join(f'{c} = {c} * ?' for c in EMA_COLUMNS)}",
+            (math.exp(10),) * len(EMA_COLUMNS),
+        )
+
+    # scripts/backfill_stats.py resets the epoch under the running tutor
+    other = StatsManager(stats_manager.db_path)
+    assert other.backfill_lesson_stats() == 1
+    other.close()
+    stats_manager.record_lesson(now, "abcd", "abcd", 1.0)
+
+    rebuilt = StatsManager(stats_manager.db_path)
+    rebuilt.backfill_lesson_stats()
+    # Both lessons weigh about the same: the CPS EMA is halfway between them
+    assert stats_manager.get_ema_stats()[0] == pytest.approx(3, rel=1e-3)
+    assert stats_manager.get_ema_stats() == pytest.approx(rebuilt.get_ema_stats())
+
+
+# Queries that read a whole table by design: every bigram weight, and the
+# single-row EMA accumulator
+WHOLE_TABLE_READS = {"bigram_weights", "ema_stats"}
+
+
+def test_stats_queries_do_not_scan_tables(stats_manager):
+    statements = []
+    conn = stats_manager.pool.connection()
+    conn.set_trace_callback(statements.append)
+    try:
+        stats_manager.record_mistake("these", 1, "x")
+        lesson_id = stats_manager.record_lesson(
+            time.time(), "ab", "ab", 1.0, [(0, 1), (1, 2)]
+        )
+        stats_manager.record_lesson_words(lesson_id, [1, 2])
+        stats_manager.get_bigram_weights()
+        stats_manager.get_recently_typed_ids()
+        stats_manager.get_ema_stats()
+    finally:
+        conn.set_trace_callback(None)
+
+    queries = [
+        sql
+        for sql in statements
+        if sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE"))
+    ]
+    assert any("lesson_words" in sql for sql in queries)
+    for sql in queries:
+        for *_, detail in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+            if detail.startswith("SCAN ") and "INDEX" not in detail:
+                assert detail.split()[1] in WHOLE_TABLE_READS, (sql, detail)
+
+
+def test_stats_index_migration(tmp_path):
+    db_path = str(tmp_path / "stats.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE lessons (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp REAL NOT NULL, text_required TEXT NOT NULL, text_typed TEXT NOT NULL, duration REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE lesson_words (id INTEGER PRIMARY KEY AUTOINCREMENT, lesson_id INTEGER, word_id INTEGER, timestamp REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE mistakes (word TEXT, char_index INTEGER, typed_char TEXT, timestamp REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE key_presses (lesson_id INTEGER, char_index INTEGER, timestamp INTEGER)"
+        )
+        conn.executemany(
+            "INSERT INTO key_presses VALUES (?, ?, ?)",
+            [(2, 1, 20), (1, 0, 10), (2, 0, 15), (1, 1, 12)],
+        )
+        migration = Path(__file__).parent / "migrations" / "004_stats_indexes.sql"
+        conn.executescript(migration.read_text())
+
+        assert conn.execute("SELECT * FROM key_presses").fetchall() == [
+            (1, 0, 10),
+            (1, 1, 12),
+            (2, 0, 15),
+            (2, 1, 20),
+        ]
+        sql = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'key_presses'"
+        ).fetchone()[0]
+        assert "WITHOUT ROWID" in sql
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT word_id FROM lesson_words WHERE timestamp > 0"
+        ).fetchall()
+        assert "COVERING INDEX idx_lesson_words_timestamp" in plan[0][-1]
+
+
+def test_compaction_keeps_aggregates_within_epsilon(stats_manager, monkeypatch):
+    now = time.time()
+    one_week = 7 * 24 * 3600
+    clock = [now - 30 * one_week]
+    monkeypatch.setattr(time, "time", lambda: clock[0])
+    # An old mistake on its own bigram, and old lessons
+    stats_manager.record_mistake("qz", 1, "x")
+    stats_manager.record_mistake("these", 1, "x")
+    stats_manager.record_lesson(clock[0], "abc", "abx", 1.0, [(0, 1), (1, 3), (2, 7)])
+    clock[0] = now
+    stats_manager.record_mistake("these", 1, "x")
+    stats_manager.record_lesson(now, "abc", "abc", 0.5, [(0, 1), (1, 2), (2, 4)])
+
+    weights = stats_manager.get_bigram_weights()
+    ema_stats = stats_manager.get_ema_stats()
+    result = stats_manager.compact(horizon_weeks=12, epsilon=1e-6)
+    assert (result.mistakes, result.key_presses, result.bigrams) == (2, 3, 1)
+
+    compacted = stats_manager.get_bigram_weights()
+    assert set(weights) - set(compacted) == {"qz"}
+    assert weights["qz"] < 1e-6
+    assert compacted["th"] == pytest.approx(weights["th"])
+    assert stats_manager.get_ema_stats() == pytest.approx(ema_stats)
+
+    # Rebuilding the summaries keeps those of the compacted lessons
+    assert stats_manager.backfill_lesson_stats() == 1
+    assert stats_manager.get_ema_stats() == pytest.approx(ema_stats)
+    with sqlite3.connect(stats_manager.db_path) as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        assert conn.execute(
+            "SELECT lesson_id, keystrokes FROM lesson_key_presses"
+        ).fetchall() == [(2, 3)]
+
+
+def test_key_press_log_round_trips_through_varints():
+    key_presses = KeyPressLog()
+    for char_index, timestamp in [(0, 10**18), (1, 10**18 + 5), (0, 10**18 + 7)]:
+        key_presses.append((char_index, timestamp))
+    data = key_presses.encode()
+    assert list(KeyPressLog.decode(data)) == list(key_presses)
+    assert KeyPressLog.decode(data).intervals.stddev() == key_presses.intervals.stddev()
+    assert list(KeyPressLog.decode(KeyPressLog().encode())) == []
+
+
+def _load_module(path):
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_legacy_key_presses_migration(tmp_path):
+    db_path = str(tmp_path / "stats.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE lessons (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp REAL NOT NULL, text_required TEXT NOT NULL, text_typed TEXT NOT NULL, duration REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE key_presses (lesson_id INTEGER, char_index INTEGER, timestamp INTEGER)"
+        )
+        conn.executemany(
+            "INSERT INTO key_presses VALUES (?, ?, ?)",
+            [(2, 1, 20), (1, 0, 10), (2, 0, 15), (1, 1, 12), (2, 2, 11)],
+        )
+        migration = Path(__file__).parent / "migrations" / "005_key_press_blobs.py"
+        _load_module(migration).migrate(conn)
+
+        rows = conn.execute(
+            "SELECT lesson_id, keystrokes, data FROM lesson_key_presses"
+        ).fetchall()
+        assert [
+            (lesson_id, keystrokes, list(KeyPressLog.decode(data)))
+            for lesson_id, keystrokes, data in rows
+        ] == [(1, 2, [(0, 10), (1, 12)]), (2, 3, [(2, 11), (0, 15), (1, 20)])]
+        assert (
+            conn.execute(
+                "SELECT name FROM sqlite_master WHERE name = 'key_presses'"
+            ).fetchall()
+            == []
+        )
+
+
+def test_legacy_key_presses_converted_at_startup(tmp_path):
+    db_path = str(tmp_path / "stats.db")
+    rows = [
+        (lesson_id, i, lesson_id * 100 + i) for lesson_id in (1, 2, 3) for i in range(4)
+    ]
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE key_presses (lesson_id INTEGER, char_index INTEGER, timestamp INTEGER)"
+        )
+        conn.executemany("INSERT INTO key_presses VALUES (?, ?, ?)", rows)
+    StatsManager(db_path).close()
+
+    with sqlite3.connect(db_path) as conn:
+        converted = conn.execute(
+            "SELECT lesson_id, keystrokes, data FROM lesson_key_presses ORDER BY lesson_id"
+        ).fetchall()
+        # Left for migrations/005_key_press_blobs.py to drop
+        assert conn.execute("SELECT COUNT(*) FROM key_presses").fetchone() == (12,)
+    assert [
+        (lesson_id, keystrokes, list(KeyPressLog.decode(data)))
+        for lesson_id, keystrokes, data in converted
+    ] == [
+        (lesson_id, 4, [(i, lesson_id * 100 + i) for i in range(4)])
+        for lesson_id in (1, 2, 3)
+    ]
+
+
+def _make_dictionary(path, titles, *, ascii_words=True):
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE articles (word_id INTEGER PRIMARY KEY, title TEXT)")
+        conn.executemany(
+            "INSERT INTO articles (word_id, title) VALUES (?, ?)",
+            enumerate(titles, start=1),
+        )
+        conn.execute(
+            "CREATE TABLE bigram_frequency (bigram TEXT, count INTEGER, word_id INTEGER)"
+        )
+        for word_id, title in enumerate(titles, start=1):
+            bounded = f"^{title.lower()}$"
+            bigrams = Counter(bounded[i : i + 2] for i in range(len(bounded) - 1))
+            conn.executemany(
+                "INSERT INTO bigram_frequency VALUES (?, ?, ?)",
+                [(bg, count, word_id) for bg, count in bigrams.items()],
+            )
+        if ascii_words:
+            create_ascii_words(conn)
+    return str(path)
+
+
+def test_ascii_words_are_numbered_densely(tmp_path):
+    dict_db_path = _make_dictionary(
+        tmp_path / "dict.db", ["apple", "abbé", "banana", "açai", "cherry"]
+    )
+    with sqlite3.connect(dict_db_path) as conn:
+        rows = conn.execute("SELECT * FROM ascii_words ORDER BY ordinal").fetchall()
+    assert rows == [(1, 1, "apple"), (2, 3, "banana"), (3, 5, "cherry")]
+
+
+def test_bigram_index_refresh_matches_full_build(tmp_path, capsys):
+    script = _load_module(Path(__file__).parent / "scripts" / "create_bigram_index.py")
+    titles = ["apple", "abbé", "banana", "açai", "cherry", "date", "elder"]
+    dict_db_path = _make_dictionary(tmp_path / "dict.db", titles)
+    with sqlite3.connect(dict_db_path) as conn:
+        conn.execute("DROP TABLE bigram_frequency")
+    script.create_bigram_index(dict_db_path)
+
+    with sqlite3.connect(dict_db_path) as conn:
+        conn.execute("INSERT INTO articles (title) VALUES ('fig'), ('gâteau')")
+        conn.execute("DELETE FROM articles WHERE title IN ('banana', 'açai')")
+        conn.execute("UPDATE articles SET title = 'chérry' WHERE title = 'cherry'")
+        conn.execute("UPDATE articles SET title = 'abbey' WHERE title = 'abbé'")
+        conn.execute("INSERT OR REPLACE INTO articles VALUES (6, 'durian')")
+        conn.execute("UPDATE articles SET title = NULL WHERE title = 'elder'")
+        conn.execute("INSERT INTO articles (title) VALUES ('grape')")
+        conn.execute("DELETE FROM articles WHERE title = 'grape'")
+    script.refresh_bigram_index(dict_db_path)
+    assert "Refreshed the bigrams of 9 changed words" in capsys.readouterr().out
+
+    query = "SELECT * FROM bigram_frequency ORDER BY bigram, count, word_id"
+    with sqlite3.connect(dict_db_path) as conn:
+        refreshed = conn.execute(query).fetchall()
+        ascii_words = conn.execute("SELECT * FROM ascii_words").fetchall()
+        assert conn.execute("SELECT COUNT(*) FROM articles_changelog").fetchone() == (
+            0,
+        )
+    script.create_bigram_index(dict_db_path)
+    with sqlite3.connect(dict_db_path) as conn:
+        assert conn.execute(query).fetchall() == refreshed
+        create_ascii_words(conn)
+        expected = conn.execute("SELECT word_id, title FROM ascii_words").fetchall()
+    # The same words, still numbered densely
+    assert sorted(row[1:] for row in ascii_words) == sorted(expected)
+    assert sorted(row[0] for row in ascii_words) == list(range(1, len(expected) + 1))
+
+
+def test_bigram_index_refresh_ignores_inserts_that_change_nothing(tmp_path, capsys):
+    script = _load_module(Path(__file__).parent / "scripts" / "create_bigram_index.py")
+    dict_db_path = _make_dictionary(tmp_path / "dict.db", ["apple", "banana"])
+    script.create_bigram_index(dict_db_path)
+    queries = ["SELECT * FROM bigram_frequency", "SELECT * FROM ascii_words"]
+    with sqlite3.connect(dict_db_path) as conn:
+        expected = [conn.execute(query).fetchall() for query in queries]
+        # Fires the BEFORE INSERT trigger, but leaves word 1 alone
+        conn.execute("INSERT OR IGNORE INTO articles VALUES (1, 'zzz')")
+    script.refresh_bigram_index(dict_db_path)
+    with sqlite3.connect(dict_db_path) as conn:
+        assert [conn.execute(query).fetchall() for query in queries] == expected
+
+    # Reloading articles drops the triggers: the log no longer covers them
+    with sqlite3.connect(dict_db_path) as conn:
+        conn.execute("DROP TABLE articles")
+        conn.execute("CREATE TABLE articles (word_id INTEGER PRIMARY KEY, title TEXT)")
+        conn.execute("INSERT INTO articles VALUES (1, 'cherry')")
+    capsys.readouterr()
+    script.refresh_bigram_index(dict_db_path)
+    assert "building the index in full" in capsys.readouterr().out
+    with sqlite3.connect(dict_db_path) as conn:
+        assert sorted(conn.execute(queries[0]).fetchall()) == sorted(
+            script.word_bigrams(1, "cherry")
+        )
+
+
+def test_running_generator_sees_refreshed_words(stats_manager, tmp_path):
+    script = _load_module(Path(__file__).parent / "scripts" / "create_bigram_index.py")
+    dict_db_path = _make_dictionary(tmp_path / "dict.db", ["apple", "banana"])
+    script.create_bigram_index(dict_db_path)
+    generator = LessonGenerator(
+        stats_manager, dict_db_path=dict_db_path, use_memory_index=True
+    )
+    generator.generate_lesson()
+
+    with sqlite3.connect(dict_db_path) as conn:
+        conn.execute("INSERT INTO articles (title) VALUES ('cherry')")
+    script.refresh_bigram_index(dict_db_path)
+    # Only the new word has the bigram, so it comes first
+    stats_manager.record_mistake("cherry", 1, "x")
+    assert generator.generate_lesson()[0].original == "cherry"
+
+
+ENTRY = '<d:entry xmlns:d="http://www.apple.com/DTDs/DictionaryService-1.0.rng"'
+
+
+def _outcome(parse, line):
+    try:
+        return parse(line)
+    except Exception as e:  # noqa: BLE001
+        return type(e)
+
+
+@pytest.mark.parametrize(
+    ("line", "scanned"),
+    [
+        (f'{ENTRY} d:title="plain" class="entry"><p>x</p></d:entry>', True),
+        (f'{ENTRY} d:title="a &amp; b &lt;c&gt; &quot;d&quot; &apos;e"/>', True),
+        (f'{ENTRY} d:title="caf&#233; na&#xEF;ve &#x1F600;"/>', True),
+        (f'{ENTRY} d:title="a>b" id="c>d"/>', False),
+        (f'{ENTRY} id="x"/>', True),
+        (f'{ENTRY} d:title=""/>', True),
+        # Invalid references and unknown entities are errors, as in XML
+        (f'{ENTRY} d:title="a&#0;b"/>', False),
+        (f'{ENTRY} d:title="&#xD800;"/>', False),
+        (f'{ENTRY} d:title="&nbsp;"/>', False),
+        (f'{ENTRY} d:title="a & b"/>', False),
+        # XML normalizes whitespace in attribute values
+        (f'{ENTRY} d:title="a\tb"/>', False),
+        (f'{ENTRY} d:title="a\nb"/>', False),
+        # Single quotes
+        (f"{ENTRY} d:title='quoted'/>", False),
+        (f'{ENTRY} id=\'it"s\' d:title="x"/>', False),
+        # Start tags beyond the plain ones of the dumps
+        (f'{ENTRY} d:title="x" d:title="y"/>', False),
+        (f'{ENTRY} d:title = "spaced"/>', False),
+        (f'{ENTRY} id="a&amp;b" d:title="x"/>', False),
+        (f'{ENTRY} d:title="x" class="<"/>', False),
+        ('<d:entry xmlns:d="urn:other" d:title="x"/>', False),
+        (f'{ENTRY}\n d:title="x"/>', False),
+        ("<entry title='x'/>", False),
+    ],
+)
+def test_scanned_titles_match_the_xml_parser(line, scanned):
+    script = _load_module(Path(__file__).parent / "scripts" / "process_dictionary.py")
+    expected = _outcome(script.parse_title_xml, line)
+    if scanned:
+        assert _outcome(script.scan_title, line) == expected
+    else:
+        with pytest.raises(ValueError):
+            script.scan_title(line)
+    assert _outcome(script.parse_title, line) == expected
+
+
+@pytest.mark.parametrize("trailing_newline", [True, False])
+@pytest.mark.parametrize("chunk_bytes", [1, 50, 1 << 20])
+def test_parallel_dictionary_load_numbers_words_serially(
+    tmp_path, monkeypatch, chunk_bytes, trailing_newline
+):
+    monkeypatch.syspath_prepend(str(Path(__file__).parent / "scripts"))
+    script = importlib.import_module("process_dictionary")
+    titles = ["apple", "x^2", "abbé", "", "banana", "açai", "$", "cherry", "d&amp;e"]
+    lines = [f'{ENTRY} d:title="{title}"><p>…</p></d:entry>' for title in titles]
+    lines[2:2] = ["", "   "]
+    text = "\r\n".join(lines[:5]) + "\r\n" + "\n".join(lines[5:])
+    dump_path = tmp_path / "dump.txt"
+    dump_path.write_bytes((text + "\n" * trailing_newline).encode())
+
+    with open(dump_path, encoding="utf-8") as f:
+        expected = list(enumerate(script.parse_titles(f), start=1))
+    assert [title for _, title in expected][-1] == "d&e"
+    for workers in (1, 2):
+        db_path = str(tmp_path / str(workers) / "dict.db")
+        script.process_dictionary(str(dump_path), db_path, workers, chunk_bytes)
+        with sqlite3.connect(db_path) as conn:
+            assert conn.execute("SELECT * FROM articles").fetchall() == expected
+
+
+def test_body_data_decompressed_into_articles(tmp_path, monkeypatch):
+    # Imported by name, as the script imports its neighbours, so that worker
+    # processes can unpickle its functions
+    monkeypatch.syspath_prepend(str(Path(__file__).parent / "scripts"))
+    decompressor = importlib.import_module("dictionary_decompressor")
+    ns = 'xmlns:d="http://www.apple.com/DTDs/DictionaryService-1.0.rng"'
+    titles = ["apple", "x^2", "abbé", "banana", "$", "façade", "cherry", "d&amp;e"]
+    entries = [
+        f'<d:entry {ns} d:title="{title}"><p>…</p></d:entry>\n' for title in titles
+    ]
+    body_path = str(tmp_path / "Body.data")
+    decompressor.write_body_data(body_path, entries, entries_per_block=3)
+
+    expected = [
+        (1, "apple"),
+        (2, "abbé"),
+        (3, "banana"),
+        (4, "façade"),
+        (5, "cherry"),
+        (6, "d&e"),
+    ]
+    for workers in (1, 2):
+        db_path = str(tmp_path / str(workers) / "dict.db")
+        decompressor.decompress_dictionary(body_path, db_path, workers)
+        with sqlite3.connect(db_path) as conn:
+            assert conn.execute("SELECT * FROM articles").fetchall() == expected
+            assert conn.execute("SELECT * FROM ascii_words").fetchall() == [
+                (1, 1, "apple"),
+                (2, 3, "banana"),
+                (3, 5, "cherry"),
+                (4, 6, "d&e"),
+            ]
+
+
+def test_dictionary_built_in_one_pass(tmp_path, monkeypatch, capsys):
+    monkeypatch.syspath_prepend(str(Path(__file__).parent / "scripts"))
+    decompressor = importlib.import_module("dictionary_decompressor")
+    bigram_index = importlib.import_module("create_bigram_index")
+    builder = importlib.import_module("build_dictionary")
+    # Several runs of bigrams, not all of them full
+    monkeypatch.setattr(builder, "CHUNK_WORDS", 4)
+    ns = 'xmlns:d="http://www.apple.com/DTDs/DictionaryService-1.0.rng"'
+    titles = ["apple", "x^2", "abbé", "banana", "açai", "cherry", "date", "elder"]
+    titles += ["fig", "$", "gâteau", "grape", "honeydew"]
+    entries = [f'<d:entry {ns} d:title="{title}"/>' for title in titles]
+    body_path = str(tmp_path / "Body.data")
+    decompressor.write_body_data(body_path, entries, entries_per_block=5)
+
+    expected_path = str(tmp_path / "expected" / "dict.db")
+    decompressor.decompress_dictionary(body_path, expected_path, 1)
+    bigram_index.create_bigram_index(expected_path, 1)
+    queries = [
+        "SELECT * FROM articles ORDER BY word_id",
+        "SELECT * FROM ascii_words ORDER BY ordinal",
+        "SELECT * FROM bigram_frequency ORDER BY bigram, count, word_id",
+        "SELECT type, name FROM sqlite_master ORDER BY name",
+    ]
+    with sqlite3.connect(expected_path) as conn:
+        expected = [conn.execute(query).fetchall() for query in queries]
+
+    for workers in (1, 2):
+        db_path = str(tmp_path / str(workers) / "dict.db")
+        builder.build_dictionary(body_path, db_path, workers)
+        out = capsys.readouterr().out
+        assert f"{len(expected[2]):,} bigrams" in out.rpartition("merge:")[2]
+        with sqlite3.connect(db_path) as conn:
+            assert [conn.execute(query).fetchall() for query in queries] == expected
+            conn.execute("UPDATE articles SET title = 'fig' WHERE title = 'date'")
+        # Change tracking is installed, as by a full index build
+        bigram_index.refresh_bigram_index(db_path)
+        assert "Refreshed the bigrams of 1 changed words" in capsys.readouterr().out
+
+
+def test_random_sampling_when_nearly_everything_is_excluded(stats_manager, tmp_path):
+    titles = [f"word{i}" for i in range(50)]
+    dict_db_path = _make_dictionary(tmp_path / "dict.db", titles)
+    generator = LessonGenerator(stats_manager, dict_db_path=dict_db_path)
+    lesson_id = stats_manager.record_lesson(time.time(), "test", "test", 1.0)
+    stats_manager.record_lesson_words(lesson_id, list(range(1, 48)))
+
+    lesson = generator.generate_lesson()
+    assert sorted(w.word_id for w in lesson) == [48, 49, 50]
+
+
+def test_memory_index_sampling_targets_bigrams(stats_manager, tmp_path):
+    titles = [f"th{c}" for c in "abcdefghijkl"] + ["thé"] + [f"x{c}" for c in "abcdef"]
+    dict_db_path = _make_dictionary(tmp_path / "dict.db", titles)
+    generator = LessonGenerator(
+        stats_manager, dict_db_path=dict_db_path, use_memory_index=True
+    )
+    stats_manager.record_mistake("the", 1, "x")
+
+    lesson = generator.generate_lesson()
+    assert len(lesson) == 10
+    assert len({w.word_id for w in lesson}) == 10
+    assert all(w.original.startswith("th") and w.original.isascii() for w in lesson)
+
+
+def test_memory_index_respects_exclusions(stats_manager, tmp_path):
+    titles = ["apple", "abbé", "banana", "cherry", "date", "elder", "fig"]
+    dict_db_path = _make_dictionary(tmp_path / "dict.db", titles)
+    generator = LessonGenerator(
+        stats_manager, dict_db_path=dict_db_path, use_memory_index=True
+    )
+    lesson_id = stats_manager.record_lesson(time.time(), "test", "test", 1.0)
+    stats_manager.record_lesson_words(lesson_id, [1, 3])
+
+    lesson = generator.generate_lesson()
+    assert sorted(w.original for w in lesson) == ["cherry", "date", "elder", "fig"]
+
+
+def test_snapshot_maps_the_same_index(tmp_path):
+    titles = ["apple", "abbé", "banana", "cherry", "", "apple"]
+    dict_db_path = _make_dictionary(tmp_path / "dict.db", titles)
+    with sqlite3.connect(dict_db_path) as conn:
+        index = BigramIndex.load(conn)
+    snapshot_path = str(tmp_path / "dict.snapshot")
+    index.save_snapshot(snapshot_path)
+
+    snapshot = BigramIndex.from_snapshot(snapshot_path)
+    assert list(snapshot.word_ids) == list(index.word_ids) == [1, 3, 4, 5, 6]
+    assert list(snapshot.titles) == index.titles
+    assert {bg: list(p) for bg, p in snapshot.postings.items()} == {
+        bg: list(p) for bg, p in index.postings.items()
+    }
+    assert [snapshot.position(word_id) for word_id in (0, 2, 3, 6, 7)] == [
+        None,
+        None,
+        1,
+        4,
+        None,
+    ]
+
+    with open(snapshot_path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b"X")
+    with pytest.raises(ValueError, match="corrupt"):
+        BigramIndex.from_snapshot(snapshot_path)
+
+
+def test_snapshot_compiled_from_dictionary_without_ascii_words(tmp_path, capsys):
+    script = _load_module(Path(__file__).parent / "scripts" / "compile_snapshot.py")
+    titles = ["apple", "abbé", "banana"]
+    dict_db_path = _make_dictionary(tmp_path / "dict.db", titles, ascii_words=False)
+    snapshot_path = str(tmp_path / "dict.snapshot")
+    script.compile_snapshot(dict_db_path, snapshot_path)
+    assert "Wrote 2 words" in capsys.readouterr().out
+
+    snapshot = BigramIndex.from_snapshot(snapshot_path)
+    assert list(snapshot.word_ids) == [1, 3]
+    assert list(snapshot.titles) == ["apple", "banana"]
+    # The ASCII words were only numbered for the snapshot
+    with sqlite3.connect(dict_db_path) as conn:
+        assert (
+            conn.execute(
+                "SELECT name FROM sqlite_master WHERE name = 'ascii_words'"
+            ).fetchall()
+            == []
+        )
+
+
+def test_lessons_from_snapshot_skip_sqlite(stats_manager, tmp_path):
+    titles = ["apple", "abbé", "banana", "cherry", "date", "elder", "fig"]
+    dict_db_path = _make_dictionary(tmp_path / "dict.db", titles)
+    snapshot_path = str(tmp_path / "dict.snapshot")
+    with sqlite3.connect(dict_db_path) as conn:
+        BigramIndex.load(conn).save_snapshot(snapshot_path)
+        conn.execute("DROP TABLE bigram_frequency")
+    later = time.time() + 60
+    os.utime(snapshot_path, (later, later))
+
+    generator = LessonGenerator(
+        stats_manager,
+        dict_db_path=dict_db_path,
+        use_memory_index=True,
+        snapshot_path=snapshot_path,
+    )
+    lesson_id = stats_manager.record_lesson(time.time(), "test", "test", 1.0)
+    stats_manager.record_lesson_words(lesson_id, [1, 3])
+    stats_manager.record_mistake("cherry", 1, "x")
+
+    lesson = generator.generate_lesson()
+    assert lesson[0].original == "cherry"
+    assert sorted(w.original for w in lesson) == ["cherry", "date", "elder", "fig"]
+
+
+def test_exclusions_are_not_bound_by_sql_variable_limit(stats_manager, tmp_path):
+    titles = [f"word{i}" for i in range(510)]
+    dict_db_path = _make_dictionary(tmp_path / "dict.db", titles)
+    generator = LessonGenerator(stats_manager, dict_db_path=dict_db_path)
+    generator.pool.connection().setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 100)
+    lesson_id = stats_manager.record_lesson(time.time(), "test", "test", 1.0)
+    stats_manager.record_lesson_words(lesson_id, list(range(1, 501)))
+
+    lesson = generator.generate_lesson()
+    assert sorted(w.word_id for w in lesson) == list(range(501, 511))
+
+
+@pytest.mark.parametrize("use_memory_index", [False, True])
+def test_exclusions_follow_recently_typed_words(
+    stats_manager, tmp_path, use_memory_index
+):
+    titles = [f"word{i}" for i in range(12)]
+    dict_db_path = _make_dictionary(tmp_path / "dict.db", titles)
+    generator = LessonGenerator(
+        stats_manager, dict_db_path=dict_db_path, use_memory_index=use_memory_index
+    )
+
+    first = [w.word_id for w in generator.generate_lesson()]
+    lesson_id = stats_manager.record_lesson(time.time(), "test", "test", 1.0)
+    stats_manager.record_lesson_words(lesson_id, first)
+    second = [w.word_id for w in generator.generate_lesson()]
+    assert len(second) == 2
+    assert not set(first) & set(second)
+
+    # Once typed long enough ago, the words are available again
+    with sqlite3.connect(stats_manager.db_path) as conn:
+        conn.execute("UPDATE lesson_words SET timestamp = 0")
+    assert len(generator.generate_lesson()) == 10
+
+
+def test_prefetched_lesson_is_regenerated_after_mistakes(stats_manager, tmp_path):
+    # Enough "zz" words for a full lesson even if the current one took some
+    titles = [f"zz{i}" for i in range(30)] + [f"w{i}" for i in range(200)]
+    dict_db_path = _make_dictionary(tmp_path / "dict.db", titles)
+    generator = LessonGenerator(
+        stats_manager, dict_db_path=dict_db_path, use_memory_index=True
+    )
+    prefetcher = LessonPrefetcher(generator)
+    try:
+        current, ema_stats = prefetcher.next_lesson()
+        assert ema_stats == (None, None, None)
+
+        prefetcher.request({w.word_id for w in current})
+        time.sleep(0.05)  # let the prefetch finish before it is invalidated
+        stats_manager.record_mistake("zzz", 1, "x")
+        stats_manager.record_lesson(time.time(), "ab", "ab", 1.0)
+
+        lesson, ema_stats = prefetcher.next_lesson()
+        assert all(w.original.startswith("zz") for w in lesson)
+        assert not {w.word_id for w in lesson} & {w.word_id for w in current}
+        assert ema_stats[0] == pytest.approx(2.0)
+    finally:
+        prefetcher.close()
+
+
+class _RecordingScreen:
+    def __init__(self):
+        self.cells = []
+        self.size = (24, 80)
+
+    def getmaxyx(self):
+        return self.size
+
+    def addch(self, y, x, char, *_):
+        self.cells.append((y, x, char))
+
+    def addstr(self, *args):
+        pass
+
+    def erase(self):
+        self.cells.clear()
+
+    def clrtoeol(self):
+        pass
+
+    def move(self, y, x):
+        pass
+
+    def refresh(self):
+        pass
+
+
+def test_renderer_repaints_only_damaged_cells(stats_manager, monkeypatch):
+    monkeypatch.setattr(curses, "color_pair", lambda n: n << 8)
+    lesson = [LessonWord(1, "abc", "abc", " "), LessonWord(2, "de", "de", " ")]
+    session = LessonSession(lesson, stats_manager)
+    screen = _RecordingScreen()
+    renderer = LessonRenderer(screen)
+
+    renderer.draw(session, " Let's go! ")
+    assert len(screen.cells) == len(session.full_text)
+
+    # A keystroke only touches the typed cell and the new cursor cell
+    screen.cells.clear()
+    session.handle_key(ord("a"))
+    renderer.draw(session, " Let's go! ")
+    assert [char for _, _, char in screen.cells] == ["a", "b"]
+
+    screen.cells.clear()
+    session.handle_key(ord("x"))
+    session.handle_key(curses.KEY_BACKSPACE)
+    renderer.draw(session, " Let's go! ")
+    assert screen.cells == []
+
+    renderer.invalidate()
+    renderer.draw(session, " Let's go! ")
+    assert len(screen.cells) == len(session.full_text)
+
+
+def test_renderer_caches_the_layout_per_text_and_width(stats_manager, monkeypatch):
+    monkeypatch.setattr(curses, "color_pair", lambda n: n << 8)
+    calls = []
+
+    def counting_layout(text, max_width):
+        calls.append((text, max_width))
+        return calculate_layout(text, max_width)
+
+    monkeypatch.setattr(tutor, "calculate_layout", counting_layout)
+    lesson = [LessonWord(1, "abc", "abc", " "), LessonWord(2, "de", "de", " ")]
+    session = LessonSession(lesson, stats_manager)
+    screen = _RecordingScreen()
+    renderer = LessonRenderer(screen)
+
+    renderer.draw(session, " Let's go! ")
+    for char in "abx":
+        session.handle_key(ord(char))
+        renderer.draw(session, " Let's go! ")
+    renderer.invalidate()
+    renderer.draw(session, " Let's go! ")
+    assert calls == [(session.full_text, 76)]
+
+    # Wider than 84 columns the text width stays at 80
+    screen.size = (24, 100)
+    renderer.invalidate()
+    renderer.draw(session, " Let's go! ")
+    screen.size = (30, 120)
+    renderer.invalidate()
+    renderer.draw(session, " Let's go! ")
+    assert calls[1:] == [(session.full_text, 80)]
+
+    other = LessonSession([LessonWord(3, "fgh", "fgh", " ")], stats_manager)
+    renderer.invalidate()
+    renderer.draw(other, " Let's go! ")
+    assert calls[2:] == [(other.full_text, 80)]
+    assert len(screen.cells) == len(other.full_text)
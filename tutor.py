@@ -1,21 +1,117 @@
+import atexit
+import bisect
 import curses
+import itertools
 import math
+import mmap
+import os
+import queue
 import random
 import re
 import sqlite3
+import struct
 import sys
+import threading
 import time
+import zlib
+from array import array
+from collections.abc import Callable, Iterable, Iterator, Sequence
 from dataclasses import dataclass
 from typing import Any
 
 # Constants
 STATS_DB = "stats.db"
 DICTIONARY_DB = "dictionaries/en_en.db"
+# Compiled from the dictionary by scripts/compile_snapshot.py
+DICTIONARY_SNAPSHOT = "dictionaries/en_en.snapshot"
+# Magic, word count, bigram count, title bytes, CRC-32 of the rest of the file
+SNAPSHOT_HEADER = struct.Struct("<8sIIII")
+SNAPSHOT_MAGIC = b"TTSNAP01"
 WORDS_PER_LESSON = 10
 EXCLUDE_RECENT_MINUTES = 5
+ONE_WEEK = 7 * 24 * 3600
+# Decayed aggregates are stored relative to an epoch; once it is this many
+# weeks old it is moved forward so that exp() stays far from overflowing.
+DECAY_REBASE_WEEKS = 52
+EMA_COLUMNS = ("weight", "cps", "accuracy", "arrhythmicity_weight", "arrhythmicity")
+SQLITE_SYNCHRONOUS = "NORMAL"
+SQLITE_CACHED_STATEMENTS = 256
+SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+# Raw mistakes and key presses older than this are dropped by compaction; they
+# live on in bigram_weights and lesson_stats
+COMPACT_HORIZON_WEEKS = 12
+# Bigram weights below this (in units of one mistake made now) are pruned
+BIGRAM_WEIGHT_EPSILON = 1e-6
+WRITE_QUEUE_SIZE = 4096
+WRITE_BATCH_SIZE = 256
+# Random draws per requested word before _sample_random falls back to a scan
+RANDOM_SAMPLE_ATTEMPTS = 8
+
+# A statement and the parameter rows it is executed with (via executemany)
+Statement = tuple[str, list[tuple[Any, ...]]]
+# (ema_cps, ema_accuracy, ema_arrhythmicity)
+EmaStats = tuple[float | None, float | None, float | None]
+
+
+class IntervalStats:
+    """
+    Running count, mean and sum of squared deviations of the intervals between
+    consecutive timestamps, updated in O(1) per timestamp (Welford's algorithm).
+
+    Accumulators of separate keystroke streams can be merged, e.g. to get the
+    arrhythmicity of several lessons together.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.last_timestamp_ns: int | None = None
+
+    @classmethod
+    def from_timestamps(cls, timestamps_ns: Iterable[int]) -> "IntervalStats":
+        stats = cls()
+        for timestamp in timestamps_ns:
+            stats.add_timestamp(timestamp)
+        return stats
+
+    def add_timestamp(self, timestamp_ns: int) -> None:
+        if self.last_timestamp_ns is not None:
+            # Convert nanoseconds to seconds
+            self.add((timestamp_ns - self.last_timestamp_ns) / 1e9)
+        self.last_timestamp_ns = timestamp_ns
+
+    def add(self, interval: float) -> None:
+        self.count += 1
+        delta = interval - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (interval - self.mean)
+
+    def merge(self, other: "IntervalStats") -> "IntervalStats":
+        """Returns the statistics of the intervals of both accumulators."""
+        merged = IntervalStats()
+        merged.count = self.count + other.count
+        if merged.count:
+            delta = other.mean - self.mean
+            merged.mean = self.mean + delta * other.count / merged.count
+            merged.m2 = (
+                self.m2
+                + other.m2
+                + delta * delta * self.count * other.count / merged.count
+            )
+        return merged
 
+    def stddev(self) -> float | None:
+        """
+        Standard deviation in seconds with Bessel's correction (DDoF=1), or None
+        if there are fewer than 2 intervals.
+        """
+        if self.count < 2:
+            return None
+        return math.sqrt(max(self.m2, 0.0) / (self.count - 1))
 
-def compute_arrhythmicity(timestamps_ns: list[int]) -> float | None:
+
+def compute_arrhythmicity(timestamps_ns: Iterable[int]) -> float | None:
     """
     Computes arrhythmicity (standard deviation of inter-key intervals) from a list
     of monotonic nanosecond timestamps.
@@ -27,24 +123,161 @@ def compute_arrhythmicity(timestamps_ns: list[int]) -> float | None:
         Standard deviation in seconds, or None if fewer than 2 intervals (3 timestamps).
         Uses Bessel's correction (DDoF=1).
     """
-    if len(timestamps_ns) < 3:
-        # We need at least 2 intervals to compute variance of intervals.
-        # 2 timestamps -> 1 interval -> variance undefined (or 0 if population).
-        # Standard deviation of a single sample is undefined for DDoF=1.
-        return None
+    return IntervalStats.from_timestamps(timestamps_ns).stddev()
 
-    intervals = []
-    for i in range(len(timestamps_ns) - 1):
-        # Convert nanoseconds to seconds
-        dt = (timestamps_ns[i + 1] - timestamps_ns[i]) / 1e9
-        intervals.append(dt)
 
-    if len(intervals) < 2:
-        return None
+def decay_weight(timestamp: float, epoch: float) -> float:
+    """Returns exp((timestamp - epoch) / week), an event's weight at the epoch."""
+    return math.exp((timestamp - epoch) / ONE_WEEK)
+
+
+def read_bigram_weights(conn: sqlite3.Connection) -> dict[str, float]:
+    """Returns exp(-age in weeks) summed over the mistakes of each bigram."""
+    # One statement reads the weights and their epoch, so a rebase by another
+    # connection is seen either entirely or not at all
+    rows = conn.execute(
+        "SELECT bigram, weight, epoch FROM bigram_weights, decay_epochs WHERE decay_epochs.name = 'bigram_weights'"
+    ).fetchall()
+    now = time.time()
+    return {bigram: weight * decay_weight(epoch, now) for bigram, weight, epoch in rows}
+
+
+def mistake_bigram(display_word: str, index: int) -> str:
+    """Returns the bigram a mistake at `index` of the displayed word is charged to."""
+    # Reconstruct the expected character from the displayed word at the recorded index.
+    # This is why we store the displayed word.
+    if index > 0:
+        return display_word[index - 1 : index + 1].lower()
+    return f"^{display_word[0].lower()}"
+
+
+def replay_typed_text(text_required: str, text_typed: str) -> tuple[int, int, int]:
+    """
+    Replays a typed text that may contain backspaces against the required
+    text, the same way LessonSession scores it.
+
+    Returns:
+        (mistakes, total_typed, final_length): characters typed wrong, characters
+        typed at all (backspaces excluded) and the length of the text left over.
+    """
+    mistakes = 0
+    total_typed = 0
+    length = 0
+    required_length = len(text_required)
+    for char in text_typed:
+        if char == "\b":
+            if length:
+                length -= 1
+        else:
+            total_typed += 1
+            if length < required_length and char != text_required[length]:
+                mistakes += 1
+            length += 1
+    return mistakes, total_typed, length
+
+
+@dataclass(frozen=True)
+class LessonSummary:
+    cps: float
+    accuracy: float
+    arrhythmicity: float | None
+    keystrokes: int
+
+    @classmethod
+    def from_lesson(
+        cls,
+        text_required: str,
+        text_typed: str,
+        duration: float,
+        timestamps_ns: Sequence[int],
+    ) -> "LessonSummary | None":
+        """Summarizes a recorded lesson, or returns None if nothing was typed."""
+        mistakes, total_typed, final_length = replay_typed_text(
+            text_required, text_typed
+        )
+        if total_typed == 0:
+            return None
+        return cls(
+            cps=final_length / duration if duration > 0 else 0,
+            accuracy=((total_typed - mistakes) / total_typed) * 100,
+            arrhythmicity=compute_arrhythmicity(timestamps_ns),
+            keystrokes=len(timestamps_ns),
+        )
+
+
+def calculate_layout(text: str, max_width: int) -> list[tuple[int, int]]:
+    """Returns list of (y, x) relative to (0, 0) for each character."""
+    layout: list[tuple[int, int]] = []
+    current_y = 0
+    current_x = 0
+
+    # Split by spaces but keep the spaces
+    parts = re.split(r"(\s+)", text)
+
+    for part in parts:
+        if not part:
+            continue
+
+        part_len = len(part)
+
+        # If it's whitespace, it might trigger a wrap if it's not the start of a line
+        # but usually we just append it and let the NEXT word decide if it fits.
+        # Standard logic: if a word doesn't fit, it goes to next line.
+        # If the part is NOT whitespace and doesn't fit:
+        if not part.isspace():
+            if current_x + part_len > max_width and current_x > 0:
+                current_y += 1
+                current_x = 0
+
+        # If the word itself is longer than max_width, we must break it
+        if not part.isspace() and part_len > max_width:
+            for _ in part:
+                layout.append((current_y, current_x))
+                current_x += 1
+                if current_x >= max_width:
+                    current_x = 0
+                    current_y += 1
+            continue
+
+        # Otherwise, just add it character by character
+        for _ in part:
+            # If we are at the end of the line and the character is whitespace,
+            # we don't necessarily HAVE to wrap before it, but for simplicity:
+            if current_x >= max_width:
+                current_x = 0
+                current_y += 1
+            layout.append((current_y, current_x))
+            current_x += 1
+
+    return layout
+
+
+def create_ascii_words(conn: sqlite3.Connection, *, temp: bool = False) -> None:
+    """
+    Builds ascii_words, the ASCII-only titles of a dictionary numbered densely
+    from 1 so that a uniformly random word is a random ordinal away.
+    """
+    conn.execute(f"""
+        CREATE {"TEMP " if temp else ""}TABLE IF NOT EXISTS ascii_words (
+            ordinal INTEGER PRIMARY KEY,
+            word_id INTEGER NOT NULL UNIQUE,
+            title TEXT NOT NULL
+        )
+    """)
+    conn.execute("DELETE FROM ascii_words")
+    conn.execute("""
+        INSERT INTO ascii_words (word_id, title)
+        SELECT word_id, title FROM articles
+        WHERE LENGTH(title) = LENGTH(CAST(title AS BLOB))
+        ORDER BY word_id
+    """)
+
 
-    mean_val = sum(intervals) / len(intervals)
-    variance = sum((x - mean_val) ** 2 for x in intervals) / (len(intervals) - 1)
-    return math.sqrt(variance)
+@dataclass(frozen=True)
+class CompactionStats:
+    mistakes: int
+    key_presses: int
+    bigrams: int
 
 
 @dataclass(frozen=True)
@@ -63,13 +296,332 @@ class LessonWord:
     separator: str
 
 
+class KeyPressLog:
+    """
+    The (char_index, timestamp_ns) key presses of a lesson, kept as two parallel
+    array('q') columns instead of a list of tuples.
+
+    Behaves like a list of tuples for reading and appending, and keeps the
+    running statistics of the intervals between key presses.
+    """
+
+    def __init__(self, key_presses: Iterable[tuple[int, int]] = ()) -> None:
+        self.char_indices = array("q")
+        self.timestamps = array("q")
+        self.intervals = IntervalStats()
+        for char_index, timestamp in key_presses:
+            self.append((char_index, timestamp))
+
+    def append(self, key_press: tuple[int, int]) -> None:
+        char_index, timestamp = key_press
+        self.char_indices.append(char_index)
+        self.timestamps.append(timestamp)
+        self.intervals.add_timestamp(timestamp)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __getitem__(self, i: int) -> tuple[int, int]:
+        return self.char_indices[i], self.timestamps[i]
+
+    def __iter__(self) -> Iterator[tuple[int, int]]:
+        return zip(self.char_indices, self.timestamps, strict=True)
+
+    def encode(self) -> bytes:
+        """
+        Packs the key presses as zigzag varints: the deltas of the char indices,
+        then the deltas of the timestamps (each column starting from 0).
+        """
+        out = bytearray()
+        for column in (self.char_indices, self.timestamps):
+            previous = 0
+            for value in column:
+                _append_varint(out, value - previous)
+                previous = value
+        return bytes(out)
+
+    @classmethod
+    def decode(cls, data: bytes) -> "KeyPressLog":
+        values = _read_varints(data)
+        count = len(values) // 2
+        return cls(
+            zip(
+                itertools.accumulate(values[:count]),
+                itertools.accumulate(values[count:]),
+                strict=True,
+            )
+        )
+
+
+def _append_varint(out: bytearray, value: int) -> None:
+    value = (value << 1) ^ (value >> 63)  # zigzag, so small negatives stay short
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varints(data: bytes) -> list[int]:
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            values.append((value >> 1) ^ -(value & 1))
+            value = shift = 0
+    return values
+
+
+def create_lesson_key_presses(conn: sqlite3.Connection) -> None:
+    """
+    Creates lesson_key_presses, the key presses of each lesson packed into one
+    KeyPressLog.encode() BLOB, converting the rows of the older one-row-per-key
+    key_presses table if there is one.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'lesson_key_presses'"
+    ).fetchone()
+    if exists:
+        return
+    conn.execute("""
+        CREATE TABLE lesson_key_presses (
+            lesson_id INTEGER PRIMARY KEY,
+            keystrokes INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            FOREIGN KEY (lesson_id) REFERENCES lessons (id)
+        )
+    """)
+    legacy = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'key_presses'"
+    ).fetchone()
+    if not legacy:
+        return
+    # Packed one lesson at a time while the SELECT's own cursor is iterated,
+    # so only a single lesson's rows are in memory however large key_presses is
+    rows = conn.execute(
+        "SELECT lesson_id, char_index, timestamp FROM key_presses WHERE lesson_id IS NOT NULL ORDER BY lesson_id, timestamp"
+    )
+    conn.executemany(
+        "INSERT INTO lesson_key_presses (lesson_id, keystrokes, data) VALUES (?, ?, ?)",
+        _pack_key_presses(rows),
+    )
+
+
+def _pack_key_presses(
+    rows: Iterable[tuple[int, int, int]],
+) -> Iterator[tuple[int, int, bytes]]:
+    for lesson_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+        log = KeyPressLog((char_index, ts) for _, char_index, ts in group)
+        yield lesson_id, len(log), log.encode()
+
+
+class ConnectionPool:
+    """
+    Long-lived SQLite connections, one per thread, reused across calls.
+
+    Statements are cached per connection (`cached_statements`), so queries with
+    constant SQL text are prepared once and then only rebound.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        synchronous: str = SQLITE_SYNCHRONOUS,
+        journal_mode: str | None = "WAL",
+        cached_statements: int = SQLITE_CACHED_STATEMENTS,
+        setup: Callable[[sqlite3.Connection], None] | None = None,
+    ) -> None:
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"unknown synchronous level: {synchronous}")
+        self.db_path = db_path
+        self.synchronous = synchronous
+        self.journal_mode = journal_mode
+        self.cached_statements = cached_statements
+        # Run on every new connection, e.g. to create connection-scoped temp tables
+        self.setup = setup
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: list[sqlite3.Connection] = []
+
+    def connection(self) -> sqlite3.Connection:
+        """Returns the calling thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                cached_statements=self.cached_statements,
+                # close() may run on a different thread than the one that opened it
+                check_same_thread=False,
+            )
+            if self.journal_mode is not None:
+                conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+            conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+            if self.setup is not None:
+                self.setup(conn)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+class WriteBehindQueue:
+    """
+    Applies writes on a background thread in batched transactions, so callers
+    only pay for appending to an in-memory queue.
+
+    Every submitted group of statements is committed atomically and groups are
+    applied in submission order. A group that fails is rolled back alone, and
+    its error is raised by the next call to `submit`, `flush` or `close`. The
+    queue is bounded: if the writer falls behind, `submit` blocks instead of
+    growing memory. Pending writes are flushed by `close`, which is also
+    registered to run at interpreter exit.
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        max_pending: int = WRITE_QUEUE_SIZE,
+        batch_size: int = WRITE_BATCH_SIZE,
+    ) -> None:
+        self.pool = pool
+        self.batch_size = batch_size
+        self._queue: queue.Queue[tuple[Statement, ...] | None] = queue.Queue(
+            maxsize=max_pending
+        )
+        self._errors: list[Exception] = []
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="stats-writer", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, *statements: Statement) -> None:
+        if self._closed:
+            raise RuntimeError("write queue is closed")
+        self._raise_error()
+        self._queue.put(statements)
+
+    def flush(self) -> None:
+        """Blocks until everything submitted so far is committed."""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        atexit.unregister(self.close)
+        self._raise_error()
+
+    def _raise_error(self) -> None:
+        if not self._errors:
+            return
+        errors, self._errors = self._errors, []
+        if len(errors) == 1:
+            raise errors[0]
+        raise ExceptionGroup(f"{len(errors)} write groups failed", errors)
+
+    def _apply(
+        self, conn: sqlite3.Connection, statements: tuple[Statement, ...]
+    ) -> None:
+        """Applies one group inside the batch's transaction, or none of it."""
+        conn.execute("SAVEPOINT write_group")
+        try:
+            for sql, rows in statements:
+                conn.executemany(sql, rows)
+        except Exception as e:  # noqa: BLE001
+            # Only this group is undone; the rest of the batch still commits
+            conn.execute("ROLLBACK TO write_group")
+            self._errors.append(e)
+        conn.execute("RELEASE write_group")
+
+    def _run(self) -> None:
+        conn = self.pool.connection()
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                stopping = True
+                batch.pop()
+            try:
+                with conn:
+                    conn.execute("BEGIN")
+                    for statements in batch:
+                        self._apply(conn, statements)
+            except Exception as e:  # noqa: BLE001
+                # The transaction was rolled back; report it to the next caller
+                self._errors.append(e)
+            finally:
+                for _ in range(len(batch) + stopping):
+                    self._queue.task_done()
+
+
 class StatsManager:
-    def __init__(self, db_path: str = STATS_DB) -> None:
+    def __init__(
+        self,
+        db_path: str = STATS_DB,
+        synchronous: str = SQLITE_SYNCHRONOUS,
+        *,
+        write_behind: bool = False,
+    ) -> None:
         self.db_path = db_path
+        self.pool = ConnectionPool(
+            db_path, synchronous=synchronous, setup=self._setup_connection
+        )
         self._init_db()
+        self.writer = WriteBehindQueue(self.pool) if write_behind else None
+        # Bumped (and `changed` notified) whenever a write changes what
+        # get_bigram_weights or get_ema_stats would return
+        self.changed = threading.Condition()
+        self.mistakes_revision = 0
+        self.lessons_revision = 0
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.pool.close()
+
+    def flush(self) -> None:
+        """Waits for pending write-behind writes to be committed."""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def _write(self, *statements: Statement) -> None:
+        if self.writer is not None:
+            self.writer.submit(*statements)
+            return
+        with self.pool.connection() as conn:
+            for sql, rows in statements:
+                conn.executemany(sql, rows)
+
+    @staticmethod
+    def _setup_connection(conn: sqlite3.Connection) -> None:
+        # Lets writes weigh events against the epoch stored in the same
+        # transaction, which other processes may move (see _load_epoch)
+        conn.create_function("decay_weight", 2, decay_weight, deterministic=True)
 
     def _init_db(self) -> None:
-        with sqlite3.connect(self.db_path) as conn:
+        with self.pool.connection() as conn:
+            # Reading and rebasing the epochs must not interleave with another
+            # process doing the same, or a table would be rescaled twice
+            conn.execute("BEGIN IMMEDIATE")
             cursor = conn.cursor()
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS mistakes (
@@ -103,24 +655,293 @@ class StatsManager:
                     FOREIGN KEY (lesson_id) REFERENCES lessons (id)
                 )
             """)
+            # Replaces key_presses, which migrations/005_key_press_blobs.py drops
+            create_lesson_key_presses(conn)
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_lesson_words_timestamp ON lesson_words (timestamp, word_id)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_mistakes_timestamp ON mistakes (timestamp)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_lessons_timestamp ON lessons (timestamp)"
+            )
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS decay_epochs (
+                    name TEXT PRIMARY KEY,
+                    epoch REAL NOT NULL
+                )
+            """)
+            # Sum of exp((mistake ts - epoch) / week) per bigram, i.e. the decayed
+            # mistake weights up to a common factor exp((epoch - now) / week)
+            backfill_weights = not self._table_exists(cursor, "bigram_weights")
             cursor.execute("""
-                CREATE TABLE IF NOT EXISTS key_presses (
-                    lesson_id INTEGER,
-                    char_index INTEGER,
-                    timestamp INTEGER,
+                CREATE TABLE IF NOT EXISTS bigram_weights (
+                    bigram TEXT PRIMARY KEY,
+                    weight REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+            bigram_epoch = self._load_epoch(cursor, "bigram_weights", ("weight",))
+            if backfill_weights:
+                self._backfill_bigram_weights(cursor, bigram_epoch)
+
+            backfill_lessons = not self._table_exists(cursor, "lesson_stats")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS lesson_stats (
+                    lesson_id INTEGER PRIMARY KEY,
+                    timestamp REAL NOT NULL,
+                    cps REAL NOT NULL,
+                    accuracy REAL NOT NULL,
+                    arrhythmicity REAL,
+                    keystrokes INTEGER NOT NULL,
                     FOREIGN KEY (lesson_id) REFERENCES lessons (id)
                 )
             """)
+            # Single-row running sums of the lesson stats weighted by
+            # exp((lesson ts - epoch) / week); the EMAs are their ratios
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS ema_stats (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    weight REAL NOT NULL,
+                    cps REAL NOT NULL,
+                    accuracy REAL NOT NULL,
+                    arrhythmicity_weight REAL NOT NULL,
+                    arrhythmicity REAL NOT NULL
+                )
+            """)
+            self._load_epoch(cursor, "ema_stats", EMA_COLUMNS)
+            if backfill_lessons:
+                self._backfill_lesson_stats(cursor)
+            # Raw rows recorded before `cutoff` were deleted by compact()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS compactions (
+                    name TEXT PRIMARY KEY,
+                    cutoff REAL NOT NULL
+                )
+            """)
             conn.commit()
 
-    def record_mistake(self, word: str, index: int, typed_char: str) -> None:
-        with sqlite3.connect(self.db_path) as conn:
+    @staticmethod
+    def _table_exists(cursor: sqlite3.Cursor, name: str) -> bool:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        )
+        return cursor.fetchone() is not None
+
+    @staticmethod
+    def _load_epoch(
+        cursor: sqlite3.Cursor, table: str, columns: tuple[str, ...]
+    ) -> float:
+        """
+        Returns the decay epoch of `table`, rebasing its `columns` if it is
+        stale. Other connections may have the table open, so readers and
+        writers take the epoch from decay_epochs in the same transaction as
+        the table rather than keeping it.
+        """
+        now = time.time()
+        cursor.execute("SELECT epoch FROM decay_epochs WHERE name = ?", (table,))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute(
+                "INSERT INTO decay_epochs (name, epoch) VALUES (?, ?)", (table, now)
+            )
+            return now
+
+        epoch = row[0]
+        if now - epoch < DECAY_REBASE_WEEKS * ONE_WEEK:
+            return epoch
+        # Decay is multiplicative, so moving the epoch is a uniform rescale
+        scale = math.exp((epoch - now) / ONE_WEEK)
+        assignments = ", ".join(f"{column} = {column} * ?" for column in columns)
+        cursor.execute(f"UPDATE {table} SET {assignments}", (scale,) * len(columns))
+        cursor.execute("UPDATE decay_epochs SET epoch = ? WHERE name = ?", (now, table))
+        return now
+
+    @staticmethod
+    def _epoch(cursor: sqlite3.Cursor | sqlite3.Connection, table: str) -> float:
+        """Returns the decay epoch of `table`, to be used in the same transaction."""
+        return cursor.execute(
+            "SELECT epoch FROM decay_epochs WHERE name = ?", (table,)
+        ).fetchone()[0]
+
+    @staticmethod
+    def _backfill_bigram_weights(cursor: sqlite3.Cursor, epoch: float) -> None:
+        cursor.execute("SELECT word, char_index, timestamp FROM mistakes")
+        weights: dict[str, float] = {}
+        for display_word, index, ts in cursor.fetchall():
+            bigram = mistake_bigram(display_word, index)
+            weight = decay_weight(ts, epoch)
+            weights[bigram] = weights.get(bigram, 0) + weight
+        cursor.executemany(
+            "INSERT INTO bigram_weights (bigram, weight) VALUES (?, ?)",
+            weights.items(),
+        )
+
+    def _backfill_lesson_stats(
+        self, cursor: sqlite3.Cursor, since: float | None = None
+    ) -> int:
+        """
+        Summarizes the lessons recorded since `since` into lesson_stats, then
+        recomputes the EMA accumulator over all of lesson_stats.
+        """
+        from analytics import ema_sums, load_lesson_history, load_lesson_stats
+
+        history = load_lesson_history(cursor.connection, since)
+        cursor.executemany(
+            "INSERT INTO lesson_stats (lesson_id, timestamp, cps, accuracy, arrhythmicity, keystrokes) VALUES (?, ?, ?, ?, ?, ?)",
+            zip(
+                history.lesson_ids.tolist(),
+                history.timestamps.tolist(),
+                history.cps.tolist(),
+                history.accuracy.tolist(),
+                [None if math.isnan(a) else a for a in history.arrhythmicity.tolist()],
+                history.keystrokes.tolist(),
+                strict=True,
+            ),
+        )
+        summaries = load_lesson_stats(cursor.connection)
+        if len(summaries):
+            epoch = self._epoch(cursor, "ema_stats")
+            self._add_ema_sums(cursor, ema_sums(summaries, epoch))
+        return len(history)
+
+    def backfill_lesson_stats(self) -> int:
+        """
+        Rebuilds lesson_stats and the EMA accumulator from the recorded lessons.
+        Summaries of compacted lessons are kept, since their key presses are gone.
+
+        Returns the number of lessons summarized.
+        """
+        self.flush()
+        with self.pool.connection() as conn:
+            # A running tutor adds lessons against the epoch it finds in its
+            # own transaction, so the reset must be atomic with the rebuild
+            conn.execute("BEGIN IMMEDIATE")
             cursor = conn.cursor()
+            cutoff = self._compaction_cutoff(cursor, "key_presses")
             cursor.execute(
-                "INSERT INTO mistakes (word, char_index, typed_char, timestamp) VALUES (?, ?, ?, ?)",
-                (word, index, typed_char, time.time()),
+                "DELETE FROM lesson_stats WHERE timestamp >= ?",
+                (cutoff if cutoff is not None else -math.inf,),
             )
-            conn.commit()
+            cursor.execute("DELETE FROM ema_stats")
+            cursor.execute(
+                "UPDATE decay_epochs SET epoch = ? WHERE name = 'ema_stats'",
+                (time.time(),),
+            )
+            return self._backfill_lesson_stats(cursor, cutoff)
+
+    @staticmethod
+    def _compaction_cutoff(cursor: sqlite3.Cursor, name: str) -> float | None:
+        cursor.execute("SELECT cutoff FROM compactions WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        return row[0] if row is not None else None
+
+    def compact(
+        self,
+        horizon_weeks: float = COMPACT_HORIZON_WEEKS,
+        epsilon: float = BIGRAM_WEIGHT_EPSILON,
+    ) -> CompactionStats:
+        """
+        Deletes raw mistakes and key presses older than `horizon_weeks` and
+        prunes bigram weights that have decayed below `epsilon`, then returns
+        the freed pages to the filesystem.
+
+        The deleted rows are already folded into bigram_weights and lesson_stats
+        (key presses of lessons without a summary are kept), which is what the
+        tutor reads, so the EMAs are unaffected and every bigram weight changes
+        by less than `epsilon`.
+        """
+        self.flush()
+        now = time.time()
+        cutoff = now - horizon_weeks * ONE_WEEK
+        conn = self.pool.connection()
+        with conn:
+            mistakes = conn.execute(
+                "DELETE FROM mistakes WHERE timestamp < ?", (cutoff,)
+            ).rowcount
+            key_presses = conn.execute(
+                "SELECT COALESCE(SUM(keystrokes), 0) FROM lesson_key_presses WHERE lesson_id IN (SELECT lesson_id FROM lesson_stats WHERE timestamp < ?)",
+                (cutoff,),
+            ).fetchone()[0]
+            conn.execute(
+                "DELETE FROM lesson_key_presses WHERE lesson_id IN (SELECT lesson_id FROM lesson_stats WHERE timestamp < ?)",
+                (cutoff,),
+            )
+            # Stored weights are relative to the epoch
+            bigrams = conn.execute(
+                "DELETE FROM bigram_weights WHERE weight < ? * decay_weight(?, (SELECT epoch FROM decay_epochs WHERE name = 'bigram_weights'))",
+                (epsilon, now),
+            ).rowcount
+            conn.executemany(
+                "INSERT INTO compactions (name, cutoff) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET cutoff = max(cutoff, excluded.cutoff)",
+                [("mistakes", cutoff), ("key_presses", cutoff)],
+            )
+
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0:
+            # Switching to incremental vacuum takes one full VACUUM; it cannot
+            # be set up front since enabling WAL already initializes the file
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        else:
+            conn.execute("PRAGMA incremental_vacuum")
+        return CompactionStats(mistakes, key_presses, bigrams)
+
+    def _insert_lesson_stats(
+        self,
+        cursor: sqlite3.Cursor | sqlite3.Connection,
+        lesson_id: int,
+        timestamp: float,
+        summary: LessonSummary,
+    ) -> None:
+        cursor.execute(
+            "INSERT INTO lesson_stats (lesson_id, timestamp, cps, accuracy, arrhythmicity, keystrokes) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                lesson_id,
+                timestamp,
+                summary.cps,
+                summary.accuracy,
+                summary.arrhythmicity,
+                summary.keystrokes,
+            ),
+        )
+        weight = decay_weight(timestamp, self._epoch(cursor, "ema_stats"))
+        arr_weight = weight if summary.arrhythmicity is not None else 0.0
+        self._add_ema_sums(
+            cursor,
+            (
+                weight,
+                summary.cps * weight,
+                summary.accuracy * weight,
+                arr_weight,
+                (summary.arrhythmicity or 0.0) * arr_weight,
+            ),
+        )
+
+    def _add_ema_sums(
+        self,
+        cursor: sqlite3.Cursor | sqlite3.Connection,
+        sums: tuple[float, float, float, float, float],
+    ) -> None:
+        cursor.execute(
+            "INSERT INTO ema_stats (id, weight, cps, accuracy, arrhythmicity_weight, arrhythmicity) VALUES (0, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET weight = weight + excluded.weight, cps = cps + excluded.cps, accuracy = accuracy + excluded.accuracy, arrhythmicity_weight = arrhythmicity_weight + excluded.arrhythmicity_weight, arrhythmicity = arrhythmicity + excluded.arrhythmicity",
+            sums,
+        )
+
+    def record_mistake(self, word: str, index: int, typed_char: str) -> None:
+        now = time.time()
+        self._write(
+            (
+                "INSERT INTO mistakes (word, char_index, typed_char, timestamp) VALUES (?, ?, ?, ?)",
+                [(word, index, typed_char, now)],
+            ),
+            (
+                "INSERT INTO bigram_weights (bigram, weight) SELECT ?, decay_weight(?, epoch) FROM decay_epochs WHERE name = 'bigram_weights' ON CONFLICT (bigram) DO UPDATE SET weight = weight + excluded.weight",
+                [(mistake_bigram(word, index), now)],
+            ),
+        )
+        with self.changed:
+            self.mistakes_revision += 1
+            self.changed.notify_all()
 
     def record_lesson(
         self,
@@ -128,253 +949,489 @@ class StatsManager:
         text_required: str,
         text_typed: str,
         duration: float,
-        key_presses: list[tuple[int, int]] | None = None,
+        key_presses: KeyPressLog | list[tuple[int, int]] | None = None,
     ) -> int:
-        if key_presses is None:
-            key_presses = []
+        if not isinstance(key_presses, KeyPressLog):
+            key_presses = KeyPressLog(key_presses or ())
         assert timestamp
         assert duration
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
+        # The lesson row is written synchronously since callers need its id;
+        # the key presses can follow through the write-behind queue.
+        with self.pool.connection() as conn:
+            cursor = conn.execute(
                 "INSERT INTO lessons (timestamp, text_required, text_typed, duration) VALUES (?, ?, ?, ?)",
                 (timestamp, text_required, text_typed, duration),
             )
             lesson_id = cursor.lastrowid
             assert lesson_id is not None
-            if key_presses:
-                cursor.executemany(
-                    "INSERT INTO key_presses (lesson_id, char_index, timestamp) VALUES (?, ?, ?)",
-                    [(lesson_id, idx, ts) for idx, ts in key_presses],
+            summary = LessonSummary.from_lesson(
+                text_required, text_typed, duration, key_presses.timestamps
+            )
+            if summary is not None:
+                self._insert_lesson_stats(conn, lesson_id, timestamp, summary)
+        with self.changed:
+            self.lessons_revision += 1
+            self.changed.notify_all()
+        if key_presses:
+            self._write(
+                (
+                    "INSERT INTO lesson_key_presses (lesson_id, keystrokes, data) VALUES (?, ?, ?)",
+                    [(lesson_id, len(key_presses), key_presses.encode())],
                 )
-            conn.commit()
-            return lesson_id
+            )
+        return lesson_id
 
     def record_lesson_words(self, lesson_id: int, word_ids: list[int]) -> None:
         now = time.time()
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            for word_id in word_ids:
-                cursor.execute(
-                    "INSERT INTO lesson_words (lesson_id, word_id, timestamp) VALUES (?, ?, ?)",
-                    (lesson_id, word_id, now),
-                )
-            conn.commit()
-
-    def get_bigram_weights(self) -> dict[str, float]:
-        now = time.time()
-        one_week = 7 * 24 * 3600
-
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            # Retrieve the display word, the index of the mistake, and the character the user typed
-            cursor.execute(
-                "SELECT word, char_index, typed_char, timestamp FROM mistakes"
+        self._write(
+            (
+                "INSERT INTO lesson_words (lesson_id, word_id, timestamp) VALUES (?, ?, ?)",
+                [(lesson_id, word_id, now) for word_id in word_ids],
             )
-            rows = cursor.fetchall()
-
-        weights: dict[str, float] = {}
-        for display_word, index, _, ts in rows:
-            # Reconstruct the expected character from the displayed word at the recorded index.
-            # This is why we store the displayed word.
-            if index > 0:
-                bigram = display_word[index - 1 : index + 1].lower()
-            else:
-                bigram = f"^{display_word[0].lower()}"
-
-            t_weeks = (ts - now) / one_week
-            weight = math.exp(t_weeks)
-            weights[bigram] = weights.get(bigram, 0) + weight
+        )
 
-        return weights
+    def get_bigram_weights(self) -> dict[str, float]:
+        """Returns exp(-age in weeks) summed over the mistakes of each bigram."""
+        self.flush()
+        return read_bigram_weights(self.pool.connection())
 
     def get_recently_typed_ids(self) -> set[int]:
         cutoff = time.time() - (EXCLUDE_RECENT_MINUTES * 60)
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT word_id FROM lesson_words WHERE timestamp > ?", (cutoff,)
-            )
-            return {row[0] for row in cursor.fetchall()}
+        self.flush()
+        conn = self.pool.connection()
+        cursor = conn.execute(
+            "SELECT word_id FROM lesson_words WHERE timestamp > ?", (cutoff,)
+        )
+        return {row[0] for row in cursor.fetchall()}
 
-    def get_ema_stats(self) -> tuple[float | None, float | None, float | None]:
+    def get_ema_stats(self) -> EmaStats:
         """Returns (ema_cps, ema_accuracy, ema_arrhythmicity)."""
-        now = time.time()
-        one_week = 7 * 24 * 3600
+        conn = self.pool.connection()
+        row = conn.execute(f"SELECT {', '.join(EMA_COLUMNS)} FROM ema_stats").fetchone()
+        if row is None or row[0] == 0:
+            return None, None, None
 
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT id, timestamp, text_required, text_typed, duration FROM lessons WHERE duration IS NOT NULL"
-            )
-            rows = cursor.fetchall()
+        # The common decay factor exp((epoch - now) / week) cancels out
+        (
+            total_weight,
+            weighted_cps,
+            weighted_accuracy,
+            total_weight_arr,
+            weighted_arr,
+        ) = row
+        ema_arr = weighted_arr / total_weight_arr if total_weight_arr > 0 else None
+        return weighted_cps / total_weight, weighted_accuracy / total_weight, ema_arr
 
-            cursor.execute(
-                "SELECT lesson_id, timestamp FROM key_presses ORDER BY lesson_id, timestamp ASC"
-            )
-            kp_rows = cursor.fetchall()
 
-        if not rows:
-            return None, None, None
+class SnapshotTitles(Sequence[str]):
+    """The titles of a dictionary snapshot, decoded from its string table on access."""
 
-        # Group key presses
-        from collections import defaultdict
-
-        kp_map = defaultdict(list)
-        for lid, ts in kp_rows:
-            kp_map[lid].append(ts)
-
-        total_weight = 0.0
-        weighted_cps = 0.0
-        weighted_accuracy = 0.0
-        weighted_arrhythmicity = 0.0
-        total_weight_arr = 0.0
-
-        for lesson_id, ts, text_required, text_typed, duration in rows:
-            # Reconstruct accuracy
-            # We need to count mistakes in text_typed compared to text_required
-            # Similar to LessonSession logic
-            mistakes = 0
-            total_typed = 0
-            # text_typed may contain backspaces
-            processed_typed = ""
-            raw_typed_list = list(text_typed)
-            for char in raw_typed_list:
-                if char == "\b":
-                    if processed_typed:
-                        processed_typed = processed_typed[:-1]
-                else:
-                    total_typed += 1
-                    if len(processed_typed) < len(text_required):
-                        if char != text_required[len(processed_typed)]:
-                            mistakes += 1
-                    processed_typed += char
-
-            if total_typed == 0:
-                continue
+    def __init__(self, offsets: memoryview, data: memoryview) -> None:
+        self.offsets = offsets
+        self.data = data
 
-            accuracy = ((total_typed - mistakes) / total_typed) * 100
-            cps = len(processed_typed) / duration if duration > 0 else 0
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
 
-            # Arrhythmicity calculation
-            ts_ns_list = kp_map.get(lesson_id)
-            arrhythmicity = None
-            if ts_ns_list:
-                arrhythmicity = compute_arrhythmicity(ts_ns_list)
+    def __getitem__(self, position: int) -> str:
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        return str(
+            self.data[self.offsets[position] : self.offsets[position + 1]], "ascii"
+        )
 
-            t_weeks = (ts - now) / one_week
-            weight = math.exp(t_weeks)
 
-            total_weight += weight
-            weighted_cps += cps * weight
-            weighted_accuracy += accuracy * weight
+class BigramIndex:
+    """
+    In-memory copy of the ASCII word pool and its bigram_frequency postings,
+    loaded once so that lessons are sampled without any SQL.
 
-            if arrhythmicity is not None:
-                total_weight_arr += weight
-                weighted_arrhythmicity += arrhythmicity * weight
+    Words are addressed by their position in `word_ids`/`titles`, in word_id
+    order; postings are compact arrays of positions, and exclusions a
+    bytearray mask over them. A snapshot file holds the same arrays, which
+    from_snapshot maps into memory without copying them.
 
-        if total_weight == 0:
-            return None, None, None
+    Snapshot layout, after SNAPSHOT_HEADER, in native uint32s (little-endian):
+    word_ids, title offsets (words + 1), posting offsets (bigrams + 1),
+    postings; then the two ASCII bytes of every bigram, and the titles.
+    """
 
-        ema_arr = (
-            weighted_arrhythmicity / total_weight_arr if total_weight_arr > 0 else None
+    def __init__(
+        self,
+        word_ids: Sequence[int],
+        titles: Sequence[str],
+        postings: dict[str, Sequence[int]],
+    ) -> None:
+        self.word_ids = word_ids
+        self.titles = titles
+        self.postings = postings
+
+    @classmethod
+    def load(cls, conn: sqlite3.Connection) -> "BigramIndex":
+        word_ids = array("I")
+        titles: list[str] = []
+        for word_id, title in conn.execute(
+            "SELECT word_id, title FROM ascii_words ORDER BY word_id"
+        ):
+            word_ids.append(word_id)
+            titles.append(title)
+        position_of = {word_id: i for i, word_id in enumerate(word_ids)}
+        postings: dict[str, array] = {}
+
+        for bigram, word_id in conn.execute(
+            "SELECT bigram, word_id FROM bigram_frequency"
+        ):
+            position = position_of.get(word_id)
+            if position is None:
+                continue  # not an ASCII word
+            bigram_postings = postings.get(bigram)
+            if bigram_postings is None:
+                bigram_postings = postings[bigram] = array("I")
+            bigram_postings.append(position)
+        return cls(word_ids, titles, postings)
+
+    @classmethod
+    def from_snapshot(cls, path: str) -> "BigramIndex":
+        """
+        Maps a snapshot written by save_snapshot. Raises ValueError if it is
+        not one, is corrupt, or cannot be read in place on this machine.
+        """
+        with open(path, "rb") as f:
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        if len(view) < SNAPSHOT_HEADER.size:
+            raise ValueError(f"{path} is not a dictionary snapshot")
+        magic, words, bigrams, title_bytes, checksum = SNAPSHOT_HEADER.unpack_from(view)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a dictionary snapshot")
+        if sys.byteorder != "little" or array("I").itemsize != 4:
+            raise ValueError("Dictionary snapshots are read as little-endian uint32s")
+        if zlib.crc32(view[SNAPSHOT_HEADER.size :]) != checksum:
+            raise ValueError(f"{path} is corrupt")
+
+        offset = SNAPSHOT_HEADER.size
+
+        def section(size: int) -> memoryview:
+            nonlocal offset
+            offset += size
+            return view[offset - size : offset]
+
+        word_ids = section(4 * words).cast("I")
+        title_offsets = section(4 * (words + 1)).cast("I")
+        posting_offsets = section(4 * (bigrams + 1)).cast("I")
+        positions = section(4 * posting_offsets[-1]).cast("I")
+        keys = str(section(2 * bigrams), "ascii")
+        titles = SnapshotTitles(title_offsets, section(title_bytes))
+        postings = {
+            keys[2 * i : 2 * i + 2]: positions[
+                posting_offsets[i] : posting_offsets[i + 1]
+            ]
+            for i in range(bigrams)
+        }
+        return cls(word_ids, titles, postings)
+
+    def save_snapshot(self, path: str) -> None:
+        """
+        Writes the index to a snapshot file for from_snapshot. The file is
+        replaced atomically, so tutors mapping the old one keep working.
+        """
+        bigrams = sorted(self.postings)
+        title_data = "".join(self.titles).encode("ascii")
+        title_offsets = array("I", [0])
+        title_offsets.extend(itertools.accumulate(map(len, self.titles)))
+        posting_offsets = array("I", [0])
+        posting_offsets.extend(
+            itertools.accumulate(len(self.postings[bigram]) for bigram in bigrams)
         )
-        return weighted_cps / total_weight, weighted_accuracy / total_weight, ema_arr
+        positions = array("I")
+        for bigram in bigrams:
+            positions.extend(self.postings[bigram])
+        numbers = [array("I", self.word_ids), title_offsets, posting_offsets, positions]
+        if sys.byteorder == "big":
+            for section in numbers:
+                section.byteswap()
+        body = b"".join(
+            [
+                *(section.tobytes() for section in numbers),
+                "".join(bigrams).encode("ascii"),
+                title_data,
+            ]
+        )
+        header = SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC,
+            len(self.word_ids),
+            len(bigrams),
+            len(title_data),
+            zlib.crc32(body),
+        )
+        with open(path + ".tmp", "wb") as f:
+            f.write(header)
+            f.write(body)
+        os.replace(path + ".tmp", path)
+
+    def position(self, word_id: int) -> int | None:
+        """Returns the position of a word, or None if it is not in the index."""
+        position = bisect.bisect_left(self.word_ids, word_id)
+        if position < len(self.word_ids) and self.word_ids[position] == word_id:
+            return position
+        return None
+
+    def sample(self, bigram: str | None, excluded: bytearray) -> int | None:
+        """
+        Returns the position of a random non-excluded word containing `bigram`
+        (any word if None), or None if there is no such word.
+        """
+        if bigram is None:
+            candidates: range | array = range(len(self.word_ids))
+        else:
+            candidates = self.postings.get(bigram, array("I"))
+        if not candidates:
+            return None
+        for _ in range(RANDOM_SAMPLE_ATTEMPTS):
+            position = candidates[random.randrange(len(candidates))]
+            if not excluded[position]:
+                return position
+        remaining = [position for position in candidates if not excluded[position]]
+        return random.choice(remaining) if remaining else None
 
 
 class LessonGenerator:
     def __init__(
-        self, stats_manager: StatsManager, dict_db_path: str = DICTIONARY_DB
+        self,
+        stats_manager: StatsManager,
+        dict_db_path: str = DICTIONARY_DB,
+        *,
+        use_memory_index: bool = False,
+        snapshot_path: str | None = None,
     ) -> None:
         self.stats_manager = stats_manager
         self.dict_db_path = dict_db_path
+        self.use_memory_index = use_memory_index
+        # A snapshot of the dictionary to map instead of loading the index
+        # from it, used while it is at least as new as the dictionary
+        self.snapshot_path = snapshot_path
+        self._index: BigramIndex | None = None
+        # Exclusions for the in-memory index: a mask over its word positions and
+        # the word ids currently set in it
+        self._excluded_mask = bytearray()
+        self._masked_ids: set[int] = set()
+        # The dictionary is read-only, so leave its journal mode alone
+        self.pool = ConnectionPool(
+            dict_db_path, journal_mode=None, setup=self._setup_connection
+        )
+        self._ascii_word_count: int | None = None
+        # The connection and its PRAGMA data_version the caches above were
+        # last checked against
+        self._data_version: tuple[sqlite3.Connection, int] | None = None
+
+    def close(self) -> None:
+        self.pool.close()
+
+    def _drop_stale_caches(self) -> None:
+        """
+        Forgets what was cached from the dictionary once another connection
+        has changed it, e.g. scripts/create_bigram_index.py --refresh, so that
+        a running tutor samples the new words without a restart.
+        """
+        conn = self.pool.connection()
+        (data_version,) = conn.execute("PRAGMA data_version").fetchone()
+        # data_version is only comparable on the same connection
+        if self._data_version != (conn, data_version):
+            self._index = None
+            self._ascii_word_count = None
+            self._data_version = (conn, data_version)
+
+    @staticmethod
+    def _setup_connection(conn: sqlite3.Connection) -> None:
+        has_ascii_words = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ascii_words'"
+        ).fetchone()
+        if not has_ascii_words:
+            # Dictionaries built before ascii_words existed get a private copy
+            create_ascii_words(conn, temp=True)
+        # Words the current lesson must not use, kept in sync across lessons
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS excluded_words (word_id INTEGER PRIMARY KEY)"
+        )
+        conn.commit()
 
-    def generate_lesson(self) -> list[LessonWord]:
+    def _load_index(self) -> BigramIndex:
+        if self.snapshot_path is not None:
+            try:
+                if os.path.getmtime(self.snapshot_path) >= os.path.getmtime(
+                    self.dict_db_path
+                ):
+                    return BigramIndex.from_snapshot(self.snapshot_path)
+            except (OSError, ValueError):
+                pass  # missing or unreadable: the dictionary still works
+        return BigramIndex.load(self.pool.connection())
+
+    def _count_ascii_words(self, conn: sqlite3.Connection) -> int:
+        if self._ascii_word_count is None:
+            (max_ordinal,) = conn.execute(
+                "SELECT MAX(ordinal) FROM ascii_words"
+            ).fetchone()
+            self._ascii_word_count = max_ordinal or 0
+        return self._ascii_word_count
+
+    def generate_lesson(self, exclude_ids: set[int] | None = None) -> list[LessonWord]:
         bigram_weights = self.stats_manager.get_bigram_weights()
         recently_typed = self.stats_manager.get_recently_typed_ids()
+        if exclude_ids:
+            recently_typed |= exclude_ids
+        self._drop_stale_caches()
 
-        words: list[tuple[int, str]] = []
-        if not bigram_weights:
-            # Random sample if no mistakes
-            words = self._sample_random(WORDS_PER_LESSON, recently_typed)
-        else:
-            # Weighted sample
-            words = self._sample_weighted(
-                WORDS_PER_LESSON, bigram_weights, recently_typed
+        if self.use_memory_index:
+            return self._format_lesson(
+                self._sample_indexed(WORDS_PER_LESSON, bigram_weights, recently_typed)
             )
 
-        # If we couldn't get enough words (e.g. dictionary too small or all excluded)
-        if len(words) < WORDS_PER_LESSON:
-            more = self._sample_random(
-                WORDS_PER_LESSON - len(words), recently_typed | {w[0] for w in words}
-            )
-            words.extend(more)
+        with self.pool.connection() as conn:
+            self._sync_excluded_words(conn, recently_typed)
+
+            words: list[tuple[int, str]] = []
+            if not bigram_weights:
+                # Random sample if no mistakes
+                words = self._sample_random(conn, WORDS_PER_LESSON)
+            else:
+                # Weighted sample
+                words = self._sample_weighted(conn, WORDS_PER_LESSON, bigram_weights)
+
+            # If we couldn't get enough words (e.g. dictionary too small or all excluded)
+            if len(words) < WORDS_PER_LESSON:
+                words.extend(self._sample_random(conn, WORDS_PER_LESSON - len(words)))
 
         return self._format_lesson(words)
 
+    @staticmethod
+    def _sync_excluded_words(conn: sqlite3.Connection, word_ids: set[int]) -> None:
+        """
+        Brings the connection's excluded_words temp table in line with `word_ids`,
+        writing only the difference from what the previous lesson left there.
+        """
+        current = {row[0] for row in conn.execute("SELECT word_id FROM excluded_words")}
+        conn.executemany(
+            "DELETE FROM excluded_words WHERE word_id = ?",
+            [(word_id,) for word_id in current - word_ids],
+        )
+        conn.executemany(
+            "INSERT INTO excluded_words (word_id) VALUES (?)",
+            [(word_id,) for word_id in word_ids - current],
+        )
+
+    @staticmethod
+    def _take(
+        conn: sqlite3.Connection, rows: list[tuple[int, str]]
+    ) -> list[tuple[int, str]]:
+        """Excludes sampled words from the rest of the lesson."""
+        conn.executemany(
+            "INSERT OR IGNORE INTO excluded_words (word_id) VALUES (?)",
+            [(word_id,) for word_id, _ in rows],
+        )
+        return rows
+
     def _sample_random(
-        self, count: int, exclude_ids: set[int]
+        self, conn: sqlite3.Connection, count: int
     ) -> list[tuple[int, str]]:
-        with sqlite3.connect(self.dict_db_path) as conn:
-            cursor = conn.cursor()
-            # exclude non-acii
-            query = "SELECT word_id, title FROM articles WHERE LENGTH(title) = LENGTH(CAST(title AS BLOB))"
-            params: list[Any] = []
-            if exclude_ids:
-                placeholders = ",".join(["?"] * len(exclude_ids))
-                query += f" AND word_id NOT IN ({placeholders})"
-                params.extend(exclude_ids)
-            query += " ORDER BY RANDOM() LIMIT ?"
-            params.append(count)
-
-            cursor.execute(query, params)
-            return cursor.fetchall()
+        total = self._count_ascii_words(conn)
+        sampled: list[tuple[int, str]] = []
+
+        # Draw random ordinals; excluded words come back empty and are redrawn
+        attempts = count * RANDOM_SAMPLE_ATTEMPTS if total else 0
+        while len(sampled) < count and attempts:
+            attempts -= 1
+            row = conn.execute(
+                "SELECT word_id, title FROM ascii_words WHERE ordinal = ? AND word_id NOT IN (SELECT word_id FROM excluded_words)",
+                (random.randint(1, total),),
+            ).fetchone()
+            if row:
+                sampled.extend(self._take(conn, [row]))
+
+        if len(sampled) < count:
+            # Almost everything is excluded: pick from what is left directly
+            rows = conn.execute(
+                "SELECT word_id, title FROM ascii_words WHERE word_id NOT IN (SELECT word_id FROM excluded_words) ORDER BY RANDOM() LIMIT ?",
+                (count - len(sampled),),
+            ).fetchall()
+            sampled.extend(self._take(conn, rows))
+
+        return sampled
 
     def _sample_weighted(
-        self, count: int, bigram_weights: dict[str, float], exclude_ids: set[int]
+        self, conn: sqlite3.Connection, count: int, bigram_weights: dict[str, float]
     ) -> list[tuple[int, str]]:
         # Select bigrams to target
         bigrams = list(bigram_weights.keys())
         weights = list(bigram_weights.values())
 
         sampled_words: list[tuple[int, str]] = []
-        used_word_ids = set(exclude_ids)
 
         # We need 10 words. We'll pick bigrams proportional to weights.
         target_bigrams = random.choices(bigrams, weights=weights, k=count)
 
-        with sqlite3.connect(self.dict_db_path) as conn:
-            cursor = conn.cursor()
-            for bg in target_bigrams:
-                # Find a word containing this bigram that isn't excluded
-                query = """
-                    SELECT b.word_id, a.title 
-                    FROM bigram_frequency b
-                    JOIN articles a ON b.word_id = a.word_id
-                    WHERE b.bigram = ? 
-                    AND LENGTH(a.title) = LENGTH(CAST(a.title AS BLOB))
+        for bg in target_bigrams:
+            # Find a word containing this bigram that isn't excluded
+            row = conn.execute(
                 """
-                params: list[Any] = [bg]
-                if used_word_ids:
-                    placeholders = ",".join(["?"] * len(used_word_ids))
-                    query += f" AND b.word_id NOT IN ({placeholders})"
-                    params.extend(used_word_ids)
-                query += " ORDER BY RANDOM() LIMIT 1"
-
-                cursor.execute(query, params)
-                row = cursor.fetchone()
-                if row:
-                    sampled_words.append(row)
-                    used_word_ids.add(row[0])
-                else:
-                    # Fallback to random if no word found for this bigram
-                    fallback = self._sample_random(1, used_word_ids)
-                    if fallback:
-                        sampled_words.append(fallback[0])
-                        used_word_ids.add(fallback[0][0])
+                SELECT b.word_id, a.title
+                FROM bigram_frequency b
+                JOIN ascii_words a ON b.word_id = a.word_id
+                WHERE b.bigram = ?
+                AND b.word_id NOT IN (SELECT word_id FROM excluded_words)
+                ORDER BY RANDOM() LIMIT 1
+                """,
+                (bg,),
+            ).fetchone()
+            if row:
+                sampled_words.extend(self._take(conn, [row]))
+            else:
+                # Fallback to random if no word found for this bigram
+                sampled_words.extend(self._sample_random(conn, 1))
 
         return sampled_words
 
+    def _sample_indexed(
+        self, count: int, bigram_weights: dict[str, float], exclude_ids: set[int]
+    ) -> list[tuple[int, str]]:
+        if self._index is None:
+            self._index = self._load_index()
+            self._excluded_mask = bytearray(len(self._index.word_ids))
+            self._masked_ids = set()
+        index = self._index
+        excluded = self._excluded_mask
+
+        # Update the mask by the difference from the previous lesson
+        for word_ids, flag in (
+            (self._masked_ids - exclude_ids, 0),
+            (exclude_ids - self._masked_ids, 1),
+        ):
+            for word_id in word_ids:
+                position = index.position(word_id)
+                if position is not None:
+                    excluded[position] = flag
+        self._masked_ids = set(exclude_ids)
+
+        targets: list[str | None] = [None] * count
+        if bigram_weights:
+            targets = random.choices(
+                list(bigram_weights.keys()),
+                weights=list(bigram_weights.values()),
+                k=count,
+            )
+
+        sampled_words: list[tuple[int, str]] = []
+        for bg in targets:
+            position = index.sample(bg, excluded)
+            if position is None and bg is not None:
+                # Fallback to random if no word found for this bigram
+                position = index.sample(None, excluded)
+            if position is None:
+                break  # everything is excluded
+            word_id = index.word_ids[position]
+            excluded[position] = 1
+            self._masked_ids.add(word_id)
+            sampled_words.append((word_id, index.titles[position]))
+        return sampled_words
+
     def _format_lesson(self, words: list[tuple[int, str]]) -> list[LessonWord]:
         # words is list of (word_id, title)
         lesson_data: list[LessonWord] = []
@@ -404,6 +1461,120 @@ class LessonGenerator:
         return lesson_data
 
 
+class LessonPrefetcher:
+    """
+    Generates the next lesson, and the EMA snapshot shown with it, on a
+    background thread while the current lesson is being typed.
+
+    A prepared lesson goes stale when a mistake is recorded after it was
+    generated (the bigram weights changed), and its EMA snapshot when a lesson
+    is recorded. The thread redoes whatever is stale as soon as it is notified,
+    and `next_lesson` waits until both are up to date.
+    """
+
+    def __init__(self, lesson_generator: LessonGenerator) -> None:
+        self.lesson_generator = lesson_generator
+        self.stats_manager = lesson_generator.stats_manager
+        self._changed = self.stats_manager.changed
+        self._request = 0
+        self._wanted = False
+        self._exclude_ids: set[int] = set()
+        self._lesson: list[LessonWord] | None = None
+        self._lesson_key = (-1, -1)  # (request, mistakes revision) it was made for
+        self._ema: EmaStats = (None, None, None)
+        self._ema_revision = -1
+        self._error: Exception | None = None
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="lesson-prefetch", daemon=True
+        )
+        self._thread.start()
+
+    def request(self, exclude_ids: set[int]) -> None:
+        """Starts preparing a lesson that avoids `exclude_ids`, e.g. the current one."""
+        with self._changed:
+            self._request += 1
+            self._wanted = True
+            self._exclude_ids = set(exclude_ids)
+            self._changed.notify_all()
+
+    def next_lesson(self) -> tuple[list[LessonWord], EmaStats]:
+        """Returns the requested lesson, waiting until it is up to date."""
+        with self._changed:
+            if not self._wanted:
+                self.request(set())
+            self._changed.wait_for(
+                lambda: self._is_fresh() or self._error is not None or self._closed
+            )
+            if self._error is not None:
+                error, self._error = self._error, None
+                raise error
+            if self._lesson is None:
+                raise RuntimeError("lesson prefetcher is closed")
+            lesson, self._lesson = self._lesson, None
+            self._wanted = False
+            return lesson, self._ema
+
+    def close(self) -> None:
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        self._thread.join()
+
+    def _lesson_is_fresh(self) -> bool:
+        return self._lesson is not None and self._lesson_key == (
+            self._request,
+            self.stats_manager.mistakes_revision,
+        )
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._lesson_is_fresh()
+            and self._ema_revision == self.stats_manager.lessons_revision
+        )
+
+    def _run(self) -> None:
+        while True:
+            with self._changed:
+                self._changed.wait_for(
+                    lambda: (
+                        self._closed
+                        or (
+                            self._wanted
+                            and self._error is None
+                            and not self._is_fresh()
+                        )
+                    )
+                )
+                if self._closed:
+                    return
+                lesson_key = (self._request, self.stats_manager.mistakes_revision)
+                ema_revision = self.stats_manager.lessons_revision
+                make_lesson = not self._lesson_is_fresh()
+                exclude_ids = set(self._exclude_ids)
+
+            try:
+                lesson = (
+                    self.lesson_generator.generate_lesson(exclude_ids)
+                    if make_lesson
+                    else None
+                )
+                ema = self.stats_manager.get_ema_stats()
+            except Exception as e:  # noqa: BLE001
+                with self._changed:
+                    self._error = e
+                    self._changed.notify_all()
+                continue
+
+            with self._changed:
+                if lesson is not None and lesson_key[0] == self._request:
+                    self._lesson = lesson
+                    self._lesson_key = lesson_key
+                self._ema = ema
+                self._ema_revision = ema_revision
+                self._changed.notify_all()
+
+
 class LessonSession:
     def __init__(
         self,
@@ -415,13 +1586,21 @@ class LessonSession:
         self.stats_manager = stats_manager
         self.full_text = ""
         self.word_mapping: list[tuple[int, int, LessonWord]] = []
+        # Ordinal in word_mapping of the word each character belongs to, -1 for
+        # separators, and the start/end offsets of every word
+        self._word_of_char = array("i")
+        self._word_starts = array("I")
+        self._word_ends = array("I")
         self._build_mapping()
 
-        self.typed_text = ""
-        self.raw_typed_text = ""
+        # Growable character buffers; typed_text and raw_typed_text are their
+        # str views
+        self.typed_chars = array("w")
+        self.raw_typed_chars = array("w")
         self.completed_word_ids_ordered: list[int] = []
+        self._completed_word_ids: set[int] = set()
         self.start_time = start_time
-        self.key_presses: list[tuple[int, int]] = []
+        self._key_presses = KeyPressLog()
         self.mistakes_count = 0
         self.total_typed_count = 0
 
@@ -431,10 +1610,38 @@ class LessonSession:
             start = len(text)
             text += w.display
             end = len(text)
+            self._word_of_char.extend([len(self.word_mapping)] * (end - start))
+            self._word_of_char.extend([-1] * len(w.separator))
+            self._word_starts.append(start)
+            self._word_ends.append(end)
             self.word_mapping.append((start, end, w))
             text += w.separator
         self.full_text = text
 
+    @property
+    def typed_text(self) -> str:
+        return self.typed_chars.tounicode()
+
+    @typed_text.setter
+    def typed_text(self, text: str) -> None:
+        self.typed_chars = array("w", text)
+
+    @property
+    def raw_typed_text(self) -> str:
+        return self.raw_typed_chars.tounicode()
+
+    @raw_typed_text.setter
+    def raw_typed_text(self, text: str) -> None:
+        self.raw_typed_chars = array("w", text)
+
+    @property
+    def key_presses(self) -> KeyPressLog:
+        return self._key_presses
+
+    @key_presses.setter
+    def key_presses(self, key_presses: Iterable[tuple[int, int]]) -> None:
+        self._key_presses = KeyPressLog(key_presses)
+
     def handle_key(self, ch: int) -> bool:
         """Returns True if the lesson should continue, False if it's finished."""
         # first thing we measure the time
@@ -442,20 +1649,20 @@ class LessonSession:
         if self.start_time is None:
             self.start_time = time.time()
 
-        self.key_presses.append((len(self.raw_typed_text), ts))
+        self._key_presses.append((len(self.raw_typed_chars), ts))
 
         if ch in (curses.KEY_BACKSPACE, 127, 8):
-            self.raw_typed_text += "\b"
-            if self.typed_text:
-                self.typed_text = self.typed_text[:-1]
+            self.raw_typed_chars.append("\b")
+            if self.typed_chars:
+                self.typed_chars.pop()
             return True
 
         if ch < 0 or ch > 255:
             return True
 
         char_typed = chr(ch)
-        self.raw_typed_text += char_typed
-        current_idx = len(self.typed_text)
+        self.raw_typed_chars.append(char_typed)
+        current_idx = len(self.typed_chars)
 
         if current_idx >= len(self.full_text):
             return False
@@ -466,43 +1673,38 @@ class LessonSession:
         if char_typed != self.full_text[current_idx]:
             self.mistakes_count += 1
             # Find which word this belongs to
-            target_word: LessonWord | None = None
-            word_start = 0
-            for start, end, wo in self.word_mapping:
-                if start <= current_idx < end:
-                    target_word = wo
-                    word_start = start
-                    break
-
-            if target_word:
+            ordinal = self._word_of_char[current_idx]
+            if ordinal >= 0:
                 self.stats_manager.record_mistake(
-                    target_word.display, current_idx - word_start, char_typed
+                    self.lesson[ordinal].display,
+                    current_idx - self._word_starts[ordinal],
+                    char_typed,
                 )
 
-        self.typed_text += char_typed
+        self.typed_chars.append(char_typed)
 
         # Check for word completion
-        for _, end, wo in self.word_mapping:
-            if (
-                len(self.typed_text) == end
-                and wo.word_id not in self.completed_word_ids_ordered
-            ):
-                self.completed_word_ids_ordered.append(wo.word_id)
-                break
+        ordinal = self._word_of_char[current_idx]
+        if ordinal >= 0 and self._word_ends[ordinal] == current_idx + 1:
+            word_id = self.lesson[ordinal].word_id
+            if word_id not in self._completed_word_ids:
+                self._completed_word_ids.add(word_id)
+                self.completed_word_ids_ordered.append(word_id)
 
-        return len(self.typed_text) < len(self.full_text)
+        return len(self.typed_chars) < len(self.full_text)
 
     def get_stats(self) -> SessionStats:
         """Returns session statistics."""
         if self.start_time is None:
             raise ValueError("session was not started")
 
+        timestamps = self._key_presses.timestamps
         duration = (
-            (self.key_presses[-1][1] - self.key_presses[0][1]) / 1e9
-            if len(self.key_presses) > 1
+            (timestamps[-1] - timestamps[0]) / 1e9
+            if len(timestamps) > 1
             else time.time() - self.start_time
         )
-        cps = len(self.typed_text) / duration if duration > 0 else 0
+        cps = len(self.typed_chars) / duration if duration > 0 else 0
         accuracy = (
             (
                 (self.total_typed_count - self.mistakes_count)
@@ -513,19 +1715,129 @@ class LessonSession:
             else 100.0
         )
 
-        arrhythmicity = None
-        if self.key_presses:
-            timestamps = [ts for _, ts in self.key_presses]
-            arrhythmicity = compute_arrhythmicity(timestamps)
-
         return SessionStats(
             cps=cps,
             accuracy=accuracy,
             duration=duration,
-            arrhythmicity=arrhythmicity,
+            arrhythmicity=self._key_presses.intervals.stddev(),
         )
 
 
+class LessonRenderer:
+    """
+    Draws the lesson screen, repainting only what changed since the last frame.
+
+    A keystroke only changes the cells between the previous and the new cursor
+    position (usually the two of them) and the stats bar, so those are all that
+    is redrawn; the whole screen is repainted only after `invalidate`, e.g. on
+    KEY_RESIZE.
+
+    The layout is computed once per (text, width) and kept as two compact
+    row/column arrays, so a resize only recomputes it if the text width changed.
+    """
+
+    HELP = " [Ctrl-C] Next Lesson | [ESC] Exit "
+
+    def __init__(self, stdscr: Any) -> None:
+        self.stdscr = stdscr
+        # Attributes of the text cells as last painted
+        self._painted: list[int] = []
+        self._typed_length = 0
+        self._stats_str: str | None = None
+        self._full_repaint = True
+        self._layout_key: tuple[str, int] | None = None
+        self._rows = array("H")
+        self._cols = array("H")
+
+    def invalidate(self) -> None:
+        self._full_repaint = True
+
+    def draw(self, session: "LessonSession", stats_str: str) -> None:
+        stdscr = self.stdscr
+        typed_length = len(session.typed_chars)
+        if self._full_repaint:
+            stdscr.erase()
+            self._layout_screen(session.full_text)
+            self._painted = [-1] * len(session.full_text)
+            self._stats_str = None
+            changed: range = range(len(session.full_text))
+            self._full_repaint = False
+        else:
+            changed = range(
+                min(self._typed_length, typed_length),
+                min(max(self._typed_length, typed_length) + 1, len(self._painted)),
+            )
+        self._typed_length = typed_length
+
+        if stats_str != self._stats_str:
+            self._draw_stats(stats_str)
+
+        for i in changed:
+            self._paint_cell(session, i, typed_length)
+
+        if typed_length < len(self._rows):
+            try:
+                stdscr.move(
+                    self._y_offset + self._rows[typed_length],
+                    self._x_offset + self._cols[typed_length],
+                )
+            except curses.error:
+                pass
+        stdscr.refresh()
+
+    def _layout_screen(self, text: str) -> None:
+        h, w = self.stdscr.getmaxyx()
+        self._width = w
+        # Calculate wrapped lines
+        max_text_width = min(w - 4, 80)  # Bound width for readability
+        self._x_offset = (w - max_text_width) // 2
+        self._y_offset = h // 3
+        if self._layout_key != (text, max_text_width):
+            layout = calculate_layout(text, max_text_width)
+            self._rows = array("H", [y for y, _ in layout])
+            self._cols = array("H", [x for _, x in layout])
+            self._layout_key = (text, max_text_width)
+
+    def _draw_stats(self, stats_str: str) -> None:
+        stdscr = self.stdscr
+        self._stats_str = stats_str
+        try:
+            stdscr.move(0, 0)
+            stdscr.clrtoeol()
+            stdscr.addstr(
+                0, max(0, self._width - len(stats_str) - 2), stats_str, curses.A_REVERSE
+            )
+            stdscr.addstr(0, 0, self.HELP, curses.A_DIM)
+        except curses.error:
+            pass
+
+    def _paint_cell(self, session: "LessonSession", i: int, typed_length: int) -> None:
+        color = curses.color_pair(3)
+        if i < typed_length:
+            if session.typed_chars[i] == session.full_text[i]:
+                color = curses.color_pair(1)
+            else:
+                color = curses.color_pair(2)
+
+        # Highlight cursor position
+        attr = color
+        if i == typed_length:
+            attr |= curses.A_UNDERLINE | curses.A_BOLD
+
+        if attr == self._painted[i] or i >= len(self._rows):
+            return
+        self._painted[i] = attr
+        try:
+            self.stdscr.addch(
+                self._y_offset + self._rows[i],
+                self._x_offset + self._cols[i],
+                session.full_text[i],
+                attr,
+            )
+        except curses.error:
+            pass
+
+
 class TutorTUI:
     def __init__(
         self, stats_manager: StatsManager, lesson_generator: LessonGenerator
@@ -549,65 +1861,25 @@ class TutorTUI:
         stdscr.nodelay(False)  # noqa: FBT003
         curses.curs_set(1)
 
-        while True:
-            lesson = self.lesson_generator.generate_lesson()
-            if not self._run_lesson(stdscr, lesson):
-                break  # User exit or error
-
-    def _calculate_layout(self, text: str, max_width: int) -> list[tuple[int, int]]:
-        """Returns list of (y, x) relative to (0, 0) for each character."""
-        layout: list[tuple[int, int]] = []
-        current_y = 0
-        current_x = 0
-
-        # Split by spaces but keep the spaces
-        parts = re.split(r"(\s+)", text)
-
-        for part in parts:
-            if not part:
-                continue
-
-            part_len = len(part)
-
-            # If it's whitespace, it might trigger a wrap if it's not the start of a line
-            # but usually we just append it and let the NEXT word decide if it fits.
-            # Standard logic: if a word doesn't fit, it goes to next line.
-            # If the part is NOT whitespace and doesn't fit:
-            if not part.isspace():
-                if current_x + part_len > max_width and current_x > 0:
-                    current_y += 1
-                    current_x = 0
-
-            # If the word itself is longer than max_width, we must break it
-            if not part.isspace() and part_len > max_width:
-                for _ in part:
-                    layout.append((current_y, current_x))
-                    current_x += 1
-                    if current_x >= max_width:
-                        current_x = 0
-                        current_y += 1
-                continue
-
-            # Otherwise, just add it character by character
-            for _ in part:
-                # If we are at the end of the line and the character is whitespace,
-                # we don't necessarily HAVE to wrap before it, but for simplicity:
-                if current_x >= max_width:
-                    current_x = 0
-                    current_y += 1
-                layout.append((current_y, current_x))
-                current_x += 1
-
-        return layout
-
-    def _run_lesson(self, stdscr: Any, lesson: list[LessonWord]) -> bool:
+        prefetcher = LessonPrefetcher(self.lesson_generator)
+        try:
+            while True:
+                lesson, ema_stats = prefetcher.next_lesson()
+                # Prepare the next lesson while this one is typed
+                prefetcher.request({w.word_id for w in lesson})
+                if not self._run_lesson(stdscr, lesson, ema_stats):
+                    break  # User exit or error
+        finally:
+            prefetcher.close()
+
+    def _run_lesson(
+        self, stdscr: Any, lesson: list[LessonWord], ema_stats: EmaStats
+    ) -> bool:
         session = LessonSession(lesson, self.stats_manager)
-        ema_cps, ema_acc, ema_arr = self.stats_manager.get_ema_stats()
+        ema_cps, ema_acc, ema_arr = ema_stats
 
+        renderer = LessonRenderer(stdscr)
         while True:
-            stdscr.erase()
-            h, w = stdscr.getmaxyx()
-
             # Draw stats
             try:
                 stats = session.get_stats()
@@ -625,43 +1897,7 @@ class TutorTUI:
             if ema_arr is not None:
                 stats_str += f"| EMA Arr: {ema_arr:.3f}s "
 
-            try:
-                stdscr.addstr(
-                    0, max(0, w - len(stats_str) - 2), stats_str, curses.A_REVERSE
-                )
-                stdscr.addstr(0, 0, " [Ctrl-C] Next Lesson | [ESC] Exit ", curses.A_DIM)
-            except curses.error:
-                pass
-
-            # Calculate wrapped lines
-            max_text_width = min(w - 4, 80)  # Bound width for readability
-            x_offset = (w - max_text_width) // 2
-            y_offset = h // 3
-
-            layout = self._calculate_layout(session.full_text, max_text_width)
-
-            # Draw text with wrapping
-            for i, char in enumerate(session.full_text):
-                color = curses.color_pair(3)
-                if i < len(session.typed_text):
-                    if session.typed_text[i] == session.full_text[i]:
-                        color = curses.color_pair(1)
-                    else:
-                        color = curses.color_pair(2)
-
-                # Highlight cursor position
-                attr = color
-                if i == len(session.typed_text):
-                    attr |= curses.A_UNDERLINE | curses.A_BOLD
-
-                if i < len(layout):
-                    ry, rx = layout[i]
-                    try:
-                        stdscr.addch(y_offset + ry, x_offset + rx, char, attr)
-                    except curses.error:
-                        pass
-
-            stdscr.refresh()
+            renderer.draw(session, stats_str)
 
             try:
                 ch = stdscr.getch()
@@ -672,6 +1908,7 @@ class TutorTUI:
                 sys.exit(0)
 
             if ch == curses.KEY_RESIZE:
+                renderer.invalidate()
                 continue
 
             if not session.handle_key(ch):
@@ -700,10 +1937,18 @@ class TutorTUI:
 
 
 def main() -> None:
-    stats_mgr = StatsManager()
-    lesson_gen = LessonGenerator(stats_mgr)
+    stats_mgr = StatsManager(write_behind=True)
+    lesson_gen = LessonGenerator(
+        stats_mgr, use_memory_index=True, snapshot_path=DICTIONARY_SNAPSHOT
+    )
     tui = TutorTUI(stats_mgr, lesson_gen)
-    tui.run()
+    try:
+        tui.run()
+    finally:
+        # ESC leaves through sys.exit, so this also runs on a normal exit and
+        # flushes the mistakes still queued for writing
+        lesson_gen.close()
+        stats_mgr.close()
 
 
 if __name__ == "__main__":